@@ -12,21 +12,42 @@ bl_info = {
 
 if "bpy" in locals():
     import importlib
-    if "export_gms_vtx_buffer" in locals():
-        importlib.reload(export_gms_vtx_buffer)
-    if "conversions" in locals():
-        importlib.reload(conversions)
+    # Modules are reloaded after the modules they import from
+    for module_name in (
+            "array_forms",
+            "quantize",
+            "conversions",
+            "attributes",
+            "profiling",
+            "vertex_format",
+            "indexing",
+            "optimize",
+            "layout",
+            "writers",
+            "shape_keys",
+            "shaders",
+            "binary_description",
+            "json_description",
+            "textures",
+            "cache",
+            "export_gms_vtx_buffer",
+            "vectorized",
+            "changes",
+            "parallel",
+            "headless",
+            "panels",
+            ):
+        if module_name in locals():
+            importlib.reload(locals()[module_name])
 
 import bpy
 import sys
 import os
 import shutil
 from . import conversions
+from . import attributes
 from .panels import *
-from .shaders import (
-    get_shader_nodes_inputs,
-    get_shader_input_attr
-)
+from .shaders import get_shader_schema
 from bpy.props import (
     StringProperty,
     IntProperty,
@@ -47,34 +68,50 @@ from inspect import (
 # Supported properties for all shader nodes & initialisation function
 # Used to populate VertexAttributeType.data_property in case of a ShaderNode source
 # 
-# Also store original shader node per prop name because get_shader_input_attr()
-# doesn't work with ShaderNode, it needs a specific subclass.
+# Also store the shader nodes that have an input per prop name, for the description.
+# The type of each input (of the first shader node that has it) is stored as well,
+# so that looking up the format of an input doesn't need to create a node.
 supported_shader_node_properties = []
 original_shader_nodes_per_prop_name = dict()
+shader_input_types = dict()
 
-def init_shader_node_props():
-    """Populate the list with the unique set of all shader nodes' available inputs"""
+# Format of each type of shader node input. The default_value of an RGBA
+# input is four floats, so that's what it's written as (use e.g. unorm8
+# with 'BBBB' to write bytes instead)
+SHADER_INPUT_FMT = {'VALUE': 'f', 'INT': 'i', 'BOOLEAN': '?', 'VECTOR': 'fff', 'RGBA': 'ffff'}
+
+def init_shader_node_props(compute=True):
+    """Populate the list with the unique set of all shader nodes' available inputs
+
+    The inputs come from the schema that's cached on disk. If there's no
+    cached schema yet, it's only worked out if compute is True.
+    """
     
     global supported_shader_node_properties
+    if supported_shader_node_properties:
+        return      # Done before
+    schema = get_shader_schema(compute)
+    if schema is None:
+        return
+
     mapping = dict()
-    shader_nodes = get_shader_nodes_inputs()
-    for shader_node_name, inputs in shader_nodes.items():
-        for input in inputs:
-            identifier = input[0]
-            mapping[identifier] = input
+    original_shader_nodes_per_prop_name.clear()
+    shader_input_types.clear()
+    for shader_node_name, inputs in schema.items():
+        for name, description, type in inputs:
+            mapping[name] = (name, name, description)
+            shader_input_types.setdefault(name, type)
             
-            if identifier not in original_shader_nodes_per_prop_name:
-                original_shader_nodes_per_prop_name[identifier] = []
+            if name not in original_shader_nodes_per_prop_name:
+                original_shader_nodes_per_prop_name[name] = []
             
-            original_shader_nodes_per_prop_name[identifier].append(shader_node_name)
-    #supported_shader_node_properties = [v for v in mapping.values()]
-    supported_shader_node_properties = []
+            original_shader_nodes_per_prop_name[name].append(shader_node_name)
+    properties = []
     for val in mapping.values():
         # List shader nodes on which this input exists
         description = "{} ({})".format(val[1], ", ".join(original_shader_nodes_per_prop_name[val[0]]))
-        supported_shader_node_properties.append((val[0], val[1], description))
-    
-    #print(original_shader_nodes_per_prop_name)
+        properties.append((val[0], val[1], description))
+    supported_shader_node_properties = properties
 
 class VBXAddonPreferences(AddonPreferences):
     # this must match the add-on name, use '__package__'
@@ -92,7 +129,9 @@ class VertexAttributeType(bpy.types.PropertyGroup):
         """ Get the list of conversion functions """
         item_list = []
         item_list.append(("none", "None", "Don't convert the value"))
-        item_list.extend([(o[0], o[1].__name__, o[1].__doc__) for o in getmembers(conversions, isfunction)])
+        # Only the functions defined in conversions.py, not the ones it imports (e.g. array_form)
+        item_list.extend([(o[0], o[1].__name__, o[1].__doc__) for o in getmembers(conversions, isfunction)
+                          if o[1].__module__ == conversions.__name__])
         return item_list
 
     def properties_callback(self, context):
@@ -100,7 +139,12 @@ class VertexAttributeType(bpy.types.PropertyGroup):
         if source.startswith('ShaderNode'):
             # This item is for a shader node
             global supported_shader_node_properties
+            init_shader_node_props(compute=False)   # Can't create nodes while drawing, see register
             items = [prop for prop in supported_shader_node_properties]
+        elif source == attributes.ATTRIBUTE_SOURCE:
+            # The attributes of all meshes in the file, by name
+            items = [(name, name, "{} attribute on the {} domain".format(data_type, domain))
+                     for name, (domain, data_type) in sorted(attributes.layers(bpy.data.meshes).items())]
         else:
             # This item is for regular (Blender RNA) node
             props = getattr(bpy.types, self.data_source).bl_rna.properties
@@ -114,7 +158,7 @@ class VertexAttributeType(bpy.types.PropertyGroup):
             'MeshVertex',
             'MeshLoop',
             'MeshUVLoop',
-            #'ShapeKeyPoint',
+            #'ShapeKeyPoint',    # Written as morph targets instead, see the Shape Keys option
             #'VertexGroupElement',
             'Material',
             'MeshLoopColor',
@@ -128,6 +172,9 @@ class VertexAttributeType(bpy.types.PropertyGroup):
         for src in supported_sources:
             rna = getattr(bpy.types, src).bl_rna
             items.append((rna.identifier, rna.name, rna.description))
+
+        # Not an RNA type: any layer in Mesh.attributes, looked up by name
+        items.append((attributes.ATTRIBUTE_SOURCE, "Attribute", "A mesh attribute by name, on any domain (point, edge, face or corner), e.g. a second UV map"))
         
         return items
 
@@ -135,18 +182,16 @@ class VertexAttributeType(bpy.types.PropertyGroup):
         type = self.data_source
         attr = self.data_property
         if type.startswith('ShaderNode'):
-            global original_shader_nodes_per_prop_name
-            map_fmt = {'VALUE': 'f', 'INT': 'i', 'BOOLEAN': '?', 'VECTOR': 'fff', 'RGBA': 'BBBB'}   # Add shader node input types
-            # TODO Sometimes an attribute still appears to be not found on the usable type.
             # Note: it could be that identically named inputs on different shader node types 
             # are of different types. The exporter currently simply ignores this.
-            try:
-                type_usable = original_shader_nodes_per_prop_name[attr]
-                datatype = get_shader_input_attr(type_usable, attr, 'type') # Mapping for shader inputs
-                self.fmt = map_fmt[datatype]
-            except:
-                # Don't change anything if the above fails for any reason
-                pass
+            datatype = shader_input_types.get(attr)     # Mapping for shader inputs
+            if datatype in SHADER_INPUT_FMT:
+                self.fmt = SHADER_INPUT_FMT[datatype]
+            # Don't change anything otherwise
+        elif type == attributes.ATTRIBUTE_SOURCE:
+            layer = attributes.layers(bpy.data.meshes).get(attr)
+            if layer:
+                self.fmt = attributes.fmt_of(layer[1])
         else:
             att = getattr(bpy.types, type).bl_rna.properties[attr]
             map_fmt = {'FLOAT':'f','INT':'i', 'BOOLEAN':'?'}    # Mapping for RNA-based attributes
@@ -221,6 +266,87 @@ class ExportGMSVertexBuffer(bpy.types.Operator, ExportHelper):
         )
     )
 
+    engine : EnumProperty(
+        name="Engine",
+        description="How to read the mesh data and write it to the vertex buffer",
+        items=(('vectorized',"Vectorized", "Read attributes of all vertices at once, attributes that cannot be vectorized are written per loop"),
+               ('loop',"Per Loop", "Traverse the mesh loop by loop"),
+        )
+    )
+
+    index_buffer : EnumProperty(
+        name="Index Buffer",
+        description="Write identical vertices once and add an index buffer that refers to them",
+        items=(('none',"None", "Write every vertex of every triangle (unindexed)"),
+               ('auto',"Auto", "Write 16-bit indices when the object has at most 65536 unique vertices, 32-bit otherwise"),
+               ('u32',"32-bit", "Always write 32-bit indices"),
+        )
+    )
+
+    optimize_order : BoolProperty(
+        name="Optimize Triangle Order",
+        default=False,
+        description="Reorder the triangles for vertex cache reuse and less overdraw (uses the first frame's mesh)",
+    )
+
+    group_by_material : BoolProperty(
+        name="Group by Material",
+        default=False,
+        description="Write the triangles of each material slot together and add their ranges to the JSON file, to draw an object with one submit per material (uses the first frame's mesh)",
+    )
+
+    shape_keys : EnumProperty(
+        name="Shape Keys",
+        description="Write the shape keys of every object once, as morph targets with a position per vertex, and list them in the JSON file (no frames are baked for them)",
+        items=(('none',"None", "Don't write shape keys"),
+               ('absolute',"Absolute", "Write the positions of every shape key"),
+               ('relative',"Relative", "Write the offsets of every shape key from the basis"),
+        )
+    )
+
+    frame_layout : EnumProperty(
+        name="Frame Layout",
+        description="How to store the frames of animated objects",
+        items=(('full',"Full", "Write complete vertex records for every frame"),
+               ('split',"Split", "Write the attributes that don't change once and the others for every frame"),
+               ('delta',"Delta", "Write the first frame once, then the changes of the other attributes for every frame (floats as half floats)"),
+        )
+    )
+
+    skip_unchanged : BoolProperty(
+        name="Skip Unchanged Frames",
+        default=False,
+        description="Don't write frames that are the same as the previous frame, refer to that frame instead",
+    )
+
+    workers : IntProperty(
+        name="Worker Processes",
+        default=0,
+        min=0,
+        max=256,
+        description="Split the work over this many background Blender processes that load a copy of the file (0 or 1: export in this process)",
+    )
+
+    use_cache : BoolProperty(
+        name="Use Export Cache",
+        default=False,
+        description="Reuse the vertex data of objects and frames that were exported before with the same format and settings, from a cache on disk",
+    )
+
+    cache_directory : StringProperty(
+        name="Cache Directory",
+        description="Directory of the export cache (leave blank for the default, in Blender's user data files)",
+        default="",
+        subtype='DIR_PATH',
+    )
+
+    cache_size : IntProperty(
+        name="Cache Size (MB)",
+        default=1024,
+        min=1,
+        description="Maximum size of the export cache, the least recently used data is removed first",
+    )
+
     export_mesh_data : BoolProperty(
         name="Export Mesh Data",
         default=True,
@@ -249,6 +375,34 @@ class ExportGMSVertexBuffer(bpy.types.Operator, ExportHelper):
         )
     )
 
+    description_format : EnumProperty(
+        name="Format",
+        description="File format of the description",
+        items=(('json',"JSON", "Write a JSON file (.json)"),
+               ('binary',"Binary", "Write a compact binary file with the same structure (.vbxd), to read with buffer_load"),
+               ('both',"Both", "Write a JSON file and a binary file"),
+        )
+    )
+
+    json_max_depth : IntProperty(
+        name="Max Depth",
+        default=0,
+        min=0,
+        description="How deep to enter collections of properties, deeper ones are written as lists of names (0: no limit)",
+    )
+
+    json_properties : StringProperty(
+        name="Properties",
+        description="Comma separated list of the properties to write, e.g. 'name, Object.location' (leave blank for all)",
+        default="",
+    )
+
+    json_references : BoolProperty(
+        name="Use References",
+        default=False,
+        description="Write data that was written before as a reference ({\"$ref\": \"Type/name\"}) instead of a copy",
+    )
+
     apply_transforms : BoolProperty(
         name="Apply Transforms",
         default=True,
@@ -258,7 +412,20 @@ class ExportGMSVertexBuffer(bpy.types.Operator, ExportHelper):
     export_images : BoolProperty(
         name="Export Images",
         default=False,
-        description="Export texture images to same directory as result file",
+        description="Export the images of the materials' image texture nodes to the same directory as the result file (unchanged images are skipped)",
+    )
+
+    profile : BoolProperty(
+        name="Profile Export",
+        default=False,
+        description="Time the stages of the export per object and frame, report a summary and add the results to the JSON file (blmod/stats)",
+    )
+
+    profile_trace : StringProperty(
+        name="Trace File",
+        description="Also write the timings to this file as a Chrome trace (leave blank for none)",
+        default="",
+        subtype='FILE_PATH',
     )
 
     collection: StringProperty(
@@ -340,6 +507,7 @@ class ExportGMSVertexBuffer(bpy.types.Operator, ExportHelper):
         keywords = self.as_keywords(ignore=("check_existing", "filter_glob", "collection", "selection_only", "active_attribute_index"))
         keywords['object_selection'] = object_selection[:]
         keywords['scene'] = context.scene
+        keywords['report'] = self.report
         result = export_gms_vtx_buffer.export(**keywords)
         return result
 
@@ -491,8 +659,10 @@ def register():
     
     bpy.types.TOPBAR_MT_file_export.append(menu_func_export)
     
-    # Workaround. See: https://blenderartists.org/t/how-do-i-solve-this-error-restrictcontext/1445005/4
-    bpy.app.timers.register(init_shader_node_props, first_interval=0.1)
+    # The shader node inputs are loaded from the cached schema, or worked out once
+    # Blender allows it. Workaround. See: https://blenderartists.org/t/how-do-i-solve-this-error-restrictcontext/1445005/4
+    if not bpy.app.timers.is_registered(init_shader_node_props):
+        bpy.app.timers.register(init_shader_node_props, first_interval=0.1)
 
 
 def unregister():
@@ -0,0 +1,89 @@
+# Array forms of conversion functions
+#
+# A conversion function converts a single value. Its array form converts
+# a full column of values at once: a NumPy array with a row per vertex
+# (float64 or int64, a vector per row for array properties). It returns what
+# the conversion function returns for each of the values, as an array.
+#
+# Register an array form with the decorator:
+#
+# @array_form(lambda values: values * 2)
+# def double(val, ctx=None):
+#     return val * 2
+#
+# The array form gets the custom arguments as args, if there are any.
+# If it needs the context, register it with uses_context=True; it then gets
+# ctx as well, which only contains "scene" and "object".
+#
+# The exporter uses the array form if the function has one and falls back
+# to calling the function per value if it doesn't, or if the array form
+# raises a ValueError, IndexError, TypeError or KeyError.
+#
+
+import numpy as np
+
+# (array form, uses context) by conversion function name
+ARRAY_FORMS = {}
+
+
+def array_form(array_func, uses_context=False):
+    """Decorator that registers the array form of a conversion function"""
+    def register(func):
+        ARRAY_FORMS[func.__name__] = (array_func, uses_context)
+        return func
+    return register
+
+
+def lookup(func):
+    """Return the (array form, uses context) tuple of a conversion function, or None"""
+    func = getattr(func, 'func', func)      # Functions bound to custom arguments
+    return ARRAY_FORMS.get(func.__name__)
+
+
+def apply(func, values, ctx, args):
+    """Apply the array form of the conversion function to the values
+
+    Returns None if the function has no array form
+    """
+    form = lookup(func)
+    if form is None:
+        return None
+    array_func, uses_context = form
+
+    kwargs = {}
+    if uses_context:
+        kwargs['ctx'] = ctx
+    if args is not None:
+        kwargs['args'] = args
+    return array_func(values, **kwargs)
+
+
+def scalars(values):
+    """Require a single value per vertex"""
+    if values.ndim != 1:
+        raise ValueError("Expected an array of scalars")
+    return values
+
+
+def vectors(values):
+    """Require a vector per vertex"""
+    if values.ndim != 2:
+        raise ValueError("Expected an array of vectors")
+    return values
+
+
+def to_int(values):
+    """Truncate towards zero like int() does"""
+    if values.dtype.kind == 'f':
+        if not np.all(np.isfinite(values)):
+            raise ValueError("Cannot convert infinity or NaN to integer")
+        values = np.trunc(values)
+    return values.astype(np.int64)
+
+
+def constant(values, value):
+    """Repeat a constant (number or list of numbers) for every vertex"""
+    value = np.asarray(value)
+    if value.dtype.kind not in 'biuf' or value.ndim > 1:
+        raise TypeError("Expected a number or a list of numbers")
+    return np.repeat(value[np.newaxis], len(values), axis=0)
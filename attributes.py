@@ -0,0 +1,84 @@
+# Mesh attributes source
+#
+# The 'Attribute' source reads any layer in Mesh.attributes by name, e.g. a
+# second UV map for lightmaps, a named color attribute or baked ambient
+# occlusion stored by geometry nodes. The layer is looked up once per mesh
+# and read with foreach_get, then its values are spread to the loops
+# according to the domain it's stored on (POINT, EDGE, FACE or CORNER).
+#
+# Attribute names are unique within a mesh, whatever their domain, so the
+# name is enough to find the layer. The domain and data type it turned out
+# to have are written to the JSON description.
+#
+
+import numpy as np
+
+ATTRIBUTE_SOURCE = 'Attribute'
+
+# (property of the layer's items, number of components, foreach_get data type) by data type
+DATA_TYPES = {
+    'FLOAT': ('value', 1, np.float32),
+    'INT': ('value', 1, np.int32),
+    'INT8': ('value', 1, np.int32),
+    'BOOLEAN': ('value', 1, np.bool_),
+    'FLOAT2': ('vector', 2, np.float32),
+    'INT32_2D': ('value', 2, np.int32),
+    'FLOAT_VECTOR': ('vector', 3, np.float32),
+    'FLOAT_COLOR': ('color', 4, np.float32),
+    'BYTE_COLOR': ('color', 4, np.float32),
+    'QUATERNION': ('value', 4, np.float32),
+}
+
+DOMAINS = ('POINT', 'EDGE', 'FACE', 'CORNER')
+
+
+def layers(meshes):
+    """Return a dict of name -> (domain, data type) of the attributes that can be exported"""
+    result = {}
+    for m in meshes:
+        for layer in m.attributes:
+            if layer.name.startswith(".") or layer.data_type not in DATA_TYPES or layer.domain not in DOMAINS:
+                continue    # Internal (e.g. ".select_vert") or unsupported
+            result.setdefault(layer.name, (layer.domain, layer.data_type))
+    return result
+
+
+def fmt_of(data_type):
+    """Return the format that writes all components of the data type as is"""
+    prop, width, dtype = DATA_TYPES[data_type]
+    return {np.float32: 'f', np.int32: 'i', np.bool_: '?'}[dtype] * width
+
+
+def loop_index(m, domain):
+    """Return the index of the domain's element that every loop belongs to"""
+    if domain == 'POINT':
+        index = np.empty(len(m.loops), dtype=np.int32)
+        m.loops.foreach_get('vertex_index', index)
+    elif domain == 'EDGE':
+        index = np.empty(len(m.loops), dtype=np.int32)
+        m.loops.foreach_get('edge_index', index)
+    elif domain == 'FACE':
+        loop_total = np.empty(len(m.polygons), dtype=np.int32)
+        m.polygons.foreach_get('loop_total', loop_total)
+        index = np.repeat(np.arange(len(m.polygons)), loop_total)
+    else:
+        index = slice(None)
+    return index
+
+
+def read_attribute(m, name):
+    """Return the values of the attribute per loop (float64 or int64, a row per loop),
+    None if the mesh has no attribute with that name that can be exported"""
+    layer = m.attributes.get(name)
+    if layer is None or layer.data_type not in DATA_TYPES or layer.domain not in DOMAINS:
+        return None
+
+    prop, width, dtype = DATA_TYPES[layer.data_type]
+    values = np.empty(len(layer.data) * width, dtype=dtype)
+    layer.data.foreach_get(prop, values)
+    if width > 1:
+        values = values.reshape(-1, width)
+    values = values[loop_index(m, layer.domain)]
+
+    # Continue with the types that Python itself would use
+    return values.astype(np.float64 if values.dtype.kind == 'f' else np.int64)
@@ -0,0 +1,271 @@
+# Export benchmarks
+#
+# Generates synthetic scenes of increasing size and exports each of them
+# with every bundled preset and engine, then reports the throughput and
+# peak memory of each run as JSON, so that results can be compared
+# between commits.
+#
+# Every benchmark runs in a process of its own, so that the peak memory
+# (max_rss) is that of the benchmark and not of the largest one before it.
+#
+# Run with bpy as a module (no GPU needed):
+#
+# python benchmarks/bench_export.py --output results.json
+#
+# or in a background Blender session:
+#
+# blender -b --factory-startup --python benchmarks/bench_export.py -- --output results.json
+#
+
+import argparse
+import glob
+import importlib
+import json
+import os
+import resource
+import subprocess
+import sys
+import tempfile
+import tracemalloc
+from time import perf_counter
+
+import bpy
+import numpy as np
+
+BENCHMARK_DIR = os.path.dirname(os.path.abspath(__file__))
+ADDON_DIR = os.path.dirname(BENCHMARK_DIR)
+
+# Triangle counts of the subdivided grids
+GRID_SIZES = [1000, 10000, 100000, 1000000]
+
+# Name of the collection the generated objects are put in
+COLLECTION = "Benchmark"
+
+# Start of the line with the result of a benchmark that runs in a process of its own
+RESULT_PREFIX = "BENCHMARK_RESULT "
+
+
+def import_addon():
+    """Import the add-on by its directory name"""
+    addon_path, package = os.path.split(ADDON_DIR)
+    if addon_path not in sys.path:
+        sys.path.insert(0, addon_path)
+    return importlib.import_module(package + ".headless")
+
+
+def reset_scene():
+    bpy.ops.wm.read_factory_settings(use_empty=True)
+    collection = bpy.data.collections.new(COLLECTION)
+    bpy.context.scene.collection.children.link(collection)
+    return collection
+
+
+def grid_mesh(name, triangles):
+    """Create a flat grid of quads that triangulates to about the given number of triangles,
+    with a UV map and a vertex color layer"""
+    n = max(1, int(round((triangles / 2) ** 0.5)))
+    x, y = np.meshgrid(np.linspace(-1, 1, n + 1), np.linspace(-1, 1, n + 1))
+    co = np.column_stack((x.ravel(), y.ravel(), np.sin(x * 4).ravel() * 0.1))
+
+    rows, cols = np.meshgrid(np.arange(n), np.arange(n), indexing='ij')
+    first = (rows * (n + 1) + cols).ravel()
+    quads = np.column_stack((first, first + 1, first + n + 2, first + n + 1))
+
+    m = bpy.data.meshes.new(name)
+    m.vertices.add(len(co))
+    m.vertices.foreach_set('co', co.astype(np.float32).ravel())
+    m.loops.add(quads.size)
+    m.loops.foreach_set('vertex_index', quads.astype(np.int32).ravel())
+    m.polygons.add(len(quads))
+    m.polygons.foreach_set('loop_start', np.arange(0, quads.size, 4, dtype=np.int32))
+    m.update()
+
+    uv = m.uv_layers.new()
+    uv.data.foreach_set('uv', (co[quads.ravel(), :2] * 0.5 + 0.5).astype(np.float32).ravel())
+    color = m.color_attributes.new("Col", 'BYTE_COLOR', 'CORNER')
+    color.data.foreach_set('color', np.tile(np.float32([1, 0.5, 0.25, 1]), quads.size))
+    m.color_attributes.active_color = color     # Exported as MeshLoopColor
+    return m
+
+
+def add_object(collection, name, mesh, location=(0, 0, 0)):
+    obj = bpy.data.objects.new(name, mesh)
+    obj.location = location
+    collection.objects.link(obj)
+    return obj
+
+
+def scene_grid(triangles):
+    """A single subdivided grid"""
+    collection = reset_scene()
+    add_object(collection, "Grid", grid_mesh("Grid", triangles))
+    return {}
+
+
+def scene_many_objects(count=500, triangles=200):
+    """Many small objects"""
+    collection = reset_scene()
+    for i in range(count):
+        add_object(collection, "Object{}".format(i), grid_mesh("Mesh{}".format(i), triangles), (i % 25, i // 25, 0))
+    return {}
+
+
+def scene_many_materials(count=64, nodes=50, triangles=20000):
+    """A grid with many materials that have large node trees"""
+    collection = reset_scene()
+    m = grid_mesh("Grid", triangles)
+    for i in range(count):
+        mat = bpy.data.materials.new("Material{}".format(i))
+        mat.use_nodes = True
+        tree = mat.node_tree
+        previous = tree.nodes["Principled BSDF"]
+        for j in range(nodes):
+            node = tree.nodes.new('ShaderNodeMixRGB' if j % 2 else 'ShaderNodeMath')
+            node.location = (-200 * (j + 1), 0)
+            tree.links.new(node.outputs[0], previous.inputs[0])
+            previous = node
+        m.materials.append(mat)
+    material_index = np.arange(len(m.polygons), dtype=np.int32) % count
+    m.polygons.foreach_set('material_index', material_index)
+    add_object(collection, "Grid", m)
+    return {}
+
+
+def scene_animated(frames=250, triangles=10000):
+    """An object with keyframed transforms over a long frame range"""
+    collection = reset_scene()
+    obj = add_object(collection, "Grid", grid_mesh("Grid", triangles))
+    scene = bpy.context.scene
+    scene.frame_start, scene.frame_end = 1, frames
+    for frame in (1, frames):
+        obj.location.z = frame / frames
+        obj.rotation_euler.z = frame / frames * 6.28
+        obj.keyframe_insert('location', frame=frame)
+        obj.keyframe_insert('rotation_euler', frame=frame)
+    return {'frame_option': 'all'}
+
+
+def scenes(max_triangles):
+    """The (name, triangles, setup function) of every benchmark scene"""
+    for size in GRID_SIZES:
+        if size <= max_triangles:
+            yield "grid_{}".format(size), size, lambda size=size: scene_grid(size)
+    yield "many_objects", 500 * 200, scene_many_objects
+    yield "many_materials", 20000, scene_many_materials
+    yield "animated_250", 10000 * 250, scene_animated
+
+
+def git_revision():
+    try:
+        return subprocess.check_output(["git", "rev-parse", "HEAD"], cwd=ADDON_DIR, text=True,
+                                       stderr=subprocess.DEVNULL).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def exported_vertices():
+    """Return the number of vertices written per frame, 3 per triangle of the
+    evaluated meshes (a quad is written as 6 vertices)"""
+    depsgraph = bpy.context.evaluated_depsgraph_get()
+    total = 0
+    for obj in bpy.data.collections[COLLECTION].all_objects:
+        if obj.type != 'MESH':
+            continue
+        m = obj.evaluated_get(depsgraph).data
+        loop_total = np.empty(len(m.polygons), dtype=np.int32)
+        m.polygons.foreach_get('loop_total', loop_total)
+        total += 3 * int(np.sum(loop_total - 2))
+    return total
+
+
+def run(headless, preset, settings, directory):
+    """Export the benchmark collection once, return the measurements"""
+    output = os.path.join(directory, "bench.vbx")
+    tracemalloc.start()
+    start = perf_counter()
+    headless.export(preset, output, COLLECTION, **settings)
+    seconds = perf_counter() - start
+    current, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    # Presets can have a custom extension, so everything but the description counts
+    size = sum(os.path.getsize(os.path.join(root, name)) for root, dirs, files in os.walk(directory)
+               for name in files if not name.endswith(".json"))
+    vertices = exported_vertices()
+    scene = bpy.context.scene
+    frames = len(range(scene.frame_start, scene.frame_end + 1, scene.frame_step)) if settings.get('frame_option') == 'all' else 1
+    return {
+        "seconds": seconds,
+        "bytes": size,
+        "vertices_per_second": vertices * frames / seconds if seconds else 0,
+        "bytes_per_second": size / seconds if seconds else 0,
+        "peak_python_memory": peak,
+    }
+
+
+def run_benchmark(scene_name, max_triangles, preset, engine, repeat):
+    """Set up the scene and run a single benchmark, in the current process
+
+    Returns the result of the fastest run, with the peak memory of the process
+    """
+    headless = import_addon()
+    setup = {name: setup for name, triangles, setup in scenes(max_triangles)}[scene_name]
+    settings = dict(setup(), engine=engine)
+    with tempfile.TemporaryDirectory() as directory:
+        runs = [run(headless, preset, settings, directory) for i in range(repeat)]
+    return dict(min(runs, key=lambda r: r["seconds"]),
+                max_rss=resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024)
+
+
+def run_in_process(scene_name, max_triangles, preset, engine, repeat):
+    """Run a single benchmark in a new process, return its result"""
+    args = ["--run", json.dumps([scene_name, max_triangles, preset, engine, repeat])]
+    if bpy.app.binary_path:
+        command = [bpy.app.binary_path, "-b", "--factory-startup", "--python", os.path.abspath(__file__), "--"] + args
+    else:
+        command = [sys.executable, os.path.abspath(__file__)] + args     # bpy as a module
+    output = subprocess.run(command, check=True, stdout=subprocess.PIPE, text=True).stdout
+    result = [line for line in output.splitlines() if line.startswith(RESULT_PREFIX)][-1]
+    return json.loads(result[len(RESULT_PREFIX):])
+
+
+def main(argv):
+    parser = argparse.ArgumentParser(prog="bench_export.py", description="Benchmark the vertex buffer export")
+    parser.add_argument("--output", help="File to write the results to (default: print them)")
+    parser.add_argument("--max-triangles", type=int, default=max(GRID_SIZES), help="Skip grids that are bigger")
+    parser.add_argument("--engines", default="vectorized,loop", help="Comma separated list of engines to run")
+    parser.add_argument("--repeat", type=int, default=1, help="Number of runs per benchmark, the fastest one counts")
+    parser.add_argument("--run", help=argparse.SUPPRESS)    # A single benchmark, in the process that's started for it
+    args = parser.parse_args(argv)
+
+    if args.run:
+        print(RESULT_PREFIX + json.dumps(run_benchmark(*json.loads(args.run))))
+        return 0
+
+    presets = sorted(glob.glob(os.path.join(ADDON_DIR, "presets", "*.py")))
+    results = []
+    for name, triangles, setup in scenes(args.max_triangles):
+        for preset in presets:
+            for engine in args.engines.split(","):
+                result = dict(run_in_process(name, args.max_triangles, preset, engine, args.repeat),
+                              scene=name, triangles=triangles,
+                              preset=os.path.basename(preset), engine=engine)
+                print("{scene:<16} {preset:<24} {engine:<10} {seconds:8.3f} s {vertices_per_second:14.0f} vertices/s".format(**result))
+                results.append(result)
+
+    report = {
+        "revision": git_revision(),
+        "blender_version": bpy.app.version[:],
+        "results": results,
+    }
+    if args.output:
+        with open(args.output, "w") as f_out:
+            json.dump(report, f_out, indent=1)
+    else:
+        print(json.dumps(report, indent=1))
+    return 0
+
+
+if __name__ == "__main__":
+    argv = sys.argv[sys.argv.index("--") + 1:] if "--" in sys.argv else sys.argv[1:]
+    sys.exit(main(argv))
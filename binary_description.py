@@ -0,0 +1,205 @@
+# Binary description file (.vbxd)
+#
+# A compact alternative to the JSON description with the exact same
+# structure (the same keys, e.g. blmod/mesh_data/ranges), that GameMaker can
+# load with buffer_load and read with buffer_peek, without parsing text.
+#
+# Everything is little-endian. The file starts with a header:
+#
+# 0   4 bytes  magic "VBXD"
+# 4   u32      version (1)
+# 8   u32      offset of the root node
+# 12  u32      offset of the string table
+#
+# Every node starts at a multiple of 8 bytes with a u32 type:
+#
+# 0 NULL        u32 type, u32 unused
+# 1 FALSE       u32 type, u32 unused
+# 2 TRUE        u32 type, u32 unused
+# 3 INT         u32 type, i32 value
+# 4 FLOAT       u32 type, u32 unused, f64 value
+# 5 STRING      u32 type, u32 string index
+# 6 LIST        u32 type, u32 count, count x u32 node offset
+# 7 MAP         u32 type, u32 count, count x (u32 key string index, u32 node offset)
+# 8 F32_ARRAY   u32 type, u32 count, count x f32
+# 9 I32_ARRAY   u32 type, u32 count, count x i32
+# 10 F64_ARRAY  u32 type, u32 count, count x f64
+# 11 INT64      u32 type, u32 unused, i64 value
+#
+# Lists of numbers are written as typed arrays, as f32 if that's exact.
+# The string table is a u32 count, followed by a u32 offset per string.
+# A string is a u32 length in bytes, followed by its UTF-8 bytes and a 0.
+#
+# To see the contents as JSON: python binary_description.py file.vbxd
+#
+
+import json
+import sys
+from array import array
+from struct import (
+    Struct,
+    pack,
+    unpack_from,
+    )
+
+MAGIC = b"VBXD"
+VERSION = 1
+
+NULL, FALSE, TRUE, INT, FLOAT, STRING, LIST, MAP, F32_ARRAY, I32_ARRAY, F64_ARRAY, INT64 = range(12)
+
+HEADER = Struct("<4sIII")
+I32_MIN, I32_MAX = -2**31, 2**31 - 1
+
+
+def _typed(values, typecode):
+    """Return the values as a little-endian array"""
+    result = array(typecode, values)
+    if sys.byteorder != 'little':
+        result.byteswap()
+    return result
+
+
+def _array_type(values):
+    """Return the typed array node type for a list of numbers, None if it isn't one"""
+    if not values or not all(type(v) in (int, float) for v in values):
+        return None
+    if all(type(v) is int for v in values):
+        return I32_ARRAY if all(I32_MIN <= v <= I32_MAX for v in values) else None
+    return F32_ARRAY if list(array('f', values)) == list(values) else F64_ARRAY
+
+
+class BinaryWriter:
+    """Writes nodes to a binary description file
+
+    Children are written before their parent, so that a parent can refer to
+    their offsets. Lists and maps take the offsets of nodes that were written
+    before, so they can be built up one item (e.g. one datablock) at a time.
+    """
+
+    def __init__(self, f):
+        self.f = f
+        self.strings = {}
+        self.pos = 0
+        self._write(HEADER.pack(MAGIC, VERSION, 0, 0))
+
+    def _write(self, data):
+        self.f.write(data)
+        self.pos += len(data)
+
+    def _align(self, size=8):
+        padding = -self.pos % size
+        if padding:
+            self._write(bytes(padding))
+
+    def string(self, value):
+        """Return the index of the string in the string table"""
+        index = self.strings.get(value)
+        if index is None:
+            index = self.strings[value] = len(self.strings)
+        return index
+
+    def _node(self, type, data=b""):
+        self._align()
+        offset = self.pos
+        self._write(pack("<I", type) + data)
+        return offset
+
+    def value(self, value):
+        """Write a json-compatible value, return its offset"""
+        if value is None:
+            return self._node(NULL, bytes(4))
+        if value is True or value is False:
+            return self._node(TRUE if value else FALSE, bytes(4))
+        if isinstance(value, int):
+            if I32_MIN <= value <= I32_MAX:
+                return self._node(INT, pack("<i", value))
+            return self._node(INT64, pack("<Iq", 0, value))
+        if isinstance(value, float):
+            return self._node(FLOAT, pack("<Id", 0, value))
+        if isinstance(value, str):
+            return self._node(STRING, pack("<I", self.string(value)))
+        if isinstance(value, dict):
+            return self.map((key, self.value(item)) for key, item in value.items())
+        values = list(value)
+        array_type = _array_type(values)
+        if array_type is not None:
+            typecode = {F32_ARRAY: 'f', I32_ARRAY: 'i', F64_ARRAY: 'd'}[array_type]
+            return self._node(array_type, pack("<I", len(values)) + _typed(values, typecode).tobytes())
+        return self.list(self.value(item) for item in values)
+
+    def list(self, offsets):
+        """Write a list of nodes that were written before, given their offsets"""
+        offsets = list(offsets)
+        return self._node(LIST, pack("<I", len(offsets)) + _typed(offsets, 'I').tobytes())
+
+    def map(self, items):
+        """Write a map, given (key, offset) pairs of nodes that were written before"""
+        entries = []
+        for key, offset in items:
+            entries.extend((self.string(key), offset))
+        return self._node(MAP, pack("<I", len(entries) // 2) + _typed(entries, 'I').tobytes())
+
+    def close(self, root):
+        """Write the string table and complete the header"""
+        self._align(4)
+        table = self.pos
+        strings = [None] * len(self.strings)
+        for string, index in self.strings.items():
+            strings[index] = string.encode("utf-8")
+        offsets, pos = [], table + 4 + 4 * len(strings)
+        for data in strings:
+            offsets.append(pos)
+            pos += 4 + len(data) + 1
+            pos += -pos % 4
+        self._write(pack("<I", len(strings)) + _typed(offsets, 'I').tobytes())
+        for data in strings:
+            self._write(pack("<I", len(data)) + data + b"\0")
+            self._align(4)
+        self.f.seek(0)
+        self.f.write(HEADER.pack(MAGIC, VERSION, root, table))
+
+
+def load(data):
+    """Return the contents of a binary description as json-compatible values"""
+    magic, version, root, table = HEADER.unpack_from(data)
+    if magic != MAGIC:
+        raise ValueError("Not a binary description file")
+    if version != VERSION:
+        raise ValueError("Unsupported binary description version {}".format(version))
+
+    def string(index):
+        offset, = unpack_from("<I", data, table + 4 + 4 * index)
+        length, = unpack_from("<I", data, offset)
+        return data[offset+4:offset+4+length].decode("utf-8")
+
+    def node(offset):
+        type, = unpack_from("<I", data, offset)
+        if type in (NULL, FALSE, TRUE):
+            return (None, False, True)[type]
+        if type == INT:
+            return unpack_from("<i", data, offset + 4)[0]
+        if type == FLOAT:
+            return unpack_from("<d", data, offset + 8)[0]
+        if type == INT64:
+            return unpack_from("<q", data, offset + 8)[0]
+        if type == STRING:
+            return string(unpack_from("<I", data, offset + 4)[0])
+        count, = unpack_from("<I", data, offset + 4)
+        if type == LIST:
+            return [node(child) for child in unpack_from("<{}I".format(count), data, offset + 8)]
+        if type == MAP:
+            entries = unpack_from("<{}I".format(2 * count), data, offset + 8)
+            return {string(entries[i]): node(entries[i+1]) for i in range(0, len(entries), 2)}
+        typecode = {F32_ARRAY: 'f', I32_ARRAY: 'i', F64_ARRAY: 'd'}.get(type)
+        if typecode is None:
+            raise ValueError("Unknown node type {} at offset {}".format(type, offset))
+        return list(unpack_from("<{}{}".format(count, typecode), data, offset + 8))
+
+    return node(root)
+
+
+if __name__ == "__main__":
+    # Dump a binary description as JSON, for debugging
+    with open(sys.argv[1], "rb") as f_desc:
+        json.dump(load(f_desc.read()), sys.stdout, indent=1)
+    print()
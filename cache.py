@@ -0,0 +1,95 @@
+# Persistent export cache
+#
+# Stores the packed vertex records of an object at a frame on disk, keyed by
+# the object's fingerprint (see changes.py) combined with everything else the
+# bytes depend on: the vertex format, the conversion functions' code and the
+# export settings. Exporting data that was exported before (in any file, any
+# earlier run) then reads the bytes instead of packing them again.
+#
+# The records are stored before interpolation offsets and triangle reordering
+# are applied, so an entry doesn't depend on the frame range.
+# The least recently used entries are removed when the cache grows too big.
+#
+
+import hashlib
+import json
+import os
+
+# Change this whenever the way vertex records are written changes
+CACHE_VERSION = 1
+
+
+def default_directory():
+    """Return the cache directory in Blender's user data files"""
+    import bpy
+    return bpy.utils.user_resource('DATAFILES', path="vbx_cache")
+
+
+class ExportCache:
+    """A size-bounded, least recently used cache of packed frames in a directory"""
+
+    def __init__(self, directory, max_size, specs, reverse_loop, apply_transforms):
+        self.directory = directory or default_directory()
+        self.max_size = max_size
+        self.hits = self.misses = 0
+
+        # The code of the conversion functions is part of the key, so editing them invalidates entries
+        from . import array_forms, conversions, quantize
+        salt = hashlib.blake2b()
+        salt.update(json.dumps([CACHE_VERSION, specs, reverse_loop, apply_transforms]).encode())
+        for module in (conversions, array_forms, quantize):
+            with open(module.__file__, "rb") as f_code:
+                salt.update(f_code.read())
+        self.salt = salt.digest()
+
+    def path(self, digest):
+        key = hashlib.blake2b(self.salt + digest).hexdigest()
+        return os.path.join(self.directory, key[:2], key)
+
+    def get(self, digest, size):
+        """Return the stored frame with the given fingerprint, None if there is none of that size"""
+        path = self.path(digest)
+        try:
+            with open(path, "rb") as f:
+                data = bytearray(f.read())
+        except OSError:
+            data = None
+        if data is None or len(data) != size:
+            self.misses += 1
+            return None
+        os.utime(path)      # Most recently used
+        self.hits += 1
+        return data
+
+    def put(self, digest, data):
+        """Store the frame with the given fingerprint"""
+        path = self.path(digest)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        temp_path = "{}.{}.tmp".format(path, os.getpid())
+        with open(temp_path, "wb") as f:
+            f.write(data)
+        os.replace(temp_path, path)     # Other exports never see a partial entry
+
+    def evict(self):
+        """Remove the least recently used entries until the cache fits in max_size bytes"""
+        if not os.path.isdir(self.directory):
+            return
+        entries = []
+        for root, dirs, files in os.walk(self.directory):
+            for name in files:
+                path = os.path.join(root, name)
+                try:
+                    stat = os.stat(path)
+                except OSError:
+                    continue    # Removed by another export meanwhile
+                entries.append((stat.st_mtime, stat.st_size, path))
+
+        total = sum(size for mtime, size, path in entries)
+        for mtime, size, path in sorted(entries):
+            if total <= self.max_size:
+                break
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+            total -= size
@@ -0,0 +1,71 @@
+# Change detection
+#
+# A fingerprint of everything an object's vertex records are made of
+# (the mesh data that the vertex format reads, the constant sources and
+# the object's transform), so that frames in which nothing changed
+# can reuse the previous frame instead of packing it again.
+#
+
+import hashlib
+
+import numpy as np
+
+from . import array_forms
+from .export_gms_vtx_buffer import constant_templates
+from .vectorized import (
+    corner_indices,
+    mesh_sources,
+    read_column,
+    )
+from .vertex_format import CONSTANT_SOURCES
+
+
+def fingerprint(scene, obj, m, compiled, reverse_loop, apply_transforms):
+    """Return a digest of the data that the object's vertex records are written from
+
+    Returns None if part of that data can't be read in full, e.g. when a
+    conversion function might look up other values through its context
+    """
+    corners = corner_indices(m, reverse_loop)
+    if corners is None:
+        return None
+    sources = mesh_sources(m, *corners)
+
+    digest = hashlib.blake2b()
+    for corner_index in corners:
+        digest.update(corner_index.tobytes())
+
+    columns = set()
+    for source, prop, occurrence in compiled.occurrences():
+        offset, attr_blen, fmt, index, func, args = occurrence
+        if source in CONSTANT_SOURCES:
+            continue
+        if source not in sources:
+            return None
+        if func != None:
+            # Functions without an array form may read anything through ctx,
+            # array forms that use the context may depend on the frame
+            form = array_forms.lookup(func)
+            if form is None or form[1]:
+                return None
+        if sources[source] is not None:
+            columns.add((source, prop))
+
+    for source, prop in sorted(columns):
+        collection, corner_index = sources[source]
+        values = read_column(collection, source, prop, slice(None))
+        if values is None:
+            return None
+        digest.update(values.tobytes())
+
+    if compiled.has_constants:
+        material_index = np.empty(len(m.polygons), dtype=np.int32)
+        m.polygons.foreach_get('material_index', material_index)
+        digest.update(material_index.tobytes())
+        for template, template_columns in constant_templates(scene, obj, m, compiled.desc):
+            digest.update(template.tobytes())
+
+    if apply_transforms:
+        digest.update(np.array(obj.matrix_world, dtype=np.float64).tobytes())
+
+    return digest.digest()
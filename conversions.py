@@ -12,29 +12,64 @@
 # ctx["polygon"]: a reference to the polygon currently being exported
 # ctx["loop"]: a reference to the loop currently being exported
 #
+# Values of Scene, Object, Material and ShaderNode sources are looked up
+# once per frame (per material slot), so for these ctx only contains
+# "scene" and "object", looking up "polygon" or "loop" raises an error.
+#
 # args is a dictionary (map) constructed from
 # the property set in the vertex attribute
 # This should be a valid JSON string
 #
+# A function can also register an array form that converts all values
+# at once, see array_forms.py. Functions without one are called per value.
+#
 
 from mathutils import *
+import numpy as np
+from .array_forms import (
+    array_form,
+    constant,
+    scalars,
+    to_int,
+    vectors,
+    )
+from .quantize import (
+    decode_octahedral,
+    decode_snorm,
+    decode_unorm,
+    octahedral,
+    octahedral_value,
+    pack_10_10_10_2,
+    per_component,
+    quantized,
+    snorm,
+    snorm_value,
+    unorm,
+    unorm_value,
+    unpack_10_10_10_2,
+    )
 
+@array_form(lambda a: to_int(scalars(a) * 255))
 def float_to_byte(val, ctx=None):
     """Convert value in range [0,1] to an integer value in range [0,255]"""
     return int(val*255)
 
+@array_form(lambda a: to_int(vectors(a) * 255))
 def vec_to_bytes(val, ctx=None):
     """Convert a list of values in range [0,1] to a list of integer values in range [0,255]"""
     return [int(x*255) for x in val]
 
+@array_form(lambda a: np.column_stack((vectors(a)[:, 0], 1 - a[:, 1])))
 def invert_v(val, ctx=None):
     """Invert the v coordinate of a (u,v) pair"""
     return [val[0],1-val[1]]
 
+@array_form(lambda a: np.column_stack((vectors(a)[:, 0], -a[:, 1], a[:, 2])))
 def invert_y(val, ctx=None):
     """Invert the y coordinate of a vector"""
     return [val[0],-val[1],val[2]]
 
+@array_form(lambda a: np.column_stack((vectors(a)[:, 0], -a[:, 1], -a[:, 2])))
 def invert_y_and_z(val, ctx=None):
     """Invert the y and z coordinate of a vector"""
     return [val[0],-val[1],-val[2]]
@@ -51,14 +86,58 @@ def mat_name_to_index(val, ctx=None):
     """Return the index of the material with the given name in bpy.data.materials"""
     return bpy.data.materials.find(val)
 
+@array_form(lambda a: 0.0 + vectors(a)[:, 0] * 0.0 + a[:, 1] * 0.0 + a[:, 2])
 def dot_with_light_vector(val, ctx=None):
     """Return the dot product of val with a constant vector"""
     return val.dot(Vector([0, 0, 1]))
 
+@array_form(lambda a, args={}: constant(a, args["a"]))
 def constant_from_map(val, ctx=None, args={}):
     """Return a constant value from the custom arguments provided, val is unused"""
     return args["a"]
 
+@array_form(lambda a, ctx: constant(a, ctx["scene"].frame_current), uses_context=True)
 def value_from_context(val, ctx):
     """Return the current frame in the scene as an example"""
     return ctx["scene"].frame_current
+
+# Quantized encodings (see quantize.py), write them with the format in the docstring
+
+@quantized('unorm8', lambda a: unorm(a, 8), lambda a: decode_unorm(a, 8))
+def unorm8(val, ctx=None):
+    """Convert value(s) in range [0,1] to normalized unsigned bytes (B)"""
+    return per_component(lambda x: unorm_value(x, 8), val)
+
+@quantized('unorm16', lambda a: unorm(a, 16), lambda a: decode_unorm(a, 16))
+def unorm16(val, ctx=None):
+    """Convert value(s) in range [0,1] to normalized unsigned shorts (H), e.g. UVs"""
+    return per_component(lambda x: unorm_value(x, 16), val)
+
+@quantized('snorm8', lambda a: snorm(a, 8), lambda a: decode_snorm(a, 8))
+def snorm8(val, ctx=None):
+    """Convert value(s) in range [-1,1] to normalized signed bytes (b)"""
+    return per_component(lambda x: snorm_value(x, 8), val)
+
+@quantized('snorm16', lambda a: snorm(a, 16), lambda a: decode_snorm(a, 16))
+def snorm16(val, ctx=None):
+    """Convert value(s) in range [-1,1] to normalized signed shorts (h)"""
+    return per_component(lambda x: snorm_value(x, 16), val)
+
+@quantized('octahedral_snorm16', lambda a: snorm(octahedral(a), 16),
+           lambda a: decode_octahedral(decode_snorm(a, 16)))
+def octahedral_snorm16(val, ctx=None):
+    """Encode a unit vector (e.g. a normal) as two normalized signed shorts (hh)"""
+    return [snorm_value(x, 16) for x in octahedral_value(val)]
+
+@quantized('octahedral_unorm8', lambda a: unorm(octahedral(a) * 0.5 + 0.5, 8),
+           lambda a: decode_octahedral(decode_unorm(a, 8) * 2 - 1))
+def octahedral_unorm8(val, ctx=None):
+    """Encode a unit vector (e.g. a normal) as two normalized unsigned bytes (BB)"""
+    return [unorm_value(x * 0.5 + 0.5, 8) for x in octahedral_value(val)]
+
+@quantized('snorm_10_10_10_2', pack_10_10_10_2, unpack_10_10_10_2)
+def snorm_10_10_10_2(val, ctx=None):
+    """Pack a vector in range [-1,1] in 10 bits per component and a 4th component in range [0,1] in 2 bits (I)"""
+    x, y, z = (snorm_value(c, 10) & 0x3FF for c in val[:3])
+    w = unorm_value(val[3], 2) if len(val) > 3 else 0
+    return x | y << 10 | z << 20 | w << 30
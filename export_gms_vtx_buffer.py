@@ -1,8 +1,36 @@
 import bpy
-import json
+from contextlib import contextmanager
+from functools import partial
+from types import SimpleNamespace
 from struct import (
     pack,
     )
+from .attributes import (
+    ATTRIBUTE_SOURCE,
+    read_attribute,
+    )
+from .vertex_format import compile_format
+from .indexing import (
+    INDEX_DTYPE,
+    deduplicate,
+    index_format,
+    )
+from .layout import detect_layout
+from .optimize import (
+    group_sizes,
+    group_triangles,
+    optimize_indexed,
+    optimize_unindexed,
+    reorder_records,
+    )
+from .writers import (
+    BatchWriter,
+    FrameStream,
+    )
+from .profiling import (
+    NO_PROFILER,
+    Profiler,
+    )
 
 # Mesh-like objects (the ones that can be converted to mesh)
 MESHLIKE_TYPES = {'MESH', 'CURVE', 'SURFACE', 'FONT', 'META'}
@@ -12,183 +40,312 @@ BUFFER_TYPE = {
     'f': "buffer_f32",
     'B': "buffer_u8",
     '?': 'buffer_bool',
-    'i': 'buffer_u32'
+    'i': 'buffer_u32',
+    'H': 'buffer_u16',
+    'I': 'buffer_u32',
+    'b': 'buffer_s8',
+    'h': 'buffer_s16',
+    'e': 'buffer_f16',
 }
 
 
+@contextmanager
+def triangulated(objects):
+    """Add a triangulate modifier to the objects for as long as the context lasts
+
+    Adding the modifiers once (instead of per object per frame) avoids
+    invalidating the depsgraph over and over again
+    """
+    modifiers = {}
+    try:
+        for obj in objects:
+            mod_tri = obj.modifiers.new('triangulate_for_export', 'TRIANGULATE')
+            mod_tri.quad_method = 'FIXED'   # FIX #20 Guarantee consistent triangulation between frames
+            mod_tri.ngon_method = 'CLIP'    # This one too
+            modifiers[obj] = mod_tri
+        yield
+    finally:
+        for obj, mod_tri in modifiers.items():
+            obj.modifiers.remove(mod_tri)
+
+
+def evaluated_mesh(obj, depsgraph):
+    """Important: use to_mesh_clear to free the mesh generated by this function"""
+    return obj.evaluated_get(depsgraph).to_mesh()
+
+
 def triangulated_mesh_from_object(obj):
     """Important: use to_mesh_clear to free the mesh generated by this function"""
-    mod_tri = obj.modifiers.new('triangulate_for_export', 'TRIANGULATE')
-    mod_tri.quad_method = 'FIXED'   # FIX #20 Guarantee consistent triangulation between frames
-    mod_tri.ngon_method = 'CLIP'    # This one too
-    depsgraph = bpy.context.evaluated_depsgraph_get()
-    obj_eval = obj.evaluated_get(depsgraph)
-    m = obj_eval.to_mesh()
-    obj.modifiers.remove(mod_tri)
-    return m
-
-
-def write_object_ba(scene, obj, desc, ba, frame, reverse_loop, apply_transforms):
-    """Traverse the object's mesh data at the given frame and write to the
-    appropriate bytearray in ba using the description data structure provided"""
-    desc, vertex_format_bytesize = desc
+    with triangulated([obj]):
+        return evaluated_mesh(obj, bpy.context.evaluated_depsgraph_get())
+
+
+def write_object_ba(scene, obj, m, compiled, ba, reverse_loop, apply_transforms, engine='loop', profiler=NO_PROFILER):
+    """Write the object's evaluated mesh m at the current frame to the
+    bytearray ba using the compiled vertex format provided
+
+    The mesh is freed afterwards
+    """
+    if len(m.loops) * compiled.stride != len(ba):
+        obj.to_mesh_clear()
+        raise ValueError("The number of vertices of object '{}' changes between frames".format(obj.name))
 
-    def fetch_attribs(desc, node, ba, byte_pos, frame, ctx=None):
-        """"Fetch the attribute values from the given node and place in ba at byte_pos"""
-        id = node.bl_rna.identifier
-        id_to_lookup = 'ShaderNode' if id.startswith('ShaderNode') else id
-        if id in desc or id.startswith('ShaderNode'):
-            for prop, occurrences in desc[id_to_lookup].items():                # Property name and occurrences in bytedata
-                for offset, attr_blen, fmt, index, func, args in occurrences:   # Each occurrence's data (tuple assignment!)
-                    ind = byte_pos + offset
-                    if id.startswith('ShaderNode'):
-                        # Write the input's default value for shader nodes
-                        if prop in node.inputs:
-                            val = node.inputs[prop].default_value
-                        else:
-                            val = 0 if len(fmt) ==  1 else [0] * len(fmt)
-                    else:
-                        # Simply lookup the property on the node
-                        val = getattr(node, prop)
-                    
-                    # Pass through pre-process function
-                    if func != None:
-                        if args == "":
-                            val = func(val, ctx=ctx)
-                        else:
-                            val = func(val, ctx=ctx, args=json.loads(args))
-                    
-                    # Pack as bytes according to the chosen data type
-                    # and write to correct position in the right bytearray
-                    val_bin = pack(fmt, val) if len(fmt) == 1 else pack(fmt, *val[:len(fmt)])
-                    ba[frame-index][ind:ind+attr_blen] = val_bin
-
-    m = triangulated_mesh_from_object(obj)
     if apply_transforms:
         # axis conversion probably needs to go here, too...
-        m.transform(obj.matrix_world)
-
-    # Setup context dict
-    ctx = {}
-    ctx['scene'] = scene
-    ctx['object'] = obj
-
-    # Traverse the Blender data, starting at the polygons
-    ba_pos = 0
-    for poly in m.polygons:
-        ctx['polygon'] = poly
-        iter = reversed(poly.loop_indices) if reverse_loop else poly.loop_indices
-        for li in iter:
-            fetch_attribs(desc, scene, ba, ba_pos, frame, ctx)
-            fetch_attribs(desc, obj, ba, ba_pos, frame, ctx)
-
-            fetch_attribs(desc, poly, ba, ba_pos, frame, ctx)
-
-            if m.materials:
-                mat = m.materials[poly.material_index]
-                fetch_attribs(desc, mat, ba, ba_pos, frame, ctx)
-
-                if mat.use_nodes:
-                    # Simply loop through all of this material's nodes
-                    # (TODO could be optimized quite a bit..)
-                    for node in mat.node_tree.nodes:
-                        fetch_attribs(desc, node, ba, ba_pos, frame, ctx)
-                
-
-            loop = m.loops[li]
-            ctx['loop'] = loop
-            fetch_attribs(desc, loop, ba, ba_pos, frame, ctx)
-
-            if m.uv_layers:
-                uvs = m.uv_layers.active.data
-                uv = uvs[loop.index]                                # Use active uv layer
-                fetch_attribs(desc, uv, ba, ba_pos, frame, ctx)
-
-            vtx_colors = m.vertex_colors.active
-            if vtx_colors:
-                vtx_col = vtx_colors.data[li]                       # Vertex colors
-                fetch_attribs(desc, vtx_col, ba, ba_pos, frame, ctx)
-
-            vertex = m.vertices[loop.vertex_index]
-            fetch_attribs(desc, vertex, ba, ba_pos, frame, ctx)
-
-            # We wrote a full vertex, so we can now increment the bytearray position by the vertex format size
-            ba_pos += vertex_format_bytesize
+        with profiler.stage('transform', obj):
+            m.transform(obj.matrix_world)
+
+    with profiler.stage('pack', obj):
+        if engine == 'vectorized':
+            from . import vectorized
+            vectorized.write_mesh_ba(scene, obj, m, compiled, ba, reverse_loop, profiler)
+        else:
+            write_mesh_ba(scene, obj, m, compiled, ba, reverse_loop, profiler)
 
     obj.to_mesh_clear()
 
 
-def construct_ds(obj, attr):
-    """ Constructs the data structure required to move through the attributes of a given object
+def convert_value(val, func, ctx):
+    """Pass the value through the pre-process function, if there is one"""
+    return val if func == None else func(val, ctx=ctx)
 
-    """
-    from struct import calcsize
 
-    description, offset = {}, 0
-    for a in attr:
-        ident, atn, format, fo, func, args = a
+def pack_value(fmt, val):
+    """Pack the value as bytes according to the chosen data type"""
+    return pack(fmt, val) if len(fmt) == 1 else pack(fmt, *val[:len(fmt)])
+
 
-        if ident not in description:
-            description[ident] = {}
-        dct_obj = description[ident]
+class ConstantContext(dict):
+    """The ctx of the conversion functions of constant sources
+
+    There's no single polygon or loop that their values belong to, so it
+    only has 'scene' and 'object'. Looking up anything else fails with an
+    error that says so.
+    """
 
-        if atn not in dct_obj:
-            dct_obj[atn] = []
-        lst_attr = dct_obj[atn]
+    def __init__(self, attribute, **values):
+        super().__init__(**values)
+        self.attribute = attribute
 
-        attrib_bytesize = calcsize(format)
+    def __missing__(self, key):
+        raise KeyError("The conversion function of {} can't use ctx[{!r}]: Scene, Object, Material and ShaderNode "
+                       "values are converted once per material slot, their ctx only has {}".format(
+                       self.attribute, key, ", ".join(repr(key) for key in self)))
 
-        lst_attr.append((offset, attrib_bytesize, format, fo, func, args))
-        offset += attrib_bytesize
 
-    return (description, offset)
+def constant_templates(scene, obj, m, desc):
+    """Resolve the constant sources once and pack them in a vertex record per material slot
 
+    Returns a (template, columns) tuple per material slot (a single one if the mesh
+    has no materials), columns contains the indices of the bytes that are filled in
+    """
+    import numpy as np
+    desc, vertex_format_bytesize = desc
 
-def construct_ba(obj, desc, frame_range):
-    """Construct the required bytearrays to store vertex data
-       for the given object for the given number of frames"""
-    m = triangulated_mesh_from_object(obj)
-    no_verts = len(m.polygons) * 3
-    obj.to_mesh_clear()         # TODO Any easier way to get number of vertices??
+    def fill(template, columns, source, props, get_value):
+        for prop, occurrences in props.items():
+            ctx = ConstantContext("{}.{}".format(source, prop), scene=scene, object=obj)
+            for offset, attr_blen, fmt, index, func, args in occurrences:
+                val = convert_value(get_value(prop, fmt), func, ctx)
+                template[offset:offset+attr_blen] = pack_value(fmt, val)
+                columns.update(range(offset, offset+attr_blen))
+
+    def node_input(node):
+        def get_value(prop, fmt):
+            # Write the input's default value for shader nodes
+            if prop in node.inputs:
+                return node.inputs[prop].default_value
+            return 0 if len(fmt) == 1 else [0] * len(fmt)
+        return get_value
+
+    base, base_columns = bytearray(vertex_format_bytesize), set()
+    fill(base, base_columns, 'Scene', desc.get('Scene', {}), lambda prop, fmt: getattr(scene, prop))
+    fill(base, base_columns, 'Object', desc.get('Object', {}), lambda prop, fmt: getattr(obj, prop))
+
+    templates = []
+    for mat in m.materials or [None]:
+        template, columns = bytearray(base), set(base_columns)
+        if mat:
+            fill(template, columns, 'Material', desc.get('Material', {}), lambda prop, fmt: getattr(mat, prop))
+            if mat.use_nodes and 'ShaderNode' in desc:
+                # Every shader node writes its value, so the last one in the tree wins
+                for node in mat.node_tree.nodes:
+                    if node.bl_rna.identifier.startswith('ShaderNode'):
+                        fill(template, columns, 'ShaderNode', desc['ShaderNode'], node_input(node))
+        templates.append((np.frombuffer(template, dtype=np.uint8), np.array(sorted(columns), dtype=np.int64)))
+    return templates
+
+
+def write_constants(scene, obj, m, desc, ba):
+    """Stamp the constant sources' values into every vertex record in ba"""
+    import numpy as np
+    templates = constant_templates(scene, obj, m, desc)
     desc, vertex_format_bytesize = desc
-    ba = [bytearray([0] * no_verts * vertex_format_bytesize) for f in frame_range]
-    return ba, no_verts
+    records = np.frombuffer(ba, dtype=np.uint8).reshape(-1, vertex_format_bytesize)
+
+    if len(templates) == 1:
+        template, columns = templates[0]
+        records[:, columns] = template[columns]
+        return
+
+    no_polys = len(m.polygons)
+    material_index = np.empty(no_polys, dtype=np.int32)
+    loop_total = np.empty(no_polys, dtype=np.int32)
+    m.polygons.foreach_get('material_index', material_index)
+    m.polygons.foreach_get('loop_total', loop_total)
+    material_index = np.repeat(material_index, loop_total)     # Per loop
+    for slot, (template, columns) in enumerate(templates):
+        rows = np.flatnonzero(material_index == slot)
+        records[np.ix_(rows, columns)] = template[columns]
+
+
+def write_mesh_ba(scene, obj, m, compiled, ba, reverse_loop, profiler=NO_PROFILER):
+    """Traverse the (triangulated) mesh loop by loop and write the values
+    at the current frame to the bytearray ba"""
+    uvs = m.uv_layers.active.data if m.uv_layers else None  # Use active uv layer
+    vtx_colors = m.vertex_colors.active                     # Vertex colors
+    sources = ['MeshPolygon', 'MeshLoop', 'MeshVertex']
+    if uvs:
+        sources.append('MeshUVLoop')
+    if vtx_colors:
+        sources.append('MeshLoopColor')
+
+    # Mesh attributes are read in full once, per loop
+    attribute_values = {}
+    if ATTRIBUTE_SOURCE in compiled.description:
+        for name in compiled.description[ATTRIBUTE_SOURCE]:
+            values = read_attribute(m, name)
+            if values is not None:
+                attribute_values[name] = values.tolist()
+        # Attributes that the mesh doesn't have aren't written, like a missing UV map
+        compiled = compiled.subset((source, prop, occurrence[0]) for source, prop, occurrence in compiled.occurrences()
+                                   if source != ATTRIBUTE_SOURCE or prop in attribute_values)
+        sources.append(ATTRIBUTE_SOURCE)
+
+    vertex_struct, getters = compiled.writer(sources)
+    if getters:
+        # Setup context dict
+        ctx = {}
+        ctx['scene'] = scene
+        ctx['object'] = obj
+
+        # Traverse the Blender data, starting at the polygons
+        pack_into = vertex_struct.pack_into
+        needed = {source for source, prop, count, func in getters}
+        nodes = {}
+        ba_pos = 0
+        for poly in m.polygons:
+            ctx['polygon'] = poly
+            nodes['MeshPolygon'] = poly
+            iter = reversed(poly.loop_indices) if reverse_loop else poly.loop_indices
+            for li in iter:
+                loop = m.loops[li]
+                ctx['loop'] = loop
+                nodes['MeshLoop'] = loop
+                if 'MeshUVLoop' in needed:
+                    nodes['MeshUVLoop'] = uvs[li]
+                if 'MeshLoopColor' in needed:
+                    nodes['MeshLoopColor'] = vtx_colors.data[li]
+                if 'MeshVertex' in needed:
+                    nodes['MeshVertex'] = m.vertices[loop.vertex_index]
+                if ATTRIBUTE_SOURCE in needed:
+                    nodes[ATTRIBUTE_SOURCE] = SimpleNamespace(**{name: values[li] for name, values in attribute_values.items()})
+
+                values = []
+                for source, prop, count, func in getters:
+                    val = getattr(nodes[source], prop)
+                    if func != None:
+                        val = func(val, ctx=ctx)
+                    if count == 1:
+                        values.append(val)
+                    else:
+                        values.extend(val[:count])
+
+                # Write the full vertex at once
+                # (interpolation offsets are handled afterwards by FrameStream)
+                pack_into(ba, ba_pos, *values)
+                ba_pos += compiled.stride
+
+    # The constant values come last, the struct writes padding in their place
+    if compiled.has_constants:
+        with profiler.stage('constants', obj):
+            write_constants(scene, obj, m, compiled.desc, ba)
+
+
+def file_names(objects):
+    """Return a dict of object -> name to use in file names, unique among the objects
+
+    Different object names can have the same clean name (e.g. "Cube.001" and
+    "Cube_001"), those get a number added. Names that only differ in case
+    count as the same, for file systems that ignore case.
+    """
+    names, used = {}, set()
+    for obj in objects:
+        base = bpy.path.clean_name(obj.name)
+        name, number = base, 1
+        while name.lower() in used:
+            number += 1
+            name = "{}_{}".format(base, number)
+        used.add(name.lower())
+        names[obj] = name
+    return names
+
+
+def batch_files(batch_mode, directory, filename, ext, objects, frame_range, blocks=()):
+    """Work out the files to write and the object frames each of them contains, in order
+
+    Returns a list of (path, [(object, frame index), ...]) tuples.
+    blocks names the data that's stored once per object (e.g. 'indices'), as ((name, object), 0).
+    A block follows the object's frames if they share a file, else it goes in a separate file.
+    """
+    from os.path import join
+
+    frames = list(enumerate(frame_range))
+    name = file_names(objects).get
+    object_blocks = lambda obj: [((block, obj), 0) for block in blocks]
+
+    if batch_mode == 'perobj':
+        return [(join(directory, "{}_{}{}".format(filename, name(obj), ext)),
+                 [(obj, i) for i, frame in frames] + object_blocks(obj)) for obj in objects]
+    if batch_mode == 'perfra':
+        files = [(join(directory, "{}_{}{}".format(filename, frame, ext)),
+                  [(obj, i) for obj in objects]) for i, frame in frames]
+    elif batch_mode == 'objfra':
+        files = [(join(directory, "{}_{}".format(filename, name(obj)), "{}{}".format(frame, ext)),
+                  [(obj, i)]) for obj in objects for i, frame in frames]
+        return files + [(join(directory, "{}_{}".format(filename, name(obj)), block + ext),
+                         [((block, obj), 0)]) for obj in objects for block in blocks]
+    elif batch_mode == 'fraobj':
+        files = [(join(directory, "{}_{}".format(filename, frame), "{}{}".format(name(obj), ext)),
+                  [(obj, i)]) for i, frame in frames for obj in objects]
+    else:
+        # Single file
+        return [(join(directory, filename + ext),
+                 [entry for obj in objects for entry in [(obj, i) for i, frame in frames] + object_blocks(obj)])]
+
+    # Per frame: each block gets a file of its own
+    return files + [(join(directory, "{}_{}{}".format(filename, block, ext)),
+                     [((block, obj), 0) for obj in objects]) for block in blocks]
 
 
 def object_to_json(obj):
     """Returns the data of the object in a json-compatible form"""
-    result = {}
-    rna = obj.bl_rna
-    for prop in rna.properties:
-        prop_id = prop.identifier
-        prop_ins = getattr(obj,prop_id)
-        prop_rna = rna.properties[prop_id]
-        type = rna.properties[prop_id].type
-        #print(prop_id,prop_ins,type)
-        if type == 'STRING':
-            result[prop_id] = prop_ins
-        elif type == 'ENUM':
-            result[prop_id] = [flag for flag in prop_ins] if prop_rna.is_enum_flag else prop_ins
-        elif type == 'POINTER':
-            result[prop_id] = getattr(prop_ins,'name','') if prop_ins != None else ''
-        elif type == 'COLLECTION':
-            # Enter collections up to encountering a PointerProperty
-            result[prop_id] = [object_to_json(prop_item) for prop_item in prop_ins if prop_item != None]
-            pass
-        else:
-            # 'Simple' attribute types: int, float, boolean
-            if prop_rna.is_array:
-                # Sometimes the bl_rna indicates a number of array items, but the actual number is less
-                # That's because items are stored in an additional object, e.g. a matrix consists of 4 vectors
-                len_expected, len_actual = prop_rna.array_length, len(prop_ins)
-                if len_expected > len_actual:
-                    result[prop_id] = []
-                    for item in prop_ins: result[prop_id].extend(item[:])
-                else:
-                    result[prop_id] = prop_ins[:]
-            else:
-                result[prop_id] = prop_ins
-    return result
+    from .json_description import JsonSerializer
+    return JsonSerializer().convert(obj)
+
+
+def compile_specs(specs):
+    """Compile the vertex format given as a list of (source, property, fmt,
+    interpolation offset, function name, args) tuples"""
+    from . import conversions
+    return compile_format([(
+        source,
+        prop,
+        fmt,
+        index,
+        None if func == "none" else getattr(conversions, func),
+        args,
+    ) for source, prop, fmt, index, func, args in specs])
 
 
 def export(filepath,
@@ -204,11 +361,35 @@ def export(filepath,
         object_types_to_export,
         apply_transforms,
         export_images,
-        custom_extension
+        custom_extension,
+        engine='vectorized',
+        index_buffer='none',
+        optimize_order=False,
+        group_by_material=False,
+        shape_keys='none',
+        frame_layout='full',
+        skip_unchanged=False,
+        workers=0,
+        use_cache=False,
+        cache_directory="",
+        cache_size=1024,
+        profile=False,
+        profile_trace="",
+        description_format='json',
+        json_max_depth=0,
+        json_properties="",
+        json_references=False,
+        report=None,
         ):
-    """Main entry point for export"""
+    """Main entry point for export
+
+    report is called like Operator.report with the profile summary, if profile is set
+    """
+
+    from os.path import split, splitext, relpath, sep
 
-    from os.path import split, splitext
+    # Timing of the export's stages, only recorded if asked for
+    profiler = Profiler(profile, bool(profile_trace))
 
     # Prepare a bit
     root, ext = splitext(filepath)
@@ -216,15 +397,13 @@ def export(filepath,
     filename = splitext(fname)[0]
 
     # Work out the frames to export
-    # frame_offset is used to index the correct bytearray! (index 0 for frame_start)
+    # The position of a frame in frame_range determines its position in the file
     if frame_option == 'all':
         # Full scene frame range, take the step value into account
         frame_range = range(scene.frame_start, scene.frame_end+1, scene.frame_step)
-        frame_offset = scene.frame_start
     else:
         # Only the current frame
         frame_range = range(scene.frame_current, scene.frame_current+1)
-        frame_offset = scene.frame_current  # Offset to subtract in the data buffer
     
     mesh_selection = [obj for obj in object_selection if obj.type in MESHLIKE_TYPES]    # TODO Does this break morphs?
     for i, obj in enumerate(mesh_selection): obj.batch_index = i   # Guarantee a predictable batch index
@@ -235,114 +414,439 @@ def export(filepath,
     # FIX for issue #21
     no_verts_per_object = {}
     offset = {}
+    block_ranges = {}
+    acmr_per_object = {}
+    submeshes = {}
+    layout = None
+    repeated_frames = {}
+    quantization_errors = {}
+    attribute_layers = {}
+    files_written = []
     for obj in mesh_selection:
         no_verts_per_object[obj] = 0
         offset[obj] = 0
+        block_ranges[obj] = {}
 
     # Export mesh data to buffer
     if export_mesh_data:
-        from . import conversions
-
-        attribs = [(
+        specs = [(
             attrib.data_source,    # Node on which to look up attribute
             attrib.data_property,  # Attribute to look up on the node
             attrib.fmt,
             attrib.int,
-            None if attrib.func == "none" else getattr(conversions, attrib.func),
+            attrib.func,
             attrib.args,
         ) for attrib in vertex_format]
 
         # << Prepare a structure to map vertex attributes to the actual contents >>
-        ba_per_object = {}
-        desc_per_object = {}
-        for obj in mesh_selection:
-            desc_per_object[obj] = construct_ds(obj, attribs)
-            ba_per_object[obj], no_verts_per_object[obj] = construct_ba(obj, desc_per_object[obj], frame_range)
-
-        # << End of preparation of structure >>
-
-        # Loop through scene frames
+        compiled = compile_specs(specs)
         frame_prev = scene.frame_current
 
-        for frame in frame_range:
-            # First set the current frame
-            scene.frame_set(frame)
-
-            # Now add frame vertex data for the current object
+        # Frames that were exported before are read from the cache (cache_size is in MB)
+        cache = None
+        if use_cache and compiled.stride:
+            from .cache import ExportCache
+            cache = ExportCache(cache_directory, cache_size * 1024 * 1024, specs, reverse_loop, apply_transforms)
+
+        # The workers start with a copy of the file as it is now, so before the triangulation
+        from .parallel import worker_pool
+        workers = workers if compiled.stride and mesh_selection else 0
+        with worker_pool(workers, scene, mesh_selection, frame_range, specs,
+                         reverse_loop, apply_transforms, engine, cache) as pool, \
+             triangulated(mesh_selection):
+            # The meshes evaluated to size the output are those of the first frame
+            profiler.frame = frame_range[0]
+            with profiler.stage('frame_set'):
+                scene.frame_set(frame_range[0])
+                depsgraph = bpy.context.evaluated_depsgraph_get()
+            first_meshes = {}
             for obj in mesh_selection:
-                write_object_ba(
-                    scene,
-                    obj,
-                    desc_per_object[obj],
-                    ba_per_object[obj],
-                    frame - frame_offset,
-                    reverse_loop,
-                    apply_transforms,
+                with profiler.stage('evaluate', obj):
+                    first_meshes[obj] = evaluated_mesh(obj, depsgraph)
+                no_verts_per_object[obj] = len(first_meshes[obj].loops)   # A vertex per loop of every triangle
+            profiler.frame = None
+
+            fingerprints, previous_frame, repeats = {}, {}, {}
+            if skip_unchanged or cache:
+                from .changes import fingerprint
+
+            # The triangle order is worked out once, using the first frame's mesh
+            triangle_order, corner_positions, triangle_groups = {}, {}, {}
+            if (optimize_order or group_by_material) and compiled.stride:
+                import numpy as np
+                from .vectorized import corner_indices
+                for obj in mesh_selection:
+                    m = first_meshes[obj]
+                    corners = corner_indices(m, reverse_loop)
+                    if corners is None:
+                        continue
+                    groups = None
+                    if group_by_material:
+                        # The triangles of each material slot are written together, slot by slot
+                        with profiler.stage('group', obj):
+                            groups = np.empty(len(m.polygons), dtype=np.int32)
+                            m.polygons.foreach_get('material_index', groups)
+                            triangle_order[obj] = group_triangles(np.arange(len(groups)), groups)
+                        names = [mat.name if mat else "" for mat in m.materials]
+                        submeshes[obj] = [(names[slot] if slot < len(names) else "", 3 * count)
+                                          for slot, count in group_sizes(groups)]
+                    if not optimize_order:
+                        continue
+                    positions = np.empty(len(m.vertices) * 3, dtype=np.float32)
+                    m.vertices.foreach_get('co', positions)
+                    positions = positions.reshape(-1, 3)
+                    if index_buffer == 'none':
+                        with profiler.stage('optimize', obj):
+                            triangle_order[obj], acmr_per_object[obj] = optimize_unindexed(corners[1], positions, groups)
+                    else:
+                        corner_positions[obj] = positions[corners[1]]
+                        if groups is not None:
+                            # The records are grouped before they're indexed, so the corners are too
+                            order = triangle_order[obj]
+                            corner_positions[obj] = corner_positions[obj].reshape(-1, 3, 3)[order].reshape(-1, 3)
+                            triangle_groups[obj] = groups[order]
+
+            # The shape keys are read once, as morph targets with a position per corner in the written order
+            targets = {}
+            if shape_keys != 'none' and compiled.stride:
+                from .shape_keys import morph_targets
+                from .vectorized import corner_indices
+                for obj in mesh_selection:
+                    with profiler.stage('shape_keys', obj):
+                        m = first_meshes[obj]
+                        corners = corner_indices(m, reverse_loop)
+                        if corners is None:
+                            continue
+                        vertices = corners[1]
+                        if obj in triangle_order:
+                            vertices = vertices.reshape(-1, 3)[triangle_order[obj]].ravel()
+                        obj_targets = morph_targets(obj, m, vertices, shape_keys, apply_transforms)
+                    if obj_targets:
+                        targets[obj] = obj_targets
+            if targets:
+                from .shape_keys import (
+                    add_offsets,
+                    from_records,
+                    per_vertex,
+                    target_data,
+                    target_ranges,
+                    target_records,
                 )
+            no_targets = {(('shape_keys', obj), 0) for obj in mesh_selection if obj not in targets}
+
+            # The domain and data type of the mesh attributes that are written, for the description
+            if ATTRIBUTE_SOURCE in compiled.description:
+                from .attributes import layers
+                attribute_layers.update(layers(first_meshes.values()))
+
+            # The error of quantized attributes is reported in the description, measured on the first frame
+            if export_json_data and compiled.stride:
+                from .quantize import measure_errors
+                for obj in mesh_selection:
+                    with profiler.stage('quantization', obj):
+                        measure_errors(scene, obj, first_meshes[obj], compiled, specs,
+                                       reverse_loop, apply_transforms, quantization_errors)
+
+            # The workers evaluate the meshes of all frames themselves
+            if pool:
+                for obj in mesh_selection:
+                    first_meshes.pop(obj)
+                    obj.to_mesh_clear()
+
+            frame_size = {obj: no_verts_per_object[obj] * compiled.stride for obj in mesh_selection}
+            if index_buffer == 'none' and frame_layout == 'full' and not skip_unchanged:
+                # Every frame is written to its file as soon as it's complete
+                blocks = ['shape_keys'] if targets else []
+                files = batch_files(batch_mode, base, filename, ext, mesh_selection, frame_range, blocks)
+                files = [(path, [entry for entry in entries if entry not in no_targets]) for path, entries in files]
+                files = [(path, entries) for path, entries in files if entries]
+                block_data = {('shape_keys', obj): target_data(obj_targets) for obj, obj_targets in targets.items()}
+                frame_size.update({key: len(data) for key, data in block_data.items()})
+                writer = BatchWriter(file_mode, files, frame_size)
+                for (block, obj), data in block_data.items():
+                    block_ranges[obj][block] = target_ranges(obj, targets[obj], shape_keys)
+                    profiler.count(obj, "bytes", len(data))
+                    writer.write((block, obj), 0, data)
+
+                def write(obj, frame_index, ba):
+                    profiler.count(obj, "bytes", len(ba))
+                    writer.write(obj, frame_index, ba)
+            else:
+                # Vertices are only merged if they're identical in all frames,
+                # attributes are only static if they're the same in all frames,
+                # the offsets aren't known until it's clear which frames repeat,
+                # so the frames are kept until the last one is done
+                writer = None
+                frames_per_object = {obj: [None] * len(frame_range) for obj in mesh_selection}
+
+                def write(obj, frame_index, ba):
+                    frames = frames_per_object[obj]
+                    if skip_unchanged and frame_index > 0 and frames[frame_index-1] == ba:
+                        ba = frames[frame_index-1]      # Keep a single copy of repeated frames
+                    frames[frame_index] = ba
+            streams = {obj: FrameStream(compiled.desc, len(frame_range), partial(write, obj))
+                       for obj in mesh_selection}
+
+            # << End of preparation of structure >>
+
+            try:
+                # Loop through scene frames
+                for frame_index, frame in enumerate(frame_range):
+                    profiler.frame = frame
+
+                    # First set the current frame
+                    if frame_index > 0 and not pool:
+                        with profiler.stage('frame_set'):
+                            scene.frame_set(frame)
+                            depsgraph = bpy.context.evaluated_depsgraph_get()
+
+                    # Now add frame vertex data for the current object
+                    for obj in mesh_selection:
+                        profiler.count(obj, "vertices", no_verts_per_object[obj])
+                        if pool:
+                            with profiler.stage('worker', obj):
+                                ba = pool.frame(obj, frame_index, frame_size)
+                            if obj in triangle_order:
+                                with profiler.stage('reorder', obj):
+                                    ba = reorder_records(ba, triangle_order[obj], 3 * compiled.stride)
+                            with profiler.stage('stream', obj):
+                                streams[obj].push(ba)
+                            continue
+
+                        if frame_index == 0:
+                            m = first_meshes.pop(obj)
+                        else:
+                            with profiler.stage('evaluate', obj):
+                                m = evaluated_mesh(obj, depsgraph)
+
+                        key = None
+                        if skip_unchanged or cache:
+                            with profiler.stage('fingerprint', obj):
+                                key = fingerprint(scene, obj, m, compiled, reverse_loop, apply_transforms)
+                        if skip_unchanged:
+                            # Nothing changed since the previous frame, so neither did the vertex data
+                            if key is not None and key == fingerprints.get(obj):
+                                obj.to_mesh_clear()
+                                with profiler.stage('stream', obj):
+                                    streams[obj].push(bytearray(previous_frame[obj]))
+                                continue
+                            fingerprints[obj] = key
+
+                        ba = None
+                        if cache and key is not None:
+                            with profiler.stage('cache', obj):
+                                ba = cache.get(key, frame_size[obj])
+                        if ba is not None:
+                            obj.to_mesh_clear()
+                        else:
+                            ba = bytearray(frame_size[obj])
+                            write_object_ba(
+                                scene,
+                                obj,
+                                m,
+                                compiled,
+                                ba,
+                                reverse_loop,
+                                apply_transforms,
+                                engine,
+                                profiler,
+                            )
+                            if cache and key is not None:
+                                with profiler.stage('cache', obj):
+                                    cache.put(key, ba)
+                        if obj in triangle_order:
+                            with profiler.stage('reorder', obj):
+                                ba = reorder_records(ba, triangle_order[obj], 3 * compiled.stride)
+                        if skip_unchanged:
+                            previous_frame[obj] = bytes(ba)     # The stream may still change ba
+                        with profiler.stage('stream', obj):
+                            streams[obj].push(ba)
+                profiler.frame = None
+
+                # Write the frames that were held back for interpolation
+                for obj in mesh_selection:
+                    with profiler.stage('stream', obj):
+                        streams[obj].close()
+
+                if writer is None:
+                    blocks, block_data = [], {}
+                    if index_buffer != 'none':
+                        blocks.append('indices')
+                        for obj in mesh_selection:
+                            with profiler.stage('index', obj):
+                                frames, indices = deduplicate(frames_per_object[obj], compiled.stride,
+                                                              target_records(targets[obj]) if obj in targets else None)
+                            if obj in targets:
+                                targets[obj] = per_vertex(targets[obj], indices)
+                            if obj in corner_positions:
+                                # The morph targets are reordered along with the vertices, as a record per vertex
+                                extra = [target_records(targets[obj]).tobytes()] if obj in targets else []
+                                with profiler.stage('optimize', obj):
+                                    frames, indices, acmr_per_object[obj] = optimize_indexed(
+                                        frames + extra, indices, compiled.stride, corner_positions.pop(obj),
+                                        triangle_groups.pop(obj, None))
+                                if extra:
+                                    frames, targets[obj] = frames[:-1], from_records(targets[obj], frames[-1])
+                            frames_per_object[obj] = frames
+                            no_verts_per_object[obj] = len(frames[0]) // compiled.stride if compiled.stride else 0
+
+                            index_fmt = index_format(no_verts_per_object[obj], index_buffer)
+                            block_data['indices', obj] = indices.astype(INDEX_DTYPE[index_fmt]).tobytes()
+                            block_ranges[obj]["indices"] = {"no_indices":len(indices), "type":BUFFER_TYPE[index_fmt]}
+
+                    if frame_layout != 'full':
+                        blocks.append('static')
+                        with profiler.stage('layout'):
+                            layout = detect_layout(frame_layout, compiled, frames_per_object.values())
+                        for obj in mesh_selection:
+                            with profiler.stage('layout', obj):
+                                block_data['static', obj], frames_per_object[obj] = layout.split(frames_per_object[obj])
+                            block_ranges[obj]["static"] = {}
+
+                    if targets:
+                        blocks.append('shape_keys')
+                        for obj, obj_targets in targets.items():
+                            block_data['shape_keys', obj] = target_data(obj_targets)
+                            block_ranges[obj]["shape_keys"] = target_ranges(obj, obj_targets, shape_keys)
+
+                    for obj in mesh_selection:
+                        frame_size[obj] = len(frames_per_object[obj][0])
+                    frame_size.update({key: len(data) for key, data in block_data.items()})
+
+                    # A frame that's the same as the one before refers to the first one of the run
+                    if skip_unchanged:
+                        for obj in mesh_selection:
+                            frames = frames_per_object[obj]
+                            for frame_index in range(1, len(frames)):
+                                if frames[frame_index] == frames[frame_index-1]:
+                                    repeats[obj, frame_index] = repeats.get((obj, frame_index-1), frame_index-1)
+
+                    files = batch_files(batch_mode, base, filename, ext, mesh_selection, frame_range, blocks)
+                    files = [(path, [entry for entry in entries if entry not in repeats and entry not in no_targets])
+                             for path, entries in files]
+                    files = [(path, entries) for path, entries in files if entries]
+                    writer = BatchWriter(file_mode, files, frame_size)
+                    for obj in mesh_selection:
+                        for frame_index, ba in enumerate(frames_per_object.pop(obj)):
+                            if (obj, frame_index) not in repeats:
+                                profiler.count(obj, "bytes", len(ba))
+                                writer.write(obj, frame_index, ba)
+                        for block in blocks:
+                            if ((block, obj), 0) in no_targets:
+                                continue
+                            data = block_data.pop((block, obj))
+                            profiler.count(obj, "bytes", len(data))
+                            writer.write((block, obj), 0, data)
+            finally:
+                if writer:
+                    with profiler.stage('flush'):
+                        writer.close()
+
+            offset = {obj: writer.offset(obj) for obj in mesh_selection}
+            for (obj, frame_index), repeated_index in sorted(repeats.items(), key=lambda item: item[0][1]):
+                # Pairs of [frame, the earlier frame that it's the same as]
+                repeated_frames.setdefault(obj, []).append([frame_range[frame_index], frame_range[repeated_index]])
+            for obj in mesh_selection:
+                for block, block_range in block_ranges[obj].items():
+                    path, block_range["offset"] = writer.locations[(block, obj), 0]
+                    block_range["location"] = relpath(path, base).replace(sep, "/")
+                if "shape_keys" in block_ranges[obj]:
+                    add_offsets(block_ranges[obj]["shape_keys"])
+
+            # The manifest of files, an object's frames are stored consecutively in a file
+            for path, entries in files:
+                ranges = {}
+                for obj, frame_index in entries:
+                    if isinstance(obj, tuple):
+                        # A block of data that the object has once (e.g. its index buffer)
+                        block, obj = obj
+                        ranges.setdefault(obj.name, {})[block] = block_ranges[obj][block]
+                        continue
+                    if obj.name not in ranges:
+                        ranges[obj.name] = {
+                            "no_verts":no_verts_per_object[obj],
+                            "offset":writer.offset(obj, frame_index),
+                            "frames":[],
+                        }
+                    ranges[obj.name]["frames"].append(frame_range[frame_index])
+                files_written.append({"location":relpath(path, base).replace(sep, "/"), "ranges":ranges})
 
         # Nicely reset the previous frame
         scene.frame_set(frame_prev)
 
-        # Final step: write all bytearrays to one or more file(s)
-        # in one or more directories
-        with open(root + ext, file_mode) as f:
-            offset = {}
-            for obj in mesh_selection:
-                ba = ba_per_object[obj]
-                offset[obj] = f.tell()
-                for b in ba:
-                    f.write(b)
+        if cache:
+            cache.evict()
+
+    # Save images (Cycles and Eevee materials)
+    textures = {}
+    if export_images:
+        from .textures import export_textures
+        materials = {slot.material for o in mesh_selection for slot in o.material_slots if slot.material}
+        textures = export_textures(materials, base, scene, profiler)
 
     # Create JSON description file
     if export_json_data:
-        ctx, data = {}, {}
-        json_data = {
-            "bpy":{
-                "context":ctx,
-                "data":data
-            }
-        }
-
-        # Export bpy.context
-        ctx["selected_objects"] = [object_to_json(obj) for obj in object_selection]
-
-        # Export bpy.data
-        data_to_export = object_types_to_export
-        for datatype in data_to_export:
-            #data[datatype] = [object_to_json(obj) for obj in getattr(bpy.data,datatype)]
-            data[datatype] = {obj.name:object_to_json(obj) for obj in getattr(bpy.data, datatype)}
+        from .json_description import (
+            JsonSerializer,
+            write_binary_description,
+            write_description,
+        )
+        from .quantize import encodings
+        attribute_encodings = encodings([(x.data_source, x.data_property, x.fmt, x.int, x.func, x.args) for x in vertex_format])
+        properties = [prop.strip() for prop in json_properties.split(",") if prop.strip()]
+        serializer = JsonSerializer(json_max_depth, properties, json_references)
+
+        def material_ranges(obj):
+            # The vertices (or indices) of each material, relative to the start of the object's data
+            key = "no_verts" if index_buffer == 'none' else "no_indices"
+            ranges, first = [], 0
+            for name, count in submeshes[obj]:
+                ranges.append({"material":name, "offset":first, key:count})
+                first += count
+            return ranges
 
         # Export additional info that might be useful
-        json_data["blmod"] = {
-            "mesh_data":{
-                "location":filename + ext,
-                "format":[{"type":x.data_source[0].node,"attr":x.data_property[1].node,"fmt":x.fmt} for x in vertex_format],
-                "ranges":{obj.name:{"no_verts":no_verts_per_object[obj],"offset":offset[obj]} for obj in mesh_selection},
-            },
-            "settings":{"apply_transforms":apply_transforms},
-            "no_frames":len(frame_range),
-            "blender_version":bpy.app.version[:],
-            #"version":bl_info["version"],
-        }
-
-        import json
-        with open(root + ".json", "w") as f_desc:
-            json.dump(json_data, f_desc)
-
-    # Save images (Cycles and Eevee materials)
-    if export_images:
-        materials = {slot.material for o in mesh_selection for slot in o.material_slots}
-        node_based_materials = [mat for mat in materials if mat.use_nodes]
-        for mat in node_based_materials:
-            ntree = mat.node_tree
-
-            if len(ntree.nodes) > 1:    # Quite a couple of happy assumptions we make here...
-                tex_node = [n for n in ntree.nodes if n.type == 'TEX_IMAGE']
-                if tex_node:
-                    tex_node = tex_node[0]
-                    image = tex_node.image
-                    if image:
-                        image.save_render(base + '/' + image.name, scene=scene)
+        def blmod():
+            blmod = {
+                "mesh_data":{
+                    "location":filename + ext,
+                    "format":[dict({"type":x.data_source,"attr":x.data_property,"fmt":x.fmt},
+                        **(layout.attribute(i) if layout else {}),
+                        **({"encoding":attribute_encodings[i]} if attribute_encodings[i] else {}),
+                        **({"error":quantization_errors[i]} if i in quantization_errors else {}),
+                        **({"domain":attribute_layers[x.data_property][0], "data_type":attribute_layers[x.data_property][1]}
+                           if x.data_source == ATTRIBUTE_SOURCE and x.data_property in attribute_layers else {})) for i, x in enumerate(vertex_format)],
+                    "layout":layout.description() if layout else {"mode":'full'},
+                    "ranges":{obj.name:dict({"no_verts":no_verts_per_object[obj],"offset":offset[obj]},
+                        **block_ranges[obj],
+                        **({"acmr":acmr_per_object[obj]} if obj in acmr_per_object else {}),
+                        **({"materials":material_ranges(obj)} if obj in submeshes else {}),
+                        **({"repeats":repeated_frames[obj]} if repeated_frames.get(obj) else {})) for obj in mesh_selection},
+                    "batch_mode":batch_mode,
+                    "files":files_written,
+                },
+                "settings":{"apply_transforms":apply_transforms},
+                "textures":{name:[relpath(path, base).replace(sep, "/") for path in paths] for name, paths in textures.items()},
+                "no_frames":len(frame_range),
+                "blender_version":bpy.app.version[:],
+                #"version":bl_info["version"],
+            }
+            if profile:
+                blmod["stats"] = profiler.stats()
+            return blmod
+
+        # Export bpy.context and bpy.data, streamed to the file
+        if description_format in ('json', 'both'):
+            with profiler.stage('json'):
+                write_description(root + ".json", serializer, object_selection, object_types_to_export, blmod)
+        if description_format in ('binary', 'both'):
+            with profiler.stage('binary_description'):
+                write_binary_description(root + ".vbxd", serializer, object_selection, object_types_to_export, blmod)
+
+    if profile and report:
+        report({'INFO'}, profiler.summary())
+    if profile_trace:
+        profiler.write_trace(bpy.path.abspath(profile_trace))
 
     # Cleanup: remove dynamic property from class
     del bpy.types.Object.batch_index
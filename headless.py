@@ -0,0 +1,184 @@
+# Headless export, without UI context
+#
+# Exports a collection (or a full scene) using the settings of an export
+# preset. Run it in a background Blender session:
+#
+# blender -b file.blend --python headless.py -- --preset vbuff.py --collection Models --output models.vbx
+#
+# Or export many .blend files in a single session, listed in a manifest:
+#
+# blender -b --python headless.py -- --manifest manifest.json
+#
+# The manifest is a JSON list of entries with the keys "blend", "preset",
+# "output" and optionally "collection", "scene" and any export setting
+# (e.g. "frame_option"). Relative paths are relative to the manifest.
+#
+
+import argparse
+import ast
+import json
+import os
+import sys
+import traceback
+from types import SimpleNamespace
+
+import bpy
+
+# Settings of the export operator that export() has no default for
+DEFAULTS = {
+    'file_mode': 'wb',
+    'vertex_format': [],
+    'reverse_loop': False,
+    'frame_option': 'cur',
+    'batch_mode': 'one',
+    'export_mesh_data': True,
+    'export_json_data': False,
+    'object_types_to_export': set(),
+    'apply_transforms': True,
+    'export_images': False,
+    'custom_extension': "",
+}
+
+# Preset settings that only matter to the operator
+IGNORED_SETTINGS = {'filepath', 'selection_only', 'collection', 'active_attribute_index'}
+
+
+class VertexFormat(list):
+    """Stands in for the operator's vertex_format collection while a preset runs"""
+
+    def add(self):
+        item = SimpleNamespace(name='', data_source='MeshVertex', data_property='co',
+                               fmt='fff', int=0, func='none', args='')
+        self.append(item)
+        return item
+
+
+def load_preset(path):
+    """Return the export settings stored in an operator preset file
+
+    The preset is run against a plain namespace instead of the operator
+    """
+    with open(path) as f_preset:
+        tree = ast.parse(f_preset.read(), path)
+
+    # The preset gets the namespace instead of bpy, so bpy mustn't be imported
+    tree.body = [node for node in tree.body
+                 if not (isinstance(node, ast.Import) and any(alias.name == 'bpy' for alias in node.names))]
+
+    settings = SimpleNamespace(**dict(DEFAULTS, vertex_format=VertexFormat()))
+    shim = SimpleNamespace(context=SimpleNamespace(active_operator=settings))
+    exec(compile(tree, path, 'exec'), {'bpy': shim})
+    return {key: value for key, value in vars(settings).items() if key not in IGNORED_SETTINGS}
+
+
+def export(preset, output, collection="", scene=None, **settings):
+    """Export the objects in the collection (all objects in the scene if empty)
+    with the settings in the preset file, overridden by the settings provided
+
+    frame_start, frame_end and frame_step override the scene's frame range
+    """
+    from . import export_gms_vtx_buffer
+
+    scene = bpy.data.scenes[scene] if scene else bpy.context.scene
+    if collection:
+        object_selection = bpy.data.collections[collection].all_objects[:]
+    else:
+        object_selection = scene.objects[:]
+    if not object_selection:
+        raise ValueError("Nothing to export")
+
+    keywords = load_preset(preset)
+    keywords.update(settings)
+
+    frame_settings = {key: keywords.pop(key) for key in ('frame_start', 'frame_end', 'frame_step') if key in keywords}
+    frame_prev = {key: getattr(scene, key) for key in frame_settings}
+    for key, value in frame_settings.items():
+        setattr(scene, key, value)
+
+    keywords['filepath'] = os.path.abspath(output)
+    keywords['scene'] = scene
+    keywords['object_selection'] = object_selection
+    keywords['object_types_to_export'] = set(keywords['object_types_to_export'])
+
+    # export() removes it again when it's done
+    bpy.types.Object.batch_index = bpy.props.IntProperty(name="Batch Index")
+    try:
+        return export_gms_vtx_buffer.export(**keywords)
+    finally:
+        if hasattr(bpy.types.Object, 'batch_index'):
+            del bpy.types.Object.batch_index
+        for key, value in frame_prev.items():
+            setattr(scene, key, value)
+
+
+def print_report(type, message):
+    """Print what the export reports (see export_gms_vtx_buffer.export)"""
+    print(message)
+
+
+def export_manifest(path, report=None):
+    """Export every entry in the manifest, opening the .blend files one by one
+
+    Returns the list of entries that failed
+    """
+    directory = os.path.dirname(os.path.abspath(path))
+    resolve = lambda entry_path: os.path.join(directory, entry_path)
+    with open(path) as f_manifest:
+        entries = json.load(f_manifest)
+
+    failed = []
+    for entry in entries:
+        settings = dict(entry)
+        blend = resolve(settings.pop('blend'))
+        preset = resolve(settings.pop('preset'))
+        output = resolve(settings.pop('output'))
+        try:
+            if bpy.data.filepath != blend:
+                bpy.ops.wm.open_mainfile(filepath=blend)
+            export(preset, output, report=report, **settings)
+            print("Exported {} to {}".format(blend, output))
+        except Exception:
+            traceback.print_exc()
+            failed.append(entry)
+    return failed
+
+
+def main(argv):
+    """Command line entry point, argv are the arguments after '--'"""
+    parser = argparse.ArgumentParser(prog="headless.py", description="Export GameMaker vertex buffers without UI")
+    parser.add_argument("--manifest", help="JSON list of exports to run, each one with its own .blend file")
+    parser.add_argument("--preset", help="Export operator preset file")
+    parser.add_argument("--output", help="File to export to")
+    parser.add_argument("--collection", default="", help="Collection to export (default: all objects in the scene)")
+    parser.add_argument("--scene", default=None, help="Scene to export (default: the active scene)")
+    parser.add_argument("--frame-option", choices=('cur', 'all'), help="Export the current frame or all frames")
+    parser.add_argument("--frame-start", type=int)
+    parser.add_argument("--frame-end", type=int)
+    parser.add_argument("--frame-step", type=int)
+    parser.add_argument("--workers", type=int, help="Number of background worker processes")
+    parser.add_argument("--profile", action="store_const", const=True, help="Time the stages of the export")
+    parser.add_argument("--profile-trace", help="Write the timings to this file as a Chrome trace")
+    args = parser.parse_args(argv)
+
+    if args.manifest:
+        failed = export_manifest(args.manifest, print_report)
+        if failed:
+            print("{} of the exports failed".format(len(failed)))
+        return 1 if failed else 0
+
+    if not args.preset or not args.output:
+        parser.error("--preset and --output are required without --manifest")
+    settings = {key: value for key, value in vars(args).items()
+                if key not in ('manifest', 'preset', 'output', 'collection', 'scene') and value is not None}
+    export(args.preset, args.output, args.collection, args.scene, report=print_report, **settings)
+    return 0
+
+
+if __name__ == "__main__":
+    # Run as a script: import the add-on by its directory name, so that its modules can be used
+    import importlib
+    addon_path, package = os.path.split(os.path.dirname(os.path.abspath(__file__)))
+    sys.path.insert(0, addon_path)
+    headless = importlib.import_module(package + ".headless")
+    argv = sys.argv[sys.argv.index("--") + 1:] if "--" in sys.argv else []
+    sys.exit(headless.main(argv))
@@ -0,0 +1,53 @@
+# Indexed vertex buffers
+#
+# Vertices whose records are byte for byte identical are written only once,
+# the triangles refer to them through a separate index buffer.
+#
+
+import numpy as np
+
+# Maps index type code to the numpy data type it's written as
+INDEX_DTYPE = {
+    'H': np.dtype('=u2'),
+    'I': np.dtype('=u4'),
+}
+
+
+def index_format(no_verts, index_buffer):
+    """Return the type code of the indices for the given number of (unique) vertices"""
+    if index_buffer == 'auto' and no_verts <= 1 << 16:
+        return 'H'
+    return 'I'
+
+
+def deduplicate(frames, vertex_format_bytesize, extra=None):
+    """Merge the identical vertices in the frames of an object
+
+    frames is a list with a bytearray per frame. Vertices are only merged
+    when their records are identical in every frame, so the same indices apply
+    to all frames. Unique vertices keep the order of their first occurrence.
+    extra, if given, is other data that has to be identical as well (an array
+    with a row per vertex, e.g. morph targets).
+
+    Returns the list of deduplicated frames and the index of each original vertex
+    """
+    records = np.stack([np.frombuffer(ba, dtype=np.uint8).reshape(-1, vertex_format_bytesize)
+                        for ba in frames], axis=1)     # (vertex, frame, byte)
+    no_verts = records.shape[0]
+    keys = records.reshape(no_verts, -1)
+    if extra is not None:
+        keys = np.concatenate((keys, np.ascontiguousarray(extra).view(np.uint8).reshape(no_verts, -1)), axis=1)
+    keys = np.ascontiguousarray(keys)
+    if no_verts == 0 or keys.shape[1] == 0:
+        return [bytes(ba) for ba in frames], np.arange(no_verts)
+
+    keys = keys.view(np.dtype((np.void, keys.shape[1]))).ravel()
+    _, first, inverse = np.unique(keys, return_index=True, return_inverse=True)
+
+    # np.unique sorts, restore the order in which vertices first occur
+    order = np.argsort(first)
+    remap = np.empty_like(order)
+    remap[order] = np.arange(len(order))
+    rows = first[order]
+
+    return [records[rows, frame].tobytes() for frame in range(len(frames))], remap[inverse.ravel()]
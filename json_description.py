@@ -0,0 +1,183 @@
+# JSON description of Blender data
+#
+# Converts RNA structs (objects, materials, actions, ...) to json-compatible
+# dicts. The properties to look up are worked out once per RNA type.
+# Datablocks that are encountered more than once (e.g. a material used by
+# many objects) are converted once. Optionally they're written as a
+# reference to the datablock after their first occurrence. The datablocks
+# that are written at the top level are only kept until they're written
+# again (the selected objects, that are part of bpy.data.objects too).
+# Structs that contain themselves (directly or indirectly) are written as
+# their name the second time, instead of recursing endlessly.
+#
+# The description is written to the file piece by piece, instead of
+# building one big dict first, as JSON or in a binary format with the same
+# structure (see binary_description.py).
+#
+
+import json
+
+import bpy
+
+# Kinds of properties
+STRING, ENUM, ENUM_FLAG, POINTER, COLLECTION, ARRAY, VALUE = range(7)
+
+
+class JsonSerializer:
+    """Converts RNA structs to json-compatible dicts
+
+    max_depth limits how deep collections are entered (0: no limit),
+    collections that are deeper are written as lists of names.
+    properties is a collection of property identifiers to write ("name" or
+    "Type.name", e.g. "Object.location"), all properties if it's empty.
+    With references, a datablock that was written before is written as
+    {"$ref": "Type/name"}.
+    """
+
+    def __init__(self, max_depth=0, properties=(), references=False):
+        self.max_depth = max_depth
+        self.properties = set(properties)
+        self.references = references
+        self.plans = {}         # RNA type identifier -> [(property identifier, kind, array length), ...]
+        self.memo = {}          # (datablock pointer, depth) -> dict
+        self.written = set()    # Pointers of datablocks that were written in full
+        self.active = set()     # Pointers of the structs that are being converted
+
+    def plan(self, rna):
+        """Return the properties to write for the RNA type and how to write them"""
+        plan = self.plans.get(rna.identifier)
+        if plan is None:
+            plan = []
+            for prop in rna.properties:
+                prop_id = prop.identifier
+                if self.properties and prop_id not in self.properties \
+                        and "{}.{}".format(rna.identifier, prop_id) not in self.properties:
+                    continue
+                type, array_length = prop.type, 0
+                if type == 'STRING':
+                    kind = STRING
+                elif type == 'ENUM':
+                    kind = ENUM_FLAG if prop.is_enum_flag else ENUM
+                elif type == 'POINTER':
+                    kind = POINTER
+                elif type == 'COLLECTION':
+                    kind = COLLECTION
+                else:
+                    # 'Simple' attribute types: int, float, boolean
+                    kind = ARRAY if prop.is_array else VALUE
+                    array_length = prop.array_length if prop.is_array else 0
+                plan.append((prop_id, kind, array_length))
+            self.plans[rna.identifier] = plan
+        return plan
+
+    @staticmethod
+    def reference(item):
+        return {"$ref": "{}/{}".format(item.bl_rna.identifier, getattr(item, 'name', ''))}
+
+    def item(self, item, depth):
+        """Convert an item of a collection"""
+        pointer = item.as_pointer()
+        if pointer in self.active:
+            # The item contains itself
+            return self.reference(item) if self.references else getattr(item, 'name', '')
+        if not isinstance(item, bpy.types.ID):
+            return self.convert(item, depth)
+
+        if self.references and pointer in self.written:
+            return self.reference(item)
+        key = (pointer, depth if self.max_depth else 0)     # The depth only matters if it's limited
+        result = self.memo.get(key)
+        if result is None:
+            result = self.memo[key] = self.convert(item, depth)
+        self.written.add(pointer)
+        return result
+
+    def convert(self, obj, depth=0):
+        """Returns the data of the struct in a json-compatible form"""
+        pointer = obj.as_pointer()
+        self.active.add(pointer)
+        try:
+            result = {}
+            for prop_id, kind, array_length in self.plan(obj.bl_rna):
+                prop_ins = getattr(obj, prop_id)
+                if kind == STRING or kind == ENUM or kind == VALUE:
+                    result[prop_id] = prop_ins
+                elif kind == ENUM_FLAG:
+                    result[prop_id] = [flag for flag in prop_ins]
+                elif kind == POINTER:
+                    result[prop_id] = getattr(prop_ins, 'name', '') if prop_ins != None else ''
+                elif kind == COLLECTION:
+                    # Enter collections up to encountering a PointerProperty
+                    if self.max_depth and depth >= self.max_depth:
+                        result[prop_id] = [getattr(prop_item, 'name', '') for prop_item in prop_ins if prop_item != None]
+                    else:
+                        result[prop_id] = [self.item(prop_item, depth + 1) for prop_item in prop_ins if prop_item != None]
+                else:
+                    # Sometimes the bl_rna indicates a number of array items, but the actual number is less
+                    # That's because items are stored in an additional object, e.g. a matrix consists of 4 vectors
+                    if array_length > len(prop_ins):
+                        result[prop_id] = []
+                        for item in prop_ins: result[prop_id].extend(item[:])
+                    else:
+                        result[prop_id] = prop_ins[:]
+            return result
+        finally:
+            self.active.discard(pointer)
+
+    def datablock(self, obj, again=False):
+        """Convert a datablock that's written at the top level, always in full
+
+        The result is only kept if the datablock is written again later
+        on (again), so that the description doesn't build up in memory
+        """
+        key = (obj.as_pointer(), 0)
+        result = self.memo.pop(key, None)
+        if result is None:
+            result = self.convert(obj)
+        if again:
+            self.memo[key] = result
+        self.written.add(key[0])
+        return result
+
+
+def write_description(path, serializer, selected_objects, datatypes, blmod):
+    """Write the JSON description file piece by piece
+
+    blmod is a function that returns the add-on's part of the description,
+    it's called last, so it can include everything up to the end
+    """
+    dumps = json.dumps
+    with open(path, "w") as f_desc:
+        write = f_desc.write
+        write('{"bpy": {"context": {"selected_objects": [')
+        again = 'objects' in datatypes     # The selected objects are in bpy.data.objects too
+        for i, obj in enumerate(selected_objects):
+            write((", " if i else "") + dumps(serializer.datablock(obj, again)))
+        write(']}, "data": {')
+        for i, datatype in enumerate(datatypes):
+            write((", " if i else "") + dumps(datatype) + ": {")
+            for j, obj in enumerate(getattr(bpy.data, datatype)):
+                write((", " if j else "") + dumps(obj.name) + ": " + dumps(serializer.datablock(obj)))
+            write("}")
+        write('}}, "blmod": ' + dumps(blmod()) + "}")
+
+
+def write_binary_description(path, serializer, selected_objects, datatypes, blmod):
+    """Write the description in the binary format (see binary_description.py)
+
+    It has the same structure as the JSON description, it's also written
+    one datablock at a time
+    """
+    from .binary_description import BinaryWriter
+    with open(path, "wb") as f_desc:
+        writer = BinaryWriter(f_desc)
+        value = writer.value
+        again = 'objects' in datatypes
+        context = writer.map([("selected_objects",
+                               writer.list(value(serializer.datablock(obj, again)) for obj in selected_objects))])
+        data = writer.map((datatype, writer.map((obj.name, value(serializer.datablock(obj)))
+                                                for obj in getattr(bpy.data, datatype)))
+                          for datatype in datatypes)
+        root = writer.map([("bpy", writer.map([("context", context), ("data", data)])),
+                           ("blmod", value(blmod()))])
+        writer.close(root)
@@ -0,0 +1,120 @@
+# Multi-frame layouts
+#
+# With the 'full' layout every frame contains complete vertex records.
+# The other layouts split the vertex format in attributes that are the same
+# in all frames (static) and attributes that change (animated):
+#
+# 'split'   The static attributes are written once, in a block per object,
+#           the frames only contain the animated attributes
+# 'delta'   The block per object contains the complete records of the first
+#           frame, the frames contain the difference with the first frame
+#           of the animated attributes. Float attributes are stored as
+#           half floats, all others as they are
+#
+# Frame k of an object is rebuilt as the static block plus frame k.
+#
+
+from struct import calcsize
+
+import numpy as np
+
+from .vertex_format import expand_format
+
+
+class FrameLayout:
+    """The way the attributes of the vertex records are divided over the static block and the frames
+
+    fields is a list of (offset, size, fmt, static, frame_fmt) tuples, one per attribute,
+    frame_fmt is the format that an animated attribute has in the frames
+    (it only differs from fmt for deltas)
+    """
+
+    def __init__(self, mode, fields, vertex_format_bytesize):
+        self.mode = mode
+        self.fields = fields
+        self.vertex_format_bytesize = vertex_format_bytesize
+        self.animated = [field for field in fields if not field[3]]
+
+        if mode == 'delta':
+            self.static_bytesize = vertex_format_bytesize
+        else:
+            self.static_bytesize = sum(size for offset, size, fmt, static, frame_fmt in fields if static)
+        self.frame_bytesize = sum(frame_size(field) for field in self.animated)
+
+    def description(self):
+        """The layout in a json-compatible form"""
+        return {
+            "mode":self.mode,
+            "static_bytesize":self.static_bytesize,
+            "frame_bytesize":self.frame_bytesize,
+        }
+
+    def attribute(self, index):
+        """The layout of the attribute at the given index of the vertex format in a json-compatible form"""
+        offset, size, fmt, static, frame_fmt = self.fields[index]
+        result = {"static":static}
+        if not static:
+            result["frame_fmt"] = frame_fmt
+            result["delta"] = frame_fmt != fmt
+        return result
+
+    def split(self, frames):
+        """Split the frames of an object in the static block and the frames to write"""
+        no_verts = len(frames[0]) // self.vertex_format_bytesize if self.vertex_format_bytesize else 0
+        records = [np.frombuffer(ba, dtype=np.uint8).reshape(no_verts, self.vertex_format_bytesize) for ba in frames]
+        first = records[0]
+
+        if self.mode == 'delta':
+            static = bytes(frames[0])
+        else:
+            static = np.ascontiguousarray(first[:, [col for offset, size, fmt, is_static, frame_fmt in self.fields
+                                                    if is_static for col in range(offset, offset+size)]]).tobytes()
+
+        result = []
+        for frame in records:
+            out = np.empty((no_verts, self.frame_bytesize), dtype=np.uint8)
+            pos = 0
+            for field in self.animated:
+                offset, size, fmt, static_field, frame_fmt = field
+                values = frame[:, offset:offset+size]
+                if frame_fmt != fmt:
+                    # Difference with the first frame, at reduced precision
+                    base = first[:, offset:offset+size].copy().view('=f4')
+                    values = (values.copy().view('=f4') - base).astype('=f2').view(np.uint8)
+                out[:, pos:pos+frame_size(field)] = values
+                pos += frame_size(field)
+            result.append(out.tobytes())
+        return static, result
+
+
+def frame_size(field):
+    """The number of bytes an animated attribute takes in a frame"""
+    offset, size, fmt, static, frame_fmt = field
+    return size if frame_fmt == fmt else calcsize('=' + frame_fmt)
+
+
+def detect_layout(mode, compiled, frames_per_object):
+    """Work out the layout of the frames for the given mode
+
+    An attribute is static if its bytes are the same in all frames of all objects.
+    The fields are in the order of the attributes in the vertex format
+    """
+    fields = []
+    for source, prop, occurrence in sorted(compiled.occurrences(), key=lambda o: o[2][0]):
+        offset, size, fmt = occurrence[:3]
+        static = all(np.array_equal(records[:, offset:offset+size], records_first[:, offset:offset+size])
+                     for records_first, records in _records(frames_per_object, compiled.stride))
+
+        frame_fmt = fmt
+        if mode == 'delta' and not static and expand_format(fmt) == 'f' * len(fmt):
+            frame_fmt = 'e' * len(fmt)
+        fields.append((offset, size, fmt, static, frame_fmt))
+    return FrameLayout(mode, fields, compiled.stride)
+
+
+def _records(frames_per_object, vertex_format_bytesize):
+    """Iterate over (first frame, frame) pairs of vertex records of all objects"""
+    for frames in frames_per_object:
+        views = [np.frombuffer(ba, dtype=np.uint8).reshape(-1, vertex_format_bytesize) for ba in frames]
+        for view in views[1:]:
+            yield views[0], view
@@ -0,0 +1,208 @@
+# Triangle order optimization
+#
+# Reorders the triangles of a mesh for better reuse of the GPU's post-transform
+# vertex cache, using Tipsify (Sander, Nehab and Barczak, "Fast Triangle
+# Reordering for Vertex Locality and Reduced Overdraw", 2007), followed by
+# its overdraw pass: the clusters that Tipsify produces are sorted so that
+# the ones facing outwards are drawn first.
+#
+# Quality is reported as ACMR (average cache miss ratio): the number of
+# vertices transformed per triangle, for a FIFO cache of the given size.
+#
+
+import numpy as np
+
+# Size of the vertex cache that's optimized for
+CACHE_SIZE = 16
+
+
+def acmr(indices, cache_size=CACHE_SIZE):
+    """Return the average cache miss ratio of the triangle list for a FIFO cache"""
+    no_tris = len(indices) // 3
+    if no_tris == 0:
+        return 0.0
+
+    cache, misses = {}, 0     # Vertex -> time it entered the cache
+    for i in indices.tolist():
+        if misses - cache.get(i, -cache_size-1) > cache_size:
+            cache[i] = misses
+            misses += 1
+    return misses / no_tris
+
+
+def tipsify(indices, no_verts, cache_size=CACHE_SIZE):
+    """Return the new order of the triangles and the positions in it where clusters start
+
+    indices lists the vertices of every triangle, three per triangle
+    """
+    tris = indices.reshape(-1, 3)
+    no_tris = len(tris)
+
+    # The triangles that use each vertex
+    live = np.bincount(indices, minlength=no_verts)
+    adjacency_start = np.concatenate(([0], np.cumsum(live)))
+    adjacency = (np.argsort(indices, kind='stable') // 3).tolist()
+    adjacency_start = adjacency_start.tolist()
+    live = live.tolist()
+    tris = tris.tolist()
+
+    timestamps = [0] * no_verts
+    emitted = [False] * no_tris
+    dead_end = []
+    time = cache_size + 1
+    cursor = 0
+    order, clusters = [], []
+
+    fanning = int(indices[0]) if no_tris else -1
+    new_cluster = True
+    while fanning >= 0:
+        if new_cluster:
+            clusters.append(len(order))
+
+        # Emit all remaining triangles around the fanning vertex
+        candidates = []
+        for t in adjacency[adjacency_start[fanning]:adjacency_start[fanning+1]]:
+            if emitted[t]:
+                continue
+            for v in tris[t]:
+                dead_end.append(v)
+                candidates.append(v)
+                live[v] -= 1
+                if time - timestamps[v] > cache_size:
+                    timestamps[v] = time
+                    time += 1
+            emitted[t] = True
+            order.append(t)
+
+        # The next fanning vertex is the one that's still in the cache
+        # after emitting its triangles and has been there the longest
+        fanning, best = -1, -1
+        for v in candidates:
+            if live[v] > 0:
+                priority = 0
+                if time - timestamps[v] + 2 * live[v] <= cache_size:
+                    priority = time - timestamps[v]
+                if priority > best:
+                    fanning, best = v, priority
+        new_cluster = fanning < 0
+
+        if fanning < 0:
+            # Dead end, use recently referenced vertices, or else the next one in line
+            while dead_end:
+                v = dead_end.pop()
+                if live[v] > 0:
+                    fanning = v
+                    break
+            else:
+                while cursor < no_verts and live[cursor] == 0:
+                    cursor += 1
+                if cursor < no_verts:
+                    fanning = cursor
+
+    return np.array(order, dtype=np.int64), np.array(clusters, dtype=np.int64)
+
+
+def sort_clusters(indices, order, clusters, positions):
+    """Return the triangle order with the clusters that face outwards first
+
+    positions contains the position of every vertex. A cluster's outward facing
+    measure is the dot product of its average normal with the direction from
+    the mesh's centroid to the cluster's centroid.
+    """
+    if len(clusters) < 2:
+        return order
+
+    corners = positions[indices.reshape(-1, 3)[order]]            # (triangle, corner, xyz)
+    normals = np.cross(corners[:, 1] - corners[:, 0], corners[:, 2] - corners[:, 0])
+    areas = np.linalg.norm(normals, axis=1)
+    centroids = corners.mean(axis=1)
+
+    weights = np.maximum(np.add.reduceat(areas, clusters), 1e-12)
+    cluster_normals = np.add.reduceat(normals, clusters)
+    cluster_centroids = np.add.reduceat(centroids * areas[:, np.newaxis], clusters) / weights[:, np.newaxis]
+    mesh_centroid = (centroids * areas[:, np.newaxis]).sum(axis=0) / max(areas.sum(), 1e-12)
+
+    facing = np.einsum('ij,ij->i', cluster_centroids - mesh_centroid, cluster_normals)
+    cluster_order = np.argsort(-facing, kind='stable')
+    bounds = np.append(clusters, len(order))
+    return np.concatenate([order[bounds[c]:bounds[c+1]] for c in cluster_order])
+
+
+def optimize_triangles(indices, no_verts, positions=None, cache_size=CACHE_SIZE):
+    """Return the order in which to write the triangles for vertex cache reuse and less overdraw"""
+    order, clusters = tipsify(indices, no_verts, cache_size)
+    if positions is not None:
+        order = sort_clusters(indices, order, clusters, positions)
+    return order
+
+
+def reorder_vertices(indices):
+    """Renumber the vertices in the order in which they're first used
+
+    Returns the new indices and, for each new vertex, the vertex it was
+    """
+    unique, first = np.unique(indices, return_index=True)
+    vertex_order = unique[np.argsort(first)]
+    remap = np.empty(len(indices) and unique.max() + 1, dtype=np.int64)
+    remap[vertex_order] = np.arange(len(vertex_order))
+    return remap[indices], vertex_order
+
+
+def reorder_records(ba, order, record_size):
+    """Return a copy of the bytes with the records of the given size in the given order"""
+    result = bytearray(len(order) * record_size)
+    records = np.frombuffer(ba, dtype=np.uint8).reshape(-1, record_size)
+    np.frombuffer(result, dtype=np.uint8).reshape(-1, record_size)[:] = records[order]
+    return result
+
+
+def group_triangles(order, groups):
+    """Return the triangle order with the triangles of each group together,
+    groups in ascending order, the order within a group is kept"""
+    return order[np.argsort(groups[order], kind='stable')]
+
+
+def group_sizes(groups):
+    """Return the (group, number of triangles) pairs of the groups, in ascending order"""
+    values, counts = np.unique(groups, return_counts=True)
+    return list(zip(values.tolist(), counts.tolist()))
+
+
+def optimize_unindexed(vertices, positions, groups=None):
+    """Work out the triangle order of unindexed vertex data
+
+    vertices contains the mesh vertex that each corner refers to, that is what
+    the vertex cache would reuse if the data were indexed.
+    groups, if given, is the group (material) of each triangle, that the
+    triangles are grouped by afterwards.
+    Returns the triangle order and the ACMR before and after
+    """
+    order = optimize_triangles(vertices, len(positions), positions)
+    if groups is not None:
+        order = group_triangles(order, groups)
+    after = vertices.reshape(-1, 3)[order].ravel()
+    return order, {"before":acmr(vertices), "after":acmr(after), "cache_size":CACHE_SIZE}
+
+
+def optimize_indexed(frames, indices, vertex_format_bytesize, corner_positions, groups=None):
+    """Reorder the triangles of indexed vertex data, then the vertices in the order they're fetched in
+
+    corner_positions contains the position of every corner (original vertex).
+    groups, if given, is the group (material) of each triangle, that the
+    triangles are grouped by afterwards.
+    frames may be followed by other data with a record per vertex of a
+    different size (e.g. all morph targets of a vertex), that's reordered along.
+    Returns the frames, the indices and the ACMR before and after
+    """
+    no_verts = len(frames[0]) // vertex_format_bytesize
+    positions = np.zeros((no_verts, 3))
+    positions[indices] = corner_positions
+
+    order = optimize_triangles(indices, no_verts, positions)
+    if groups is not None:
+        order = group_triangles(order, groups)
+    before = acmr(indices)
+    indices, vertex_order = reorder_vertices(indices.reshape(-1, 3)[order].ravel())
+    frames = [reorder_records(ba, vertex_order, len(ba) // no_verts if no_verts else vertex_format_bytesize)
+              for ba in frames]
+    return frames, indices, {"before":before, "after":acmr(indices), "cache_size":CACHE_SIZE}
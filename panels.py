@@ -16,8 +16,21 @@ def export_panel_general(layout, operator, is_file_browser):
             box.prop(operator, property='selection_only')
         
         box.prop(operator, property='frame_option')
+        box.prop(operator, property='batch_mode')
         box.prop(operator, property='file_mode')
         box.prop(operator, property='custom_extension')
+        box.prop(operator, property='engine')
+        box.prop(operator, property='index_buffer')
+        box.prop(operator, property='optimize_order')
+        box.prop(operator, property='group_by_material')
+        box.prop(operator, property='shape_keys')
+        box.prop(operator, property='frame_layout')
+        box.prop(operator, property='skip_unchanged')
+        box.prop(operator, property='workers')
+        box.prop(operator, property='use_cache')
+        if operator.use_cache:
+            box.prop(operator, property='cache_directory')
+            box.prop(operator, property='cache_size')
 
 
 def export_panel_attributes(layout, operator, is_file_browser):
@@ -71,6 +84,10 @@ def export_panel_object_data(layout, operator, is_file_browser):
     if body:
         box = body.box()
         box.prop(operator, property="object_types_to_export")
+        box.prop(operator, property="description_format")
+        box.prop(operator, property="json_max_depth")
+        box.prop(operator, property="json_properties")
+        box.prop(operator, property="json_references")
 
 
 def export_panel_extra(layout, operator, is_file_browser):
@@ -82,3 +99,6 @@ def export_panel_extra(layout, operator, is_file_browser):
     if body:
         box = body.box()
         box.prop(operator, property='export_images')
+        box.prop(operator, property='profile')
+        if operator.profile:
+            box.prop(operator, property='profile_trace')
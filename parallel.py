@@ -0,0 +1,228 @@
+# Parallel export in background Blender processes
+#
+# The objects (or, if there are fewer objects than workers, the frames)
+# are split into jobs. Each job runs in a separate `blender --background`
+# process (a Python process that imports bpy, if bpy runs as a module)
+# that loads a copy of the current .blend file, packs the vertex
+# records of its objects and frames exactly like the serial export does
+# and writes them to a temporary file, frame by frame.
+#
+# The main process reads the packed frames back in the serial order and
+# takes care of everything else (interpolation offsets, indexing, layouts,
+# offsets and files), so the output is the same byte for byte.
+#
+
+import json
+import os
+import subprocess
+import sys
+import tempfile
+from contextlib import contextmanager
+
+import bpy
+
+# Maximum number of characters of a failed worker's output to report
+LOG_TAIL = 4000
+
+
+def split_jobs(objects, frame_range, workers):
+    """Divide the objects and frames over at most workers jobs
+
+    Returns a list of (objects, frame indices) tuples
+    """
+    frame_indices = list(range(len(frame_range)))
+    if len(objects) >= workers or len(frame_indices) == 1:
+        chunks = [objects[i::workers] for i in range(workers)]
+        return [(chunk, frame_indices) for chunk in chunks if chunk]
+    size = -(-len(frame_indices) // workers)    # Ceiling division
+    return [(objects, frame_indices[i:i+size]) for i in range(0, len(frame_indices), size)]
+
+
+class WorkerPool:
+    """Runs the export jobs in background Blender processes and reads back their frames
+
+    specs is the vertex format as a list of (source, property, fmt,
+    interpolation offset, function name, args) tuples.
+    The jobs start right away, the pool waits for a job the first time
+    one of its frames is needed.
+    """
+
+    def __init__(self, workers, scene, objects, frame_range, specs,
+                 reverse_loop, apply_transforms, engine, cache=None):
+        self.directory = tempfile.TemporaryDirectory(prefix="vbx_")
+        self.jobs = []
+        self.handles = {}
+
+        try:
+            self._start(workers, scene, objects, frame_range, specs, reverse_loop, apply_transforms, engine, cache)
+        except:
+            self.close()
+            raise
+
+    def _start(self, workers, scene, objects, frame_range, specs, reverse_loop, apply_transforms, engine, cache):
+        # The workers load a copy, so that changes that weren't saved are included
+        blend_path = os.path.join(self.directory.name, "scene.blend")
+        bpy.ops.wm.save_as_mainfile(filepath=blend_path, copy=True)
+
+        # Import the add-on by its directory name, that also works for extensions
+        addon_dir = os.path.dirname(os.path.abspath(__file__))
+        addon_path, package = os.path.split(addon_dir)
+        for job_index, (job_objects, frame_indices) in enumerate(split_jobs(objects, frame_range, workers)):
+            job_path = os.path.join(self.directory.name, "job{}.json".format(job_index))
+            output_path = os.path.join(self.directory.name, "job{}.bin".format(job_index))
+            log_path = os.path.join(self.directory.name, "job{}.log".format(job_index))
+            with open(job_path, "w") as f_job:
+                json.dump({
+                    "scene": scene.name,
+                    "objects": [obj.name for obj in job_objects],
+                    "frames": [frame_range[i] for i in frame_indices],
+                    "specs": specs,
+                    "reverse_loop": reverse_loop,
+                    "apply_transforms": apply_transforms,
+                    "engine": engine,
+                    "cache": [cache.directory, cache.max_size] if cache else None,
+                    "output": output_path,
+                }, f_job)
+
+            expr = ("import sys, importlib; sys.path.insert(0, {!r}); "
+                    "importlib.import_module({!r}).run_job({!r})").format(addon_path, package + ".parallel", job_path)
+            if bpy.app.binary_path:
+                command = [bpy.app.binary_path, "--background", "--factory-startup", blend_path,
+                           "--python-exit-code", "1", "--python-expr", expr]
+            else:
+                # bpy as a module: the worker is a Python process that opens the file itself
+                command = [sys.executable, "-c", "import bpy; bpy.ops.wm.open_mainfile(filepath={!r}); {}".format(
+                    blend_path, expr)]
+            with open(log_path, "w") as log:
+                process = subprocess.Popen(
+                    command,
+                    stdout=log,
+                    stderr=subprocess.STDOUT,
+                )
+
+            self.jobs.append({"process": process, "output": output_path, "log": log_path,
+                              "objects": job_objects, "frame_indices": frame_indices, "positions": None})
+
+        self.job_of = {(obj, frame_index): job for job in self.jobs
+                       for obj in job["objects"] for frame_index in job["frame_indices"]}
+
+    def _wait(self, job, frame_size):
+        if job["positions"] is not None:
+            return
+        if job["process"].wait() != 0:
+            with open(job["log"], errors="replace") as log:
+                output = log.read()[-LOG_TAIL:]
+            raise RuntimeError("Export worker failed with exit code {}:\n{}".format(job["process"].returncode, output))
+
+        # A worker sizes the frames using the first frame of its job, not the first frame
+        with open(job["output"] + ".json") as f_sizes:
+            sizes = json.load(f_sizes)
+        for obj in job["objects"]:
+            if sizes[obj.name] != frame_size[obj]:
+                raise ValueError("The number of vertices of object '{}' changes between frames".format(obj.name))
+
+        # The frames are stored frame by frame, then object by object
+        positions, pos = {}, 0
+        for frame_index in job["frame_indices"]:
+            for obj in job["objects"]:
+                positions[obj, frame_index] = pos
+                pos += frame_size[obj]
+        job["positions"] = positions
+
+    def frame(self, obj, frame_index, frame_size):
+        """Return the packed bytearray of the object at the given frame
+
+        frame_size maps each object to the size of its frames
+        """
+        job = self.job_of[obj, frame_index]
+        self._wait(job, frame_size)
+        f = self.handles.get(job["output"])
+        if f is None:
+            f = self.handles[job["output"]] = open(job["output"], "rb")
+        f.seek(job["positions"][obj, frame_index])
+        return bytearray(f.read(frame_size[obj]))
+
+    def close(self):
+        """Stop the workers that are still running and remove the temporary files"""
+        for job in self.jobs:
+            if job["process"].poll() is None:
+                job["process"].kill()
+                job["process"].wait()
+        for f in self.handles.values():
+            f.close()
+        self.handles.clear()
+        self.directory.cleanup()
+
+
+@contextmanager
+def worker_pool(workers, *args):
+    """Run the export jobs in a WorkerPool for as long as the context lasts
+
+    Yields None if there's no point in using more than one process
+    """
+    if workers < 2:
+        yield None
+        return
+    pool = WorkerPool(workers, *args)
+    try:
+        yield pool
+    finally:
+        pool.close()
+
+
+def run_job(job_path):
+    """Worker entry point: pack the job's object frames and write them to its output file"""
+    from .changes import fingerprint
+    from .export_gms_vtx_buffer import (
+        compile_specs,
+        evaluated_mesh,
+        triangulated,
+        write_object_ba,
+    )
+    from .cache import ExportCache
+
+    with open(job_path) as f_job:
+        job = json.load(f_job)
+
+    # The worker starts without the add-on, its dynamic properties (read by the
+    # vertex format, e.g. Object.batch_index) are registered here
+    if not hasattr(bpy.types.Object, 'batch_index'):
+        bpy.types.Object.batch_index = bpy.props.IntProperty(name="Batch Index")
+
+    scene = bpy.data.scenes[job["scene"]]
+    objects = [bpy.data.objects[name] for name in job["objects"]]
+    compiled = compile_specs(job["specs"])
+    reverse_loop, apply_transforms = job["reverse_loop"], job["apply_transforms"]
+    cache = ExportCache(*job["cache"], job["specs"], reverse_loop, apply_transforms) if job["cache"] else None
+
+    sizes = {}
+    with triangulated(objects), open(job["output"], "wb") as f_out:
+        for frame in job["frames"]:
+            scene.frame_set(frame)
+            depsgraph = bpy.context.evaluated_depsgraph_get()
+            for obj in objects:
+                m = evaluated_mesh(obj, depsgraph)
+                if obj.name not in sizes:
+                    sizes[obj.name] = len(m.loops) * compiled.stride
+                key = fingerprint(scene, obj, m, compiled, reverse_loop, apply_transforms) if cache else None
+                ba = cache.get(key, sizes[obj.name]) if key is not None else None
+                if ba is not None:
+                    obj.to_mesh_clear()
+                else:
+                    ba = bytearray(sizes[obj.name])
+                    write_object_ba(
+                        scene,
+                        obj,
+                        m,
+                        compiled,
+                        ba,
+                        reverse_loop,
+                        apply_transforms,
+                        job["engine"],
+                    )
+                    if key is not None:
+                        cache.put(key, ba)
+                f_out.write(ba)
+
+    with open(job["output"] + ".json", "w") as f_sizes:
+        json.dump(sizes, f_sizes)
@@ -52,3 +52,20 @@ op.object_types_to_export = set()
 op.apply_transforms = True
 op.export_images = False
 op.custom_extension = '.vbuff'
+op.engine = 'vectorized'
+op.index_buffer = 'none'
+op.optimize_order = False
+op.group_by_material = False
+op.shape_keys = 'none'
+op.frame_layout = 'full'
+op.skip_unchanged = False
+op.workers = 0
+op.use_cache = False
+op.cache_directory = ''
+op.cache_size = 1024
+op.profile = False
+op.profile_trace = ''
+op.description_format = 'json'
+op.json_max_depth = 0
+op.json_properties = ''
+op.json_references = False
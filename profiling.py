@@ -0,0 +1,130 @@
+# Export profiling
+#
+# Records the wall time and number of calls of the stages of an export
+# (frame changes, mesh evaluation, reading, converting and packing the
+# attributes, JSON, images, ...), per object and per frame, along with
+# the number of vertices and bytes that were written.
+#
+# The results end up in the JSON description under blmod/stats and can
+# also be written as a Chrome trace (chrome://tracing, Perfetto).
+#
+
+import json
+import threading
+from contextlib import contextmanager, nullcontext
+from time import perf_counter
+
+_NO_STAGE = nullcontext()
+
+
+class Profiler:
+    """Keeps track of the time spent in each stage of an export
+
+    A disabled profiler records nothing, so the calls can stay in the code
+    """
+
+    def __init__(self, enabled=False, trace=False):
+        self.enabled = enabled
+        self.trace = trace and enabled
+        self.start = perf_counter()
+        self.frame = None           # The frame that's being exported, set by the export
+        self.stages = {}            # stage -> [time, calls]
+        self.objects = {}           # object name -> {"stages": ..., "time": ..., "vertices": ..., "bytes": ...}
+        self.frames = {}            # frame -> time
+        self.events = []            # Chrome trace events
+        self.open = []              # Objects of the stages that are running
+
+    def stage(self, name, obj=None):
+        """Return a context manager that times a stage, of an object if one is given"""
+        if not self.enabled:
+            return _NO_STAGE
+        return self._stage(name, obj)
+
+    @contextmanager
+    def _stage(self, name, obj):
+        # Only the outermost stages add to the object's and the frame's time
+        outer = not self.open
+        outer_obj = obj is not None and obj not in self.open
+        self.open.append(obj)
+        start = perf_counter()
+        try:
+            yield
+        finally:
+            end = perf_counter()
+            elapsed = end - start
+            self.open.pop()
+            self._add(self.stages, name, elapsed)
+            if obj is not None:
+                obj_stats = self.object_stats(obj)
+                self._add(obj_stats["stages"], name, elapsed)
+                if outer_obj:
+                    obj_stats["time"] += elapsed
+            if outer and self.frame is not None:
+                self.frames[self.frame] = self.frames.get(self.frame, 0) + elapsed
+            if self.trace:
+                args = {}
+                if obj is not None:
+                    args["object"] = obj.name
+                if self.frame is not None:
+                    args["frame"] = self.frame
+                self.events.append({
+                    "name": name,
+                    "ph": "X",
+                    "ts": (start - self.start) * 1e6,
+                    "dur": elapsed * 1e6,
+                    "pid": 0,
+                    "tid": threading.get_ident(),
+                    "args": args,
+                })
+
+    @staticmethod
+    def _add(stages, name, elapsed):
+        totals = stages.setdefault(name, [0.0, 0])
+        totals[0] += elapsed
+        totals[1] += 1
+
+    def object_stats(self, obj):
+        return self.objects.setdefault(obj.name, {"stages": {}, "time": 0.0, "vertices": 0, "bytes": 0})
+
+    def count(self, obj, key, value):
+        """Add to a counter of the object ("vertices" or "bytes")"""
+        if self.enabled:
+            self.object_stats(obj)[key] += value
+
+    def stats(self):
+        """Return the results in a json-compatible form"""
+        as_dict = lambda stages: {name: {"time": time, "calls": calls} for name, (time, calls) in stages.items()}
+        objects = {}
+        for name, obj_stats in self.objects.items():
+            time = obj_stats["time"]
+            objects[name] = {
+                "stages": as_dict(obj_stats["stages"]),
+                "time": time,
+                "vertices": obj_stats["vertices"],
+                "bytes": obj_stats["bytes"],
+                "vertices_per_second": obj_stats["vertices"] / time if time else 0,
+            }
+        return {
+            "total_time": perf_counter() - self.start,
+            "stages": as_dict(self.stages),
+            "objects": objects,
+            "frames": {str(frame): time for frame, time in self.frames.items()},
+            "vertices": sum(obj_stats["vertices"] for obj_stats in self.objects.values()),
+            "bytes": sum(obj_stats["bytes"] for obj_stats in self.objects.values()),
+        }
+
+    def summary(self):
+        """Return a short overview of the time per stage, slowest first"""
+        lines = ["Export profile ({:.3f} s)".format(perf_counter() - self.start)]
+        for name, (time, calls) in sorted(self.stages.items(), key=lambda item: -item[1][0]):
+            lines.append("  {:<16} {:10.3f} s {:8} calls".format(name, time, calls))
+        return "\n".join(lines)
+
+    def write_trace(self, path):
+        """Write the recorded stages as a Chrome trace file"""
+        with open(path, "w") as f_trace:
+            json.dump({"traceEvents": self.events, "displayTimeUnit": "ms"}, f_trace)
+
+
+# For code that's called without a profiler
+NO_PROFILER = Profiler()
@@ -0,0 +1,211 @@
+# Quantized encodings
+#
+# Compact encodings of attributes that are written as integers and decoded
+# in the shader (or by the vertex format, for normalized types):
+#
+# unorm8, unorm16       [0, 1] as B, H
+# snorm8, snorm16       [-1, 1] as b, h
+# octahedral_snorm16    unit vector as hh (octahedral mapping)
+# octahedral_unorm8     unit vector as BB (octahedral mapping, * 0.5 + 0.5)
+# snorm_10_10_10_2      vector as I: x, y, z as 10-bit snorm in bits 0-29,
+#                       w (the 4th component, if any) as 2-bit unorm in bits 30-31
+#
+# Half floats need no conversion, they're written with the format 'e'.
+#
+# The conversion functions are in conversions.py, they register their array
+# form and decoder with the quantized decorator. Their scalar forms (used by
+# the per loop engine) round exactly like the array forms. The error of an encoding
+# is the largest difference between a value and its decoded value. It's
+# measured on the first frame and added to the attribute's format in the
+# JSON description.
+#
+
+from itertools import accumulate
+from struct import calcsize
+
+import numpy as np
+from . import array_forms
+from .array_forms import array_form, vectors
+
+# (encoding name, decoder) by conversion function name
+ENCODINGS = {}
+
+
+def quantized(name, encode, decode):
+    """Decorator that registers a conversion function as a quantized encoding,
+    with encode as its array form and decode as the inverse of that"""
+    def register(func):
+        ENCODINGS[func.__name__] = (name, decode)
+        return array_form(encode)(func)
+    return register
+
+
+def finite(values):
+    if not np.all(np.isfinite(values)):
+        raise ValueError("Cannot quantize infinity or NaN")
+    return values
+
+
+def unorm(values, bits):
+    """Round values in [0, 1] to integers in [0, 2**bits - 1]"""
+    return np.rint(np.clip(finite(values), 0.0, 1.0) * ((1 << bits) - 1)).astype(np.int64)
+
+
+def snorm(values, bits):
+    """Round values in [-1, 1] to integers in [-(2**(bits-1) - 1), 2**(bits-1) - 1]"""
+    return np.rint(np.clip(finite(values), -1.0, 1.0) * ((1 << (bits - 1)) - 1)).astype(np.int64)
+
+
+def unorm_value(x, bits):
+    """Scalar form of unorm, rounds the same way"""
+    return round(min(max(x, 0.0), 1.0) * ((1 << bits) - 1))
+
+
+def snorm_value(x, bits):
+    """Scalar form of snorm, rounds the same way"""
+    return round(min(max(x, -1.0), 1.0) * ((1 << (bits - 1)) - 1))
+
+
+def per_component(func, val):
+    """Apply a scalar form to a value or to each component of a vector"""
+    return func(val) if isinstance(val, (int, float)) else [func(x) for x in val]
+
+
+def decode_unorm(values, bits):
+    return values / ((1 << bits) - 1)
+
+
+def decode_snorm(values, bits):
+    return np.maximum(values / ((1 << (bits - 1)) - 1), -1.0)
+
+
+def octahedral(values):
+    """Map unit vectors to the [-1, 1] square"""
+    values = finite(vectors(values))
+    x, y, z = values[:, 0], values[:, 1], values[:, 2]
+    l1 = np.abs(x) + np.abs(y) + np.abs(z)
+    l1 = np.where(l1 == 0, 1.0, l1)
+    x, y, z = x / l1, y / l1, z / l1
+    folded_x = (1 - np.abs(y)) * np.where(x >= 0, 1.0, -1.0)
+    folded_y = (1 - np.abs(x)) * np.where(y >= 0, 1.0, -1.0)
+    return np.column_stack((np.where(z < 0, folded_x, x), np.where(z < 0, folded_y, y)))
+
+
+def octahedral_value(v):
+    """Scalar form of octahedral, for a single vector"""
+    x, y, z = v[0], v[1], v[2]
+    l1 = abs(x) + abs(y) + abs(z)
+    if l1 == 0:
+        l1 = 1.0
+    x, y, z = x / l1, y / l1, z / l1
+    if z < 0:
+        x, y = (1 - abs(y)) * (1.0 if x >= 0 else -1.0), (1 - abs(x)) * (1.0 if y >= 0 else -1.0)
+    return x, y
+
+
+def decode_octahedral(values):
+    """Map points in the [-1, 1] square back to unit vectors"""
+    x, y = values[:, 0], values[:, 1]
+    z = 1 - np.abs(x) - np.abs(y)
+    t = np.maximum(-z, 0)
+    x = x - t * np.where(x >= 0, 1.0, -1.0)
+    y = y - t * np.where(y >= 0, 1.0, -1.0)
+    result = np.column_stack((x, y, z))
+    return result / np.linalg.norm(result, axis=1)[:, np.newaxis]
+
+
+def pack_10_10_10_2(values):
+    values = vectors(values)
+    xyz = snorm(values[:, :3], 10) & 0x3FF
+    w = unorm(values[:, 3], 2) if values.shape[1] > 3 else np.zeros(len(values), np.int64)
+    return xyz[:, 0] | xyz[:, 1] << 10 | xyz[:, 2] << 20 | w << 30
+
+
+def unpack_10_10_10_2(values):
+    xyz = np.column_stack([values >> shift & 0x3FF for shift in (0, 10, 20)])
+    xyz = np.where(xyz >= 512, xyz - 1024, xyz)     # Sign extension
+    return np.column_stack((decode_snorm(xyz, 10), decode_unorm(values >> 30 & 3, 2)))
+
+
+def encodings(specs):
+    """Return the name of the encoding of each attribute, None if it isn't quantized"""
+    from . import conversions   # Registers the encodings
+    result = []
+    for source, prop, fmt, index, func, args in specs:
+        if func in ENCODINGS:
+            result.append(ENCODINGS[func][0])
+        elif fmt and fmt == 'e' * len(fmt):
+            result.append('half')
+        else:
+            result.append(None)
+    return result
+
+
+def error(values, fmt, func, args, ctx):
+    """Return the largest difference between the values and the values
+    that are decoded from what's written, None if that can't be worked out"""
+    name = getattr(func, 'func', func).__name__ if func != None else None
+    if name in ENCODINGS:
+        encoded = np.asarray(array_forms.apply(func, values, ctx, args))
+        decode = ENCODINGS[name][1]
+    else:
+        if func != None:
+            values = array_forms.apply(func, values, ctx, args)
+            if values is None:
+                return None     # No array form
+            values = np.asarray(values, dtype=np.float64)
+        encoded, decode = values, lambda halves: halves.astype(np.float16).astype(np.float64)
+
+    # Only the components that are written count
+    if encoded.ndim == 2:
+        encoded = encoded[:, :len(fmt)]
+    decoded = decode(encoded)
+    if decoded.ndim != values.ndim:
+        return None
+    if values.ndim == 2:
+        width = min(values.shape[1], decoded.shape[1])
+        values, decoded = values[:, :width], decoded[:, :width]
+    if not values.size:
+        return 0.0
+    result = float(np.max(np.abs(decoded - values)))
+    return result if np.isfinite(result) else None
+
+
+def measure_errors(scene, obj, m, compiled, specs, reverse_loop, apply_transforms, errors):
+    """Measure the error of the quantized attributes of the mesh m (evaluated
+    but not transformed yet) and keep the largest one per attribute in errors"""
+    import bpy
+    from .vectorized import corner_indices, mesh_sources, read_column
+
+    offsets = list(accumulate((calcsize(spec[2]) for spec in specs), initial=0))
+    quantized = {offsets[i]: i for i, name in enumerate(encodings(specs)) if name}
+    if not quantized:
+        return
+
+    if apply_transforms:
+        m = m.copy()
+        m.transform(obj.matrix_world)
+    try:
+        corners = corner_indices(m, reverse_loop)
+        if corners is None:
+            return
+        sources = mesh_sources(m, *corners)
+        ctx = {'scene': scene, 'object': obj}
+        for source, prop, occurrence in compiled.occurrences():
+            offset, attr_blen, fmt, index, func, args = occurrence
+            if offset not in quantized or not sources.get(source):
+                continue
+            collection, corner_index = sources[source]
+            values = read_column(collection, source, prop, corner_index)
+            if values is None:
+                continue
+            try:
+                value = error(values, fmt, func, args, ctx)
+            except (ValueError, IndexError, TypeError, KeyError):
+                continue
+            if value is not None:
+                i = quantized[offset]
+                errors[i] = max(errors.get(i, 0.0), value)
+    finally:
+        if apply_transforms:
+            bpy.data.meshes.remove(m)
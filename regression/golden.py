@@ -0,0 +1,415 @@
+# Golden output regression check
+#
+# Exports a corpus of small generated scenes with every bundled preset in
+# several modes (indexed, split and delta layouts, ...) and compares the
+# output byte for byte with the expected output stored in golden/.
+# The vertex buffers of the modes that the original exporter already had
+# (BASELINE_MODES) are written by the add-on as it was at the BASELINE
+# revision, those of the other modes by the per loop engine. Every way to
+# get the same result (both engines, the export cache, background workers)
+# has to produce exactly the same bytes.
+#
+# Note that the expected output of the other modes is whatever the per loop
+# engine wrote when it was last updated, so it only catches changes made
+# after that, not mistakes the engine already made then. Only the
+# BASELINE_MODES are checked against an independent implementation.
+#
+# Scenes can add attributes to the presets' vertex formats (the 'attributes'
+# setting), e.g. ShaderNode inputs, which the baseline exporter needs to
+# export materials with a node tree.
+#
+# When bytes differ, the vertex records are decoded using the format
+# description in the JSON file, to show which attribute of which vertex
+# of which object and frame changed.
+#
+# Write the expected output (only after checking that it is correct!),
+# this needs git to extract the baseline revision:
+#
+# python regression/golden.py --update
+#
+# Compare (exits with a non-zero code if anything differs):
+#
+# python regression/golden.py
+#
+# Both also run in a background Blender session (blender -b --python regression/golden.py -- ...).
+#
+
+import argparse
+import filecmp
+import glob
+import importlib
+import inspect
+import io
+import json
+import os
+import shutil
+import subprocess
+import sys
+import tarfile
+import tempfile
+from struct import calcsize, unpack_from
+
+import bpy
+
+REGRESSION_DIR = os.path.dirname(os.path.abspath(__file__))
+GOLDEN_DIR = os.path.join(REGRESSION_DIR, "golden")
+sys.path.insert(0, os.path.join(os.path.dirname(REGRESSION_DIR), "benchmarks"))
+
+import bench_export
+from bench_export import (
+    COLLECTION,
+    add_object,
+    grid_mesh,
+    reset_scene,
+)
+
+# Export settings that change the output, the expected output is stored per mode
+MODES = {
+    'full': {},
+    'indexed': {'index_buffer': 'auto'},
+    'split': {'frame_layout': 'split'},
+    'delta': {'frame_layout': 'delta'},
+    'skip_unchanged': {'skip_unchanged': True},
+    'optimized': {'optimize_order': True},
+    'grouped': {'group_by_material': True},
+    'grouped_indexed': {'group_by_material': True, 'index_buffer': 'auto', 'optimize_order': True},
+    'shape_keys': {'shape_keys': 'relative'},
+    'shape_keys_indexed': {'shape_keys': 'absolute', 'index_buffer': 'auto', 'optimize_order': True},
+    'per_frame': {'batch_mode': 'perfra'},
+}
+
+# Revision of the original exporter, that the expected output of BASELINE_MODES comes from
+BASELINE = "909331b"
+
+# Modes that the original exporter can export (a single file with full vertex records)
+BASELINE_MODES = ('full',)
+
+# Name that the add-on at the baseline revision is imported as
+BASELINE_PACKAGE = "vbx_baseline"
+
+# Ways of exporting that must give the same output as the reference
+REFERENCE = {'engine': 'loop'}
+VARIANTS = {
+    'vectorized': {'engine': 'vectorized'},
+    'cache': {'engine': 'vectorized', 'use_cache': True},     # Run twice: filled, then hit
+}
+
+# Maximum number of differences reported per file
+MAX_REPORTED = 10
+
+
+def scene_static():
+    """Three small objects, one with two materials and one with shape keys"""
+    collection = reset_scene()
+    m = grid_mesh("Grid", 8)
+    for name in ("Red", "Blue"):
+        mat = bpy.data.materials.new(name)
+        mat.diffuse_color = (name == "Red", 0, name == "Blue", 1)
+        if mat.node_tree:
+            # Materials get a node tree in Blender 5, which the baseline exporter
+            # can only export if the format has a ShaderNode attribute
+            mat.node_tree.nodes.clear()
+        m.materials.append(mat)
+    m.polygons[0].material_index = 1
+    add_object(collection, "Grid", m)
+    add_object(collection, "Small", grid_mesh("Small", 2), (3, 0, 0))
+
+    # Shape keys, for the shape_keys modes
+    face = add_object(collection, "Face", grid_mesh("Face", 32), (0, 3, 0))
+    face.shape_key_add(name="Basis")
+    for i, name in enumerate(("Smile", "Blink")):
+        block = face.shape_key_add(name=name)
+        block.value = 0.25 * i
+        for point in block.data[:][i::3]:
+            point.co.z += 0.5 + i
+    return {}
+
+
+def scene_shaded():
+    """An object with node tree materials, exported with ShaderNode attributes
+
+    The input of the last node that has it is written (like the baseline
+    exporter does), zeros if no node has it
+    """
+    collection = reset_scene()
+    m = grid_mesh("Shaded", 8)
+    for i, name in enumerate(("Plastic", "Metal", "Output")):
+        mat = bpy.data.materials.new(name)
+        mat.use_nodes = True
+        nodes = mat.node_tree.nodes
+        bsdf = nodes["Principled BSDF"]
+        bsdf.inputs["Base Color"].default_value = (0.25 * i, 0.5, 0.75, 1)
+        bsdf.inputs["Roughness"].default_value = 0.25 + 0.25 * i
+        if name == "Plastic":
+            nodes.remove(nodes["Material Output"])     # The Principled BSDF is the last node
+        elif name == "Metal":
+            diffuse = nodes.new('ShaderNodeBsdfDiffuse')
+            diffuse.inputs["Color"].default_value = (0.5, 0.25, 0, 1)
+            diffuse.inputs["Roughness"].default_value = 0.125
+        m.materials.append(mat)
+    for polygon in m.polygons:
+        polygon.material_index = polygon.index % 3
+    add_object(collection, "Shaded", m)
+    return {'attributes': [('ShaderNode', 'Base Color', 'ffff'), ('ShaderNode', 'Roughness', 'f')]}
+
+
+def scene_animated():
+    """A moving object and one that stands still, over a few frames"""
+    collection = reset_scene()
+    moving = add_object(collection, "Moving", grid_mesh("Moving", 8))
+    add_object(collection, "Still", grid_mesh("Still", 2), (3, 0, 0))
+    scene = bpy.context.scene
+    scene.frame_start, scene.frame_end = 1, 4
+    for frame in (1, 3):
+        moving.location.z = frame
+        moving.keyframe_insert('location', frame=frame)
+    return {'frame_option': 'all'}
+
+
+SCENES = {
+    'static': scene_static,
+    'shaded': scene_shaded,
+    'animated': scene_animated,
+}
+
+
+def with_attributes(headless, preset, settings):
+    """Return the settings, with the scene's attributes (if any) added to the preset's vertex format"""
+    settings = dict(settings)
+    attributes = settings.pop('attributes', ())
+    if attributes:
+        vertex_format = headless.load_preset(preset)['vertex_format']
+        for data_source, data_property, fmt in attributes:
+            attribute = vertex_format.add()
+            attribute.data_source, attribute.data_property, attribute.fmt = data_source, data_property, fmt
+        settings['vertex_format'] = vertex_format
+    return settings
+
+
+def export(headless, preset, settings, directory):
+    """Export the scene's collection to the directory, return the blmod part of the description"""
+    output = os.path.join(directory, "golden.vbx")
+    headless.export(preset, output, COLLECTION, export_json_data=True, **with_attributes(headless, preset, settings))
+    with open(os.path.join(directory, "golden.json")) as f_desc:
+        blmod = json.load(f_desc)["blmod"]
+    blmod.pop("blender_version", None)
+    blmod.pop("stats", None)
+    os.remove(os.path.join(directory, "golden.json"))
+    return blmod
+
+
+def import_baseline(revision, directory):
+    """Extract the add-on at the given revision to the directory and import
+    its exporter as a package of its own, return the module"""
+    archive = subprocess.run(["git", "archive", "--format=tar", revision], cwd=bench_export.ADDON_DIR,
+                             check=True, stdout=subprocess.PIPE).stdout
+    with tarfile.open(fileobj=io.BytesIO(archive)) as tar:
+        tar.extractall(os.path.join(directory, BASELINE_PACKAGE))
+    sys.path.insert(0, directory)
+    return importlib.import_module(BASELINE_PACKAGE + ".export_gms_vtx_buffer")
+
+
+def export_baseline(baseline, headless, preset, settings, directory):
+    """Export the scene's collection to the directory with the baseline exporter, only the vertex buffers
+
+    The settings that the baseline exporter doesn't have (e.g. the engine) are left out
+    """
+    keywords = headless.load_preset(preset)
+    keywords.update(with_attributes(headless, preset, settings))
+    parameters = inspect.signature(baseline.export).parameters
+    keywords = {key: value for key, value in keywords.items() if key in parameters}
+    keywords.update(
+        filepath=os.path.join(directory, "golden.vbx"),
+        scene=bpy.context.scene,
+        object_selection=bpy.data.collections[COLLECTION].all_objects[:],
+        export_json_data=False,
+        object_types_to_export=set(),
+        export_images=False,
+    )
+    bpy.types.Object.batch_index = bpy.props.IntProperty(name="Batch Index")    # export() removes it
+    baseline.export(**keywords)
+
+
+def update_from_baseline(baseline, headless, preset, settings, expected_dir, temp_dir):
+    """Replace the vertex buffers in expected_dir with the ones the baseline exporter writes
+
+    Returns lines that describe how the current output differs from them
+    """
+    baseline_dir = tempfile.mkdtemp(dir=temp_dir)
+    export_baseline(baseline, headless, preset, settings, baseline_dir)
+    with open(os.path.join(expected_dir, "blmod.json")) as f_desc:
+        blmod = json.load(f_desc)
+    lines = []
+    for name in sorted(os.listdir(baseline_dir)):
+        baseline_path, expected_path = os.path.join(baseline_dir, name), os.path.join(expected_dir, name)
+        if not os.path.exists(expected_path):
+            lines.append("  {} is missing".format(name))
+        elif not filecmp.cmp(baseline_path, expected_path, shallow=False):
+            with open(baseline_path, "rb") as f_baseline, open(expected_path, "rb") as f_current:
+                lines.append("  {} differs".format(name))
+                lines.extend(describe_differences(blmod, name, f_baseline.read(), f_current.read()))
+        shutil.copyfile(baseline_path, expected_path)
+    shutil.rmtree(baseline_dir)
+    return lines
+
+
+def record_layout(blmod):
+    """Return the offset, format and name of each attribute and the record size,
+    as written with a full frame layout"""
+    attributes, offset = [], 0
+    for i, attr in enumerate(blmod["mesh_data"]["format"]):
+        attributes.append((offset, attr["fmt"], "{}: {}.{}".format(i, attr["type"], attr["attr"])))
+        offset += calcsize(attr["fmt"])
+    return attributes, offset
+
+
+def locate(blmod, location, pos):
+    """Return a description of what's stored at the byte position in the file"""
+    attributes, stride = record_layout(blmod)
+    full = blmod["mesh_data"]["layout"]["mode"] == 'full'
+    for entry in blmod["mesh_data"]["files"]:
+        if entry["location"] != location:
+            continue
+        for name, ranges in entry["ranges"].items():
+            if "frames" not in ranges or not stride:
+                continue
+            frame_size = ranges["no_verts"] * stride
+            relative = pos - ranges["offset"]
+            if not full or not 0 <= relative < frame_size * len(ranges["frames"]):
+                continue
+            frame = ranges["frames"][relative // frame_size]
+            vertex, record_pos = divmod(relative % frame_size, stride)
+            for offset, fmt, label in attributes:
+                if offset <= record_pos < offset + calcsize(fmt):
+                    return name, frame, vertex, offset, fmt, label, relative - record_pos
+    return None
+
+
+def describe_differences(blmod, location, expected, actual):
+    """Return lines that describe the first differences between two versions of a file"""
+    lines = []
+    if len(expected) != len(actual):
+        lines.append("  size {} instead of {}".format(len(actual), len(expected)))
+    reported = set()
+    for pos in range(min(len(expected), len(actual))):
+        if expected[pos] == actual[pos]:
+            continue
+        found = locate(blmod, location, pos)
+        if found is None:
+            lines.append("  byte {}: {} instead of {}".format(pos, actual[pos], expected[pos]))
+            key = pos
+        else:
+            name, frame, vertex, offset, fmt, label, record_start = found
+            key = (name, frame, vertex, offset)
+            if key in reported:
+                continue
+            start = record_start + offset
+            lines.append("  object '{}' frame {} vertex {} attribute {}: {} instead of {}".format(
+                name, frame, vertex, label,
+                unpack_from("=" + fmt, actual, start), unpack_from("=" + fmt, expected, start)))
+        reported.add(key)
+        if len(reported) >= MAX_REPORTED:
+            lines.append("  ...")
+            break
+    return lines
+
+
+def compare(blmod_expected, expected_dir, blmod_actual, actual_dir):
+    """Return lines that describe everything that differs, an empty list if nothing does"""
+    lines = []
+    if blmod_actual != blmod_expected:
+        lines.append("  the description (blmod) differs")
+
+    files = lambda directory: {os.path.relpath(path, directory).replace(os.sep, "/")
+                               for path in glob.glob(os.path.join(directory, "**", "*"), recursive=True)
+                               if os.path.isfile(path) and not path.endswith("blmod.json")}
+    expected_files, actual_files = files(expected_dir), files(actual_dir)
+    for location in sorted(expected_files ^ actual_files):
+        lines.append("  {} {}".format(location, "is missing" if location in expected_files else "is new"))
+    for location in sorted(expected_files & actual_files):
+        expected_path, actual_path = os.path.join(expected_dir, location), os.path.join(actual_dir, location)
+        if filecmp.cmp(expected_path, actual_path, shallow=False):
+            continue
+        with open(expected_path, "rb") as f_expected, open(actual_path, "rb") as f_actual:
+            expected, actual = f_expected.read(), f_actual.read()
+        lines.append("  {} differs".format(location))
+        lines.extend(describe_differences(blmod_expected, location, expected, actual))
+    return lines
+
+
+def main(argv):
+    parser = argparse.ArgumentParser(prog="golden.py", description="Compare the export output with the expected output")
+    parser.add_argument("--update", action="store_true", help="Write the expected output instead of comparing")
+    parser.add_argument("--workers", type=int, default=0, help="Also compare an export with this many background workers")
+    parser.add_argument("--baseline", default=BASELINE, help="Revision of the exporter that writes the expected vertex buffers of {}".format(", ".join(BASELINE_MODES)))
+    args = parser.parse_args(argv)
+
+    if not args.update and not os.path.isdir(GOLDEN_DIR):
+        print("There's no expected output in {}, write it with --update".format(GOLDEN_DIR))
+        return 2
+
+    headless = bench_export.import_addon()
+    variants = dict(VARIANTS)
+    if args.workers > 1:
+        variants['workers'] = {'engine': 'vectorized', 'workers': args.workers}
+
+    failures = 0
+    with tempfile.TemporaryDirectory() as temp_dir:
+        cache_dir = os.path.join(temp_dir, "cache")
+        baseline = import_baseline(args.baseline, temp_dir) if args.update else None
+        for scene_name, setup in SCENES.items():
+            scene_settings = setup()
+            for preset in sorted(glob.glob(os.path.join(bench_export.ADDON_DIR, "presets", "*.py"))):
+                preset_name = os.path.splitext(os.path.basename(preset))[0]
+                for mode, mode_settings in MODES.items():
+                    name = "{}/{}/{}".format(scene_name, preset_name, mode)
+                    expected_dir = os.path.join(GOLDEN_DIR, scene_name, preset_name, mode)
+                    settings = dict(scene_settings, **mode_settings)
+
+                    if args.update:
+                        shutil.rmtree(expected_dir, ignore_errors=True)
+                        os.makedirs(expected_dir)
+                        blmod = export(headless, preset, dict(settings, **REFERENCE), expected_dir)
+                        with open(os.path.join(expected_dir, "blmod.json"), "w") as f_desc:
+                            json.dump(blmod, f_desc, indent=1, sort_keys=True)
+                        if mode in BASELINE_MODES:
+                            lines = update_from_baseline(baseline, headless, preset, settings, expected_dir, temp_dir)
+                            if lines:
+                                failures += 1
+                                print("FAIL {} (the per loop engine differs from the baseline)".format(name))
+                                print("\n".join(lines))
+                        print("Updated", name)
+                        continue
+
+                    blmod_path = os.path.join(expected_dir, "blmod.json")
+                    if not os.path.exists(blmod_path):
+                        failures += 1
+                        print("FAIL {} (no expected output, write it with --update)".format(name))
+                        continue
+                    with open(blmod_path) as f_desc:
+                        blmod_expected = json.load(f_desc)
+                    runs = [('reference', REFERENCE)] + list(variants.items())
+                    for variant, variant_settings in runs:
+                        variant_settings = dict(variant_settings)
+                        if variant_settings.get('use_cache'):
+                            variant_settings['cache_directory'] = cache_dir
+                        for attempt in range(2 if variant == 'cache' else 1):
+                            actual_dir = tempfile.mkdtemp(dir=temp_dir)
+                            blmod_actual = export(headless, preset, dict(settings, **variant_settings), actual_dir)
+                            lines = compare(blmod_expected, expected_dir, blmod_actual, actual_dir)
+                            shutil.rmtree(actual_dir)
+                            if lines:
+                                failures += 1
+                                print("FAIL {} ({}, run {})".format(name, variant, attempt + 1))
+                                print("\n".join(lines))
+                            else:
+                                print("ok   {} ({})".format(name, variant))
+
+    if failures:
+        print("{} exports differ from the expected output".format(failures))
+    return 1 if failures else 0
+
+
+if __name__ == "__main__":
+    argv = sys.argv[sys.argv.index("--") + 1:] if "--" in sys.argv else sys.argv[1:]
+    sys.exit(main(argv))
@@ -1,14 +1,25 @@
 import bpy
+import json
+import os
 
 # Some definitions
 TEMP_MAT_NAME = "Temporary Material"
+SCHEMA_VERSION = 1      # Change this when the stored schema changes
 SUPPORTED_SHADERNODE_INPUT_DATA_TYPES = ('VALUE', 'INT', 'BOOLEAN', 'VECTOR', 'ROTATION', 'RGBA')
 
 # Modified workaround to get shader inputs based on answer provided here: 
 # https://blender.stackexchange.com/a/254595
 # 
-def get_shader_nodes_inputs():
-    """Get all inputs of all supported shader nodes"""
+def compute_shader_schema():
+    """Get all supported inputs of all shader nodes as a dict of
+    node class -> [(input name, description, type), ...]
+
+    The name is the socket's name as shown in the UI (e.g. "Base Color"),
+    which is also how an input is looked up when exporting
+
+    Creates every type of shader node in a temporary material, so it's slow
+    and it can't run while Blender restricts access to bpy.data
+    """
     
     prefix = 'ShaderNode'
     excluded = (prefix, 'ShaderNodeCustomGroup', 'ShaderNodeTree', 'ShaderNodeAddShader', ' ShaderNodeGroup', 'ShaderNodeScript', 'ShaderNodeOutputMaterial')
@@ -26,8 +37,7 @@ def get_shader_nodes_inputs():
     for name in names:
         nodes.clear()
         node = nodes.new(name)
-        socket_to_dict = lambda s: (s.name, s.name, s.description)
-        inputs = [socket_to_dict(input) for input in node.inputs if input.type in SUPPORTED_SHADERNODE_INPUT_DATA_TYPES]
+        inputs = [(input.name, input.description, input.type) for input in node.inputs if input.type in SUPPORTED_SHADERNODE_INPUT_DATA_TYPES]
 
         # Don't return nodes that have no inputs
         if len(inputs) == 0:
@@ -40,27 +50,48 @@ def get_shader_nodes_inputs():
 
     return out
 
-def get_shader_input_attr(shader_node_subclass, input_name, attr_name):
-    """A 'getattr' for shader nodes
 
-    shader_node_subclass: One of the subclasses of: https://docs.blender.org/api/current/bpy.types.ShaderNode.html
-    input_name: the input on which to look up the attribute
-    attr_name: the name of the attribute to look up
+# The schema only changes with Blender itself, so it's computed once per
+# Blender build and stored in the user config directory
+_schema = None
 
-    """
+def schema_path():
+    directory = bpy.utils.user_resource('CONFIG', path="vbx_shader_schema", create=True)
+    return os.path.join(directory, "shader_inputs_{}.json".format("_".join(str(v) for v in bpy.app.version)))
 
-    # Create a "dummy" material on which we can lookup inputs
-    temp_mat = bpy.data.materials.get(TEMP_MAT_NAME)
-    if not temp_mat:
-        temp_mat = bpy.data.materials.new(TEMP_MAT_NAME)
-        
-    temp_mat.use_nodes = True
-    nodes = temp_mat.node_tree.nodes
-    n = nodes.new(shader_node_subclass)
+def schema_key():
+    """What the stored schema must have been made with"""
+    build_hash = bpy.app.build_hash
+    return [SCHEMA_VERSION, list(bpy.app.version), build_hash.decode() if isinstance(build_hash, bytes) else build_hash]
 
-    result = getattr(n.inputs[input_name], attr_name)
+def get_shader_schema(compute=True):
+    """Return the shader node input schema (see compute_shader_schema)
 
-    nodes.clear()
-    bpy.data.materials.remove(temp_mat)
+    It's read from the cache file, or else computed and stored, the first time.
+    Returns None if there's no cache file and compute is False.
+    """
+    global _schema
+    if _schema is not None:
+        return _schema
+
+    path = schema_path()
+    try:
+        with open(path) as f_schema:
+            stored = json.load(f_schema)
+        if stored.get("key") == schema_key():
+            _schema = {name: [tuple(input) for input in inputs] for name, inputs in stored["nodes"].items()}
+            return _schema
+    except (OSError, ValueError, KeyError, AttributeError):
+        pass
 
-    return result
+    if not compute:
+        return None
+    _schema = compute_shader_schema()
+    try:
+        temp_path = path + ".tmp"
+        with open(temp_path, "w") as f_schema:
+            json.dump({"key": schema_key(), "nodes": _schema}, f_schema, separators=(",", ":"))
+        os.replace(temp_path, path)
+    except OSError:
+        pass    # It's only a cache
+    return _schema
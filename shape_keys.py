@@ -0,0 +1,117 @@
+# Shape keys as morph targets
+#
+# Instead of baking the frames of an animation that blends shape keys, the
+# positions of every key block are written once, as a target that the shader
+# blends between. The key blocks are read with foreach_get from the original
+# mesh, the timeline isn't touched.
+#
+# A target has a position (fff) per vertex record, in the order the records
+# are written: the key block's vertices are mapped through the loops of the
+# triangulated (evaluated) mesh. That only works when the modifiers keep the
+# vertices of the original mesh (e.g. Triangulate, Armature), so objects whose
+# evaluated mesh has a different number of vertices get no targets.
+#
+# Absolute targets contain the positions of the key block, relative targets
+# the difference with the reference key (the basis), which itself isn't written.
+# All targets of an object are written consecutively, as the object's
+# 'shape_keys' block.
+#
+
+import numpy as np
+
+# Format of a position in a target
+TARGET_FMT = 'fff'
+
+
+def key_blocks(obj):
+    """Return the key blocks of the object, an empty list if it has none"""
+    if obj.type != 'MESH' or obj.data.shape_keys is None:
+        return []
+    return list(obj.data.shape_keys.key_blocks)
+
+
+def read_co(key_block):
+    """Return the positions of the key block's vertices, a row per vertex"""
+    co = np.empty(len(key_block.data) * 3, dtype=np.float32)
+    key_block.data.foreach_get('co', co)
+    return co.reshape(-1, 3).astype(np.float64)
+
+
+def morph_targets(obj, m, corner_vertices, mode, apply_transforms):
+    """Return the targets of the object as a list of (key name, positions per corner)
+
+    m is the object's evaluated mesh and corner_vertices the vertex of every
+    corner, in the order the corners are written. Returns an empty list if
+    the object has no shape keys or they can't be mapped to the corners.
+    """
+    blocks = key_blocks(obj)
+    if not blocks or len(m.vertices) != len(obj.data.vertices):
+        return []       # The modifiers added or removed vertices
+
+    matrix = np.array(obj.matrix_world, dtype=np.float64)
+    reference = obj.data.shape_keys.reference_key
+    basis = read_co(reference)
+
+    targets = []
+    for block in blocks:
+        if mode == 'relative':
+            if block == reference:
+                continue
+            positions = read_co(block) - basis
+            if apply_transforms:
+                positions = positions @ matrix[:3, :3].T    # Offsets, so no translation
+        else:
+            positions = read_co(block)
+            if apply_transforms:
+                positions = positions @ matrix[:3, :3].T + matrix[:3, 3]
+        targets.append((block.name, positions[corner_vertices].astype(np.float32)))
+    return targets
+
+
+def per_vertex(targets, indices):
+    """Return the targets with a position per unique vertex instead of per corner
+
+    indices is the unique vertex of every corner. Vertices are only merged
+    when their targets are identical too (see target_records), so any of the
+    corners of a vertex will do.
+    """
+    no_verts = int(indices.max()) + 1 if len(indices) else 0
+    corner = np.empty(no_verts, dtype=np.int64)
+    corner[indices[::-1]] = np.arange(len(indices))[::-1]     # The first corner of every vertex
+    return [(name, positions[corner]) for name, positions in targets]
+
+
+def target_records(targets):
+    """Return the positions of all targets as a single array with a row (record)
+    per corner or vertex, e.g. to keep vertices with different targets from
+    being merged or to reorder the targets along with the vertices"""
+    return np.ascontiguousarray(np.stack([positions for name, positions in targets], axis=1))
+
+
+def from_records(targets, data):
+    """Return the targets, with their positions taken from the bytes of the records (see target_records)"""
+    records = np.frombuffer(data, dtype=np.float32).reshape(-1, len(targets), 3)
+    return [(name, records[:, i]) for i, (name, positions) in enumerate(targets)]
+
+
+def target_data(targets):
+    """Return the bytes of the targets, one after the other"""
+    return b"".join(positions.tobytes() for name, positions in targets)
+
+
+def target_ranges(obj, targets, mode):
+    """Return the description of the object's 'shape_keys' block, the offset
+    of each target is added once the block's offset is known (see add_offsets)"""
+    return {
+        "mode":mode,
+        "fmt":TARGET_FMT,
+        **({"basis":obj.data.shape_keys.reference_key.name} if mode == 'relative' else {}),
+        "size":targets[0][1].nbytes if targets else 0,
+        "keys":[{"name":name} for name, positions in targets],
+    }
+
+
+def add_offsets(block_range):
+    """Add the offset of each target, given the offset of the block"""
+    for i, key in enumerate(block_range["keys"]):
+        key["offset"] = block_range["offset"] + i * block_range["size"]
@@ -0,0 +1,35 @@
+# Test setup
+#
+# The tests need bpy, either as a module (pip install bpy) or by running
+# pytest in a background Blender session. They share the scene generators
+# of the benchmarks.
+#
+# python -m pytest tests
+#
+
+import importlib
+import os
+import sys
+
+import pytest
+
+bpy = pytest.importorskip("bpy")
+
+TESTS_DIR = os.path.dirname(os.path.abspath(__file__))
+ADDON_DIR = os.path.dirname(TESTS_DIR)
+sys.path.insert(0, os.path.join(ADDON_DIR, "benchmarks"))
+
+import bench_export
+
+
+@pytest.fixture(scope="session")
+def addon():
+    """The add-on package, imported by its directory name"""
+    bench_export.import_addon()
+    return importlib.import_module(os.path.basename(ADDON_DIR))
+
+
+@pytest.fixture
+def preset():
+    """Return the path of a bundled preset"""
+    return lambda name: os.path.join(ADDON_DIR, "presets", name + ".py")
@@ -0,0 +1,26 @@
+import os
+
+from bench_export import (
+    COLLECTION,
+    add_object,
+    grid_mesh,
+    reset_scene,
+)
+
+
+def test_file_names_are_unique(addon):
+    collection = reset_scene()
+    objects = [add_object(collection, name, grid_mesh(name, 2)) for name in ("Cube.001", "Cube_001", "cube_001")]
+    names = addon.export_gms_vtx_buffer.file_names(objects)
+    assert names[objects[0]] == "Cube_001"
+    assert len({name.lower() for name in names.values()}) == len(objects)
+
+
+def test_per_object_files_dont_overwrite(addon, preset, tmp_path):
+    collection = reset_scene()
+    add_object(collection, "Cube.001", grid_mesh("A", 2))
+    add_object(collection, "Cube_001", grid_mesh("B", 8))
+    addon.headless.export(preset("passthrough"), str(tmp_path / "out.vbx"), COLLECTION, batch_mode='perobj')
+    sizes = sorted(os.path.getsize(tmp_path / name) for name in os.listdir(tmp_path))
+    assert len(sizes) == 2 and sizes[0] < sizes[1]
+
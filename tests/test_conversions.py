@@ -0,0 +1,63 @@
+from struct import pack
+
+import bpy
+import pytest
+from bench_export import (
+    COLLECTION,
+    add_object,
+    reset_scene,
+)
+
+
+def negative_zero_scene():
+    collection = reset_scene()
+    m = bpy.data.meshes.new("Triangle")
+    m.from_pydata([(0, 0, -0.0), (1, 0, -0.0), (0, 1, -0.0)], [], [(0, 1, 2)])
+    add_object(collection, "Triangle", m)
+
+
+def export(addon, preset, path, data_property, fmt, func, **settings):
+    vertex_format = addon.headless.VertexFormat()
+    attribute = vertex_format.add()
+    attribute.data_source, attribute.data_property, attribute.fmt, attribute.func = 'MeshVertex', data_property, fmt, func
+    addon.headless.export(preset("passthrough"), path, COLLECTION, vertex_format=vertex_format, **settings)
+    with open(path, "rb") as f:
+        return f.read()
+
+
+@pytest.mark.parametrize("func", ['dot_with_light_vector', 'invert_y', 'invert_y_and_z'])
+def test_negative_zero(addon, preset, tmp_path, func):
+    negative_zero_scene()
+    fmt = 'f' if func == 'dot_with_light_vector' else 'fff'
+    loop = export(addon, preset, str(tmp_path / "loop.vbx"), 'co', fmt, func, engine='loop')
+    vectorized = export(addon, preset, str(tmp_path / "vectorized.vbx"), 'co', fmt, func, engine='vectorized')
+    assert len(loop) == 3 * 4 * len(fmt)
+    assert vectorized == loop
+
+
+def polygon_index(val, ctx=None):
+    return ctx["polygon"].index
+
+
+def frame_number(val, ctx=None):
+    return ctx["scene"].frame_current
+
+
+@pytest.mark.parametrize("engine", ['loop', 'vectorized'])
+def test_constant_source_context(addon, preset, tmp_path, monkeypatch, engine):
+    negative_zero_scene()
+    monkeypatch.setattr(addon.conversions, "polygon_index", polygon_index, raising=False)
+    monkeypatch.setattr(addon.conversions, "frame_number", frame_number, raising=False)
+    bpy.context.scene.frame_current = 7
+
+    vertex_format = addon.headless.VertexFormat()
+    attribute = vertex_format.add()
+    attribute.data_source, attribute.data_property, attribute.fmt, attribute.func = 'Object', 'pass_index', 'i', 'frame_number'
+    path = str(tmp_path / "out.vbx")
+    addon.headless.export(preset("passthrough"), path, COLLECTION, vertex_format=vertex_format, engine=engine)
+    with open(path, "rb") as f:
+        assert f.read() == pack("=3i", 7, 7, 7)
+
+    attribute.func = 'polygon_index'
+    with pytest.raises(KeyError, match=r"Object\.pass_index can't use ctx\['polygon'\].*'scene', 'object'"):
+        addon.headless.export(preset("passthrough"), path, COLLECTION, vertex_format=vertex_format, engine=engine)
@@ -0,0 +1,31 @@
+import glob
+import json
+import os
+import sys
+
+import pytest
+
+ADDON_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.join(ADDON_DIR, "regression"))
+
+import golden
+
+PRESETS = sorted(glob.glob(os.path.join(ADDON_DIR, "presets", "*.py")))
+
+
+@pytest.mark.parametrize("preset", PRESETS, ids=lambda path: os.path.splitext(os.path.basename(path))[0])
+@pytest.mark.parametrize("scene_name", sorted(golden.SCENES))
+@pytest.mark.parametrize("mode", golden.BASELINE_MODES)
+@pytest.mark.parametrize("engine", ['vectorized', 'loop'])
+def test_same_bytes_as_baseline(addon, tmp_path, scene_name, preset, mode, engine):
+    """The vertex buffers of the modes that the original exporter has are the ones it wrote"""
+    expected_dir = os.path.join(golden.GOLDEN_DIR, scene_name, os.path.splitext(os.path.basename(preset))[0], mode)
+    if not os.path.isdir(expected_dir):
+        pytest.fail("No expected output in {}, write it with regression/golden.py --update".format(expected_dir))
+
+    settings = dict(golden.SCENES[scene_name](), **golden.MODES[mode])
+    blmod = golden.export(addon.headless, preset, dict(settings, engine=engine), str(tmp_path))
+    with open(os.path.join(expected_dir, "blmod.json")) as f_desc:
+        blmod_expected = json.load(f_desc)
+    lines = golden.compare(blmod_expected, expected_dir, blmod, str(tmp_path))
+    assert not lines, "\n".join(lines)
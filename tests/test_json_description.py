@@ -0,0 +1,57 @@
+import json
+from importlib import import_module
+
+import bpy
+from bench_export import (
+    add_object,
+    grid_mesh,
+    reset_scene,
+)
+
+DATATYPES = ['objects', 'meshes', 'materials']
+
+
+def scene(count):
+    """Objects that share a mesh with a material"""
+    collection = reset_scene()
+    m = grid_mesh("Grid", 8)
+    m.materials.append(bpy.data.materials.new("Material"))
+    return [add_object(collection, "Object{}".format(i), m) for i in range(count)]
+
+
+def write(addon, path, selected, datatypes):
+    """Write the description, return its bpy part, the largest number of
+    conversions the memo held and the pointers of the ones it still holds"""
+    json_description = import_module(addon.__name__ + ".json_description")
+    peak = [0]
+
+    class Serializer(json_description.JsonSerializer):
+        def datablock(self, obj, again=False):
+            result = super().datablock(obj, again)
+            peak[0] = max(peak[0], len(self.memo))
+            return result
+
+    serializer = Serializer()
+    json_description.write_description(path, serializer, selected, datatypes, lambda: {})
+    with open(path) as f_desc:
+        return json.load(f_desc)["bpy"], peak[0], {pointer for pointer, depth in serializer.memo}
+
+
+def test_memo_only_holds_what_is_written_again(addon, tmp_path):
+    objects = scene(30)
+    selected = objects[:3]
+    description, peak, remaining = write(addon, str(tmp_path / "description.json"), selected, DATATYPES)
+
+    assert peak <= len(selected) + 2        # The selected objects, the shared mesh and material
+    assert not remaining & {obj.as_pointer() for obj in objects}
+    assert len(description["data"]["objects"]) == len(objects)
+    for obj, converted in zip(selected, description["context"]["selected_objects"]):
+        assert converted == description["data"]["objects"][obj.name]
+
+
+def test_objects_are_not_kept_if_not_written_again(addon, tmp_path):
+    objects = scene(10)
+    description, peak, remaining = write(addon, str(tmp_path / "description.json"), objects, ['meshes'])
+    assert peak <= 2
+    assert not remaining & {obj.as_pointer() for obj in objects}
+    assert [converted["name"] for converted in description["context"]["selected_objects"]] == [obj.name for obj in objects]
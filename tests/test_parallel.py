@@ -0,0 +1,45 @@
+import filecmp
+import os
+
+import bpy
+from bench_export import (
+    COLLECTION,
+    add_object,
+    grid_mesh,
+    reset_scene,
+)
+
+
+def animated_scene():
+    """Three objects, one of them moving, over a few frames"""
+    collection = reset_scene()
+    moving = add_object(collection, "Moving", grid_mesh("Moving", 32))
+    add_object(collection, "Still", grid_mesh("Still", 8), (3, 0, 0))
+    add_object(collection, "Other", grid_mesh("Other", 2), (-3, 0, 0))
+    scene = bpy.context.scene
+    scene.frame_start, scene.frame_end = 1, 4
+    for frame in (1, 4):
+        moving.location.z = frame
+        moving.keyframe_insert('location', frame=frame)
+
+
+def export(addon, preset, directory, **settings):
+    vertex_format = addon.headless.VertexFormat()
+    for source, prop, fmt in (('MeshVertex', 'co', 'fff'), ('Object', 'batch_index', 'i'), ('MeshLoop', 'normal', 'fff')):
+        attribute = vertex_format.add()
+        attribute.data_source, attribute.data_property, attribute.fmt = source, prop, fmt
+    os.makedirs(directory)
+    addon.headless.export(preset("passthrough"), os.path.join(directory, "out.vbx"), COLLECTION,
+                          frame_option='all', vertex_format=vertex_format, **settings)
+
+
+def test_parallel_export_is_identical(addon, preset, tmp_path):
+    animated_scene()
+    export(addon, preset, str(tmp_path / "serial"))
+    for workers in (2, 3):
+        directory = str(tmp_path / "workers{}".format(workers))
+        export(addon, preset, directory, workers=workers)
+        files = os.listdir(tmp_path / "serial")
+        match, mismatch, errors = filecmp.cmpfiles(tmp_path / "serial", directory, files, shallow=False)
+        assert not mismatch and not errors
+        assert sorted(os.listdir(directory)) == sorted(files)
@@ -0,0 +1,17 @@
+from bench_export import (
+    COLLECTION,
+    scene_grid,
+)
+
+
+def test_profile_summary_is_reported(addon, preset, tmp_path, capsys):
+    scene_grid(100)
+    addon.headless.export(preset("passthrough"), str(tmp_path / "quiet.vbx"), COLLECTION, profile=True)
+    assert capsys.readouterr().out == ""
+
+    reports = []
+    addon.headless.export(preset("passthrough"), str(tmp_path / "out.vbx"), COLLECTION, profile=True,
+                          report=lambda type, message: reports.append((type, message)))
+    assert len(reports) == 1
+    assert reports[0][0] == {'INFO'}
+    assert reports[0][1].startswith("Export profile")
@@ -0,0 +1,60 @@
+from struct import iter_unpack
+
+import bpy
+import pytest
+from bench_export import (
+    COLLECTION,
+    add_object,
+    grid_mesh,
+    reset_scene,
+)
+
+BASE_COLOR = (0.25, 0.5, 0.75, 1.0)
+
+
+def material_scene():
+    collection = reset_scene()
+    mat = bpy.data.materials.new("Material")
+    mat.use_nodes = True
+    nodes = mat.node_tree.nodes
+    nodes["Principled BSDF"].inputs["Base Color"].default_value = BASE_COLOR
+    nodes.remove(nodes["Material Output"])      # The last node in the tree wins, it has no Base Color
+    m = grid_mesh("Grid", 2)
+    m.materials.append(mat)
+    add_object(collection, "Grid", m)
+
+
+def export(addon, preset, path, fmt, func='none', **settings):
+    vertex_format = addon.headless.VertexFormat()
+    attribute = vertex_format.add()
+    attribute.data_source, attribute.data_property, attribute.fmt, attribute.func = 'ShaderNode', 'Base Color', fmt, func
+    addon.headless.export(preset("passthrough"), path, COLLECTION, vertex_format=vertex_format, **settings)
+    with open(path, "rb") as f:
+        return list(iter_unpack("=" + fmt, f.read()))
+
+
+def test_input_names(addon):
+    addon.init_shader_node_props()
+    items = {item[0]: item for item in addon.supported_shader_node_properties}
+    assert items["Base Color"][1] == "Base Color"
+    assert "ShaderNodeBsdfPrincipled" in items["Base Color"][2]
+
+
+def test_rgba_input_format(addon):
+    addon.init_shader_node_props()
+    assert addon.shader_input_types["Base Color"] == 'RGBA'
+    assert addon.SHADER_INPUT_FMT['RGBA'] == 'ffff'
+
+
+@pytest.mark.parametrize("engine", ['loop', 'vectorized'])
+def test_export_rgba_input(addon, preset, tmp_path, engine):
+    material_scene()
+    records = export(addon, preset, str(tmp_path / "out.vbx"), addon.SHADER_INPUT_FMT['RGBA'], engine=engine)
+    assert len(records) == 6
+    assert all(record == BASE_COLOR for record in records)
+
+
+def test_export_rgba_input_as_bytes(addon, preset, tmp_path):
+    material_scene()
+    records = export(addon, preset, str(tmp_path / "out.vbx"), 'BBBB', 'unorm8')
+    assert all(record == (64, 128, 191, 255) for record in records)
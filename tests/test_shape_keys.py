@@ -0,0 +1,81 @@
+import json
+import os
+
+import bpy
+import numpy as np
+import pytest
+from bench_export import (
+    COLLECTION,
+    add_object,
+    grid_mesh,
+    reset_scene,
+)
+
+# Offset of every vertex in each shape key, as a function of its basis position
+KEYS = {
+    "Up": lambda co: co * [0, 0, 0] + [0, 0, 1],
+    "Wave": lambda co: np.column_stack((np.zeros(len(co)), np.zeros(len(co)), np.sin(co[:, 0] * 3))),
+    "Squash": lambda co: co * [0.5, -0.25, 0],
+}
+
+
+def shape_key_scene():
+    collection = reset_scene()
+    obj = add_object(collection, "Face", grid_mesh("Face", 128), (1, 2, 3))
+    obj.shape_key_add(name="Basis")
+    basis = np.array([v.co[:] for v in obj.data.vertices])
+    for name, offset in KEYS.items():
+        block = obj.shape_key_add(name=name)
+        block.data.foreach_set('co', (basis + offset(basis)).astype(np.float32).ravel())
+        block.value = 0.0       # The vertex buffer gets the basis
+    return obj
+
+
+def export(addon, preset, directory, **settings):
+    vertex_format = addon.headless.VertexFormat()
+    for source, prop, fmt in (('MeshVertex', 'co', 'fff'), ('MeshUVLoop', 'uv', 'ff')):
+        attribute = vertex_format.add()
+        attribute.data_source, attribute.data_property, attribute.fmt = source, prop, fmt
+    path = os.path.join(directory, "out.vbx")
+    addon.headless.export(preset("passthrough"), path, COLLECTION, vertex_format=vertex_format,
+                          export_json_data=True, apply_transforms=False, **settings)
+    with open(os.path.join(directory, "out.json")) as f_desc:
+        ranges = json.load(f_desc)["blmod"]["mesh_data"]["ranges"]["Face"]
+    block = ranges["shape_keys"]
+    with open(os.path.join(directory, block["location"]), "rb") as f:     # The file with the object's frames
+        data = f.read()
+
+    records = np.frombuffer(data, dtype=np.float32, count=ranges["no_verts"] * 5, offset=ranges["offset"])
+    positions = records.reshape(-1, 5)[:, :3].astype(np.float64)
+    targets = {key["name"]: np.frombuffer(data, dtype=np.float32, count=ranges["no_verts"] * 3,
+                                          offset=key["offset"]).reshape(-1, 3) for key in block["keys"]}
+    return positions, targets, block
+
+
+@pytest.mark.parametrize("settings", [
+    {},
+    {'index_buffer': 'auto'},
+    {'index_buffer': 'auto', 'optimize_order': True},
+    {'optimize_order': True, 'group_by_material': True},
+    {'batch_mode': 'perobj', 'index_buffer': 'auto'},
+])
+@pytest.mark.parametrize("mode", ['absolute', 'relative'])
+def test_targets_follow_the_vertices(addon, preset, tmp_path, mode, settings):
+    shape_key_scene()
+    positions, targets, block = export(addon, preset, str(tmp_path), shape_keys=mode, **settings)
+
+    assert block["mode"] == mode and block["fmt"] == 'fff'
+    assert list(targets) == (["Basis"] if mode == 'absolute' else []) + list(KEYS)
+    for name, offset in KEYS.items():
+        expected = offset(positions) + (positions if mode == 'absolute' else 0)
+        np.testing.assert_allclose(targets[name], expected, atol=1e-5)
+    if mode == 'absolute':
+        np.testing.assert_allclose(targets["Basis"], positions, atol=1e-6)
+
+
+def test_timeline_is_untouched(addon, preset, tmp_path):
+    shape_key_scene()
+    scene = bpy.context.scene
+    scene.frame_set(7)
+    export(addon, preset, str(tmp_path), shape_keys='relative')
+    assert scene.frame_current == 7
@@ -0,0 +1,59 @@
+import os
+
+import bpy
+import numpy as np
+from bench_export import (
+    COLLECTION,
+    add_object,
+    grid_mesh,
+    reset_scene,
+)
+
+IMAGE_NAMES = ["wood.jpg", "foo", "foo.png"]
+
+
+def texture_scene():
+    collection = reset_scene()
+    m = grid_mesh("Grid", 2)
+    for i, name in enumerate(IMAGE_NAMES):
+        image = bpy.data.images.new(name, 4, 4)
+        image.pixels.foreach_set(np.linspace(0, 1, 64, dtype=np.float32) * (i + 1) / len(IMAGE_NAMES))
+        mat = bpy.data.materials.new(name)
+        mat.use_nodes = True
+        node = mat.node_tree.nodes.new('ShaderNodeTexImage')
+        node.image = image
+        m.materials.append(mat)
+    add_object(collection, "Grid", m)
+
+
+def export(addon, preset, directory):
+    addon.headless.export(preset("passthrough"), os.path.join(directory, "out.vbx"), COLLECTION, export_images=True)
+    return {name: os.stat(os.path.join(directory, name)).st_mtime_ns for name in IMAGE_NAMES}
+
+
+def read(path):
+    with open(path, "rb") as f:
+        return f.read()
+
+
+def test_export_images(addon, preset, tmp_path):
+    texture_scene()
+    export(addon, preset, str(tmp_path))
+    for name in IMAGE_NAMES:
+        reference = str(tmp_path / "reference")
+        bpy.data.images[name].save_render(reference, scene=bpy.context.scene)
+        assert read(str(tmp_path / name)) == read(reference)
+
+
+def test_export_changed_images(addon, preset, tmp_path):
+    texture_scene()
+    written = export(addon, preset, str(tmp_path))
+    assert export(addon, preset, str(tmp_path)) == written
+
+    bpy.data.images["foo"].pixels[0] = 0.5
+    again = export(addon, preset, str(tmp_path))
+    assert again["foo"] != written["foo"]
+    assert again["wood.jpg"] == written["wood.jpg"]
+
+    bpy.context.scene.view_settings.view_transform = 'Standard'
+    assert all(again[name] != mtime for name, mtime in export(addon, preset, str(tmp_path)).items())
@@ -0,0 +1,43 @@
+from importlib import import_module
+from struct import calcsize, pack
+
+import bpy
+import pytest
+from bench_export import (
+    COLLECTION,
+    add_object,
+    reset_scene,
+)
+
+
+def test_expand_native_sizes(addon):
+    vertex_format = import_module(addon.__name__ + ".vertex_format")
+    for fmt in ('l', 'L', 'n', 'N', 'P', 'bl', 'Bn', 'hP'):
+        expanded = vertex_format.expand_format(fmt)
+        assert calcsize("=" + expanded) == calcsize(fmt)
+    with pytest.raises(ValueError, match="Format '3f'"):
+        vertex_format.expand_format('3f')
+
+
+def test_compiled_formats_are_bounded(addon):
+    vertex_format = import_module(addon.__name__ + ".vertex_format")
+    for i in range(vertex_format.COMPILED_FORMATS_MAX * 2):
+        vertex_format.compile_format([('MeshVertex', 'co', 'fff', 0, None, str(i))])
+    assert vertex_format._compile_format.cache_info().currsize <= vertex_format.COMPILED_FORMATS_MAX
+
+
+@pytest.mark.parametrize("engine", ['loop', 'vectorized'])
+def test_export_native_sizes(addon, preset, tmp_path, engine):
+    collection = reset_scene()
+    m = bpy.data.meshes.new("Triangle")
+    m.from_pydata([(0, 0, 0), (1, 0, 0), (0, 1, 0)], [], [(0, 1, 2)])
+    add_object(collection, "Triangle", m)
+
+    vertex_format = addon.headless.VertexFormat()
+    for data_property, fmt in (('index', 'b'), ('index', 'l'), ('index', 'N')):
+        attribute = vertex_format.add()
+        attribute.data_source, attribute.data_property, attribute.fmt = 'MeshVertex', data_property, fmt
+    path = str(tmp_path / "out.vbx")
+    addon.headless.export(preset("passthrough"), path, COLLECTION, vertex_format=vertex_format, engine=engine)
+    with open(path, "rb") as f:
+        assert f.read() == b"".join(pack('b', i) + pack('l', i) + pack('N', i) for i in range(3))
@@ -0,0 +1,173 @@
+# Texture export
+#
+# Writes the images of the image texture nodes of materials (including the
+# ones in node groups) with Image.save_render, like before: to the image's
+# name in the directory, in the scene's output file format and with the
+# scene's color management. An image is written once, however many materials
+# or nodes use it.
+#
+# Images that didn't change since the last export aren't written again. The
+# pixels are read in the main thread (bpy isn't thread-safe) and hashed in a
+# pool of threads (numpy and hashlib release the GIL), the hashes are stored
+# in a file in the directory (MANIFEST_NAME), together with the settings that
+# affect the result. save_render itself has to run in the main thread.
+#
+
+import hashlib
+import json
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+# The hashes of the images written to a directory
+MANIFEST_NAME = ".vbx_textures.json"
+MANIFEST_VERSION = 1
+
+
+def image_nodes(ntree, visited=None):
+    """Yield the image texture nodes in the node tree and the node groups it uses"""
+    visited = set() if visited is None else visited
+    visited.add(ntree.as_pointer())
+    for node in ntree.nodes:
+        if node.type == 'TEX_IMAGE':
+            yield node
+        elif node.type == 'GROUP' and node.node_tree and node.node_tree.as_pointer() not in visited:
+            yield from image_nodes(node.node_tree, visited)
+
+
+def material_images(materials):
+    """Return a dict of material -> list of the images it uses, without duplicates"""
+    result = {}
+    for mat in materials:
+        if not mat.use_nodes or not mat.node_tree:
+            continue
+        images = [node.image for node in image_nodes(mat.node_tree) if node.image]
+        result[mat] = list(dict.fromkeys(images))
+    return result
+
+
+def texture_paths(directory, images):
+    """Return a dict of image -> path of its file, the image's name in the directory
+
+    Images of different libraries can have the same name, those get a number
+    added. Names that only differ in case count as the same, for file systems
+    that ignore case.
+    """
+    paths, used = {}, set()
+    for image in images:
+        root, ext = os.path.splitext(image.name)
+        name, number = image.name, 1
+        while name.lower() in used:
+            number += 1
+            name = "{}_{}{}".format(root, number, ext)
+        used.add(name.lower())
+        paths[image] = os.path.join(directory, name)
+    return paths
+
+
+def rna_values(struct):
+    """Return the values of the simple properties of an RNA struct, e.g. the scene's view settings"""
+    values = {}
+    for prop in struct.bl_rna.properties:
+        if prop.type in ('POINTER', 'COLLECTION') or prop.identifier == 'rna_type':
+            continue
+        value = getattr(struct, prop.identifier)
+        values[prop.identifier] = sorted(value) if isinstance(value, set) else value if isinstance(value, (bool, int, float, str)) else list(value)
+    return values
+
+
+def output_settings(scene):
+    """Return the settings of the scene that affect what save_render writes,
+    None if they can't be compared (curve mapping)"""
+    image_settings = scene.render.image_settings
+    structs = [scene.view_settings, scene.display_settings, image_settings]
+    structs += [getattr(image_settings, name) for name in ('view_settings', 'display_settings') if hasattr(image_settings, name)]
+    if any(getattr(struct, 'use_curve_mapping', False) for struct in structs):
+        return None
+    return [rna_values(struct) for struct in structs]
+
+
+def image_hash(pixels, image_key):
+    """Return the hash of the pixels (as read from Image.pixels) and the other
+    data the written file depends on"""
+    digest = hashlib.blake2b(pixels.tobytes())
+    digest.update(image_key.encode())
+    return digest.hexdigest()
+
+
+def read_manifest(directory):
+    """Return the file name -> entry dict of the images written to the directory before"""
+    try:
+        with open(os.path.join(directory, MANIFEST_NAME)) as f:
+            manifest = json.load(f)
+        if manifest.get("version") == MANIFEST_VERSION:
+            return manifest["images"]
+    except (OSError, ValueError, KeyError, AttributeError):
+        pass
+    return {}
+
+
+def write_manifest(directory, images):
+    path = os.path.join(directory, MANIFEST_NAME)
+    try:
+        temp_path = path + ".tmp"
+        with open(temp_path, "w") as f:
+            json.dump({"version":MANIFEST_VERSION, "images":images}, f, separators=(",", ":"))
+        os.replace(temp_path, path)
+    except OSError:
+        pass    # The images are written again next time
+
+
+def file_state(path):
+    """Return what's compared to find out if the file was changed or removed since it was written"""
+    try:
+        stat = os.stat(path)
+    except OSError:
+        return None
+    return [stat.st_size, stat.st_mtime_ns]
+
+
+def export_textures(materials, directory, scene, profiler, workers=None):
+    """Write the images of the materials to the directory
+
+    Returns a dict of material name -> list of the paths of its images
+    """
+    images_per_material = material_images(materials)
+    images = list(dict.fromkeys(image for images in images_per_material.values() for image in images))
+    images = [image for image in images if image.size[0] and image.size[1]]     # Not e.g. a missing file
+    paths = texture_paths(directory, images)
+
+    settings = output_settings(scene)
+    manifest = read_manifest(directory) if settings is not None else {}
+    written = {}
+    with ThreadPoolExecutor(workers) as pool:
+        jobs = []
+        for image in images:
+            if settings is None:
+                jobs.append((image, None))
+                continue
+            with profiler.stage('images'):
+                width, height = image.size
+                pixels = np.empty(width * height * image.channels, np.float32)
+                image.pixels.foreach_get(pixels)
+            image_key = json.dumps([width, height, image.channels, image.is_float,
+                                    image.colorspace_settings.name, image.alpha_mode, settings])
+            jobs.append((image, pool.submit(image_hash, pixels, image_key)))
+
+        for image, job in jobs:
+            path = paths[image]
+            name = os.path.basename(path)
+            with profiler.stage('images'):
+                digest = job.result() if job else None
+                entry = manifest.get(name)
+                if digest is None or entry is None or entry["hash"] != digest or entry["file"] != file_state(path):
+                    image.save_render(path, scene=scene)
+                if digest is not None:
+                    written[name] = {"hash":digest, "file":file_state(path)}
+
+    if settings is not None:
+        write_manifest(directory, dict(manifest, **written))
+
+    return {mat.name: [paths[image] for image in images if image in paths]
+            for mat, images in images_per_material.items()}
@@ -0,0 +1,206 @@
+# Vectorized export engine
+#
+# Reads complete attribute columns from the mesh using foreach_get,
+# gathers them in export (corner) order and writes them to the vertex records
+# through a structured array whose layout is the one created by construct_ds.
+#
+# Attributes that can't be written this way (e.g. conversion functions
+# without an array form) are written by the per loop traversal.
+#
+
+import bpy
+import numpy as np
+from . import array_forms
+from .attributes import (
+    ATTRIBUTE_SOURCE,
+    read_attribute,
+    )
+from .export_gms_vtx_buffer import write_mesh_ba as write_mesh_ba_per_loop
+from .profiling import NO_PROFILER
+
+# Maps RNA property type to the data type foreach_get expects
+RNA_DTYPE = {
+    'FLOAT': np.float32,
+    'INT': np.int32,
+    'BOOLEAN': np.bool_,
+}
+
+# Maps binary type code to the numpy data type that it's written as
+# (native byte order, just like pack() without a prefix)
+FMT_DTYPE = {
+    'f': np.dtype('=f4'),
+    'B': np.dtype('=u1'),
+    '?': np.dtype('=?'),
+    'i': np.dtype('=i4'),
+    'I': np.dtype('=u4'),
+    'b': np.dtype('=i1'),
+    'h': np.dtype('=i2'),
+    'H': np.dtype('=u2'),
+    'e': np.dtype('=f2'),
+}
+
+
+def corner_indices(m, reverse_loop):
+    """Return the loop, vertex and polygon index of every corner in the order
+    that corners are written, or None if the mesh doesn't consist of triangles only"""
+    no_polys = len(m.polygons)
+    loop_total = np.empty(no_polys, dtype=np.int32)
+    m.polygons.foreach_get('loop_total', loop_total)
+    if np.any(loop_total != 3):
+        return None
+
+    loop_start = np.empty(no_polys, dtype=np.int32)
+    m.polygons.foreach_get('loop_start', loop_start)
+    order = np.array([2, 1, 0] if reverse_loop else [0, 1, 2], dtype=np.int32)
+    loops = (loop_start[:, np.newaxis] + order).ravel()
+
+    loop_vertex = np.empty(len(m.loops), dtype=np.int32)
+    m.loops.foreach_get('vertex_index', loop_vertex)
+
+    return loops, loop_vertex[loops], np.repeat(np.arange(no_polys), 3)
+
+
+def mesh_sources(m, loops, vertices, polygons):
+    """Map each source that can be vectorized to its collection and per corner index
+
+    Sources that the mesh doesn't have (e.g. no UV map) map to None
+    """
+    uv_layer = m.uv_layers.active if m.uv_layers else None
+    vtx_colors = m.vertex_colors.active
+    return {
+        'MeshVertex': (m.vertices, vertices),
+        'MeshLoop': (m.loops, loops),
+        'MeshPolygon': (m.polygons, polygons),
+        'MeshUVLoop': (uv_layer.data, loops) if uv_layer else None,
+        'MeshLoopColor': (vtx_colors.data, loops) if vtx_colors else None,
+        ATTRIBUTE_SOURCE: (m, loops),       # Any layer in m.attributes, by name
+    }
+
+
+def read_column(collection, source, prop, index):
+    """Read a property of all items in the collection and gather it per corner
+
+    Returns None if the property can't be read with foreach_get
+    """
+    if source == ATTRIBUTE_SOURCE:
+        values = read_attribute(collection, prop)
+        return None if values is None else values[index]
+
+    prop_rna = getattr(bpy.types, source).bl_rna.properties.get(prop)
+    if prop_rna is None or prop_rna.type not in RNA_DTYPE:
+        return None
+
+    width = prop_rna.array_length if prop_rna.is_array else 1
+    if width == 0 or prop_rna.is_array and prop_rna.array_dimensions[1] != 0:
+        return None     # Dynamic and multidimensional arrays (e.g. matrices)
+
+    values = np.empty(len(collection) * width, dtype=RNA_DTYPE[prop_rna.type])
+    collection.foreach_get(prop, values)
+    if prop_rna.is_array:
+        values = values.reshape(-1, width)
+    values = values[index]
+
+    # Continue with the types that Python itself would use
+    return values.astype(np.float64 if values.dtype.kind == 'f' else np.int64)
+
+
+def cast_to_format(values, fmt):
+    """Cast the values to the data type that pack(fmt, ...) would write
+
+    Returns None whenever the result could differ from what pack() does
+    (mixed formats, wrong number of values, values out of range, ...).
+    The per loop traversal then handles the attribute, errors included.
+    """
+    char = fmt[:1]
+    if char not in FMT_DTYPE or fmt != char * len(fmt):
+        return None
+
+    if len(fmt) == 1:
+        if values.ndim != 1:
+            return None
+    else:
+        if values.ndim != 2 or values.shape[1] < len(fmt):
+            return None
+        values = values[:, :len(fmt)]
+
+    dtype = FMT_DTYPE[char]
+    if dtype.kind in 'iu':
+        if values.dtype.kind == 'f':
+            return None     # pack() refuses floats for integer types
+        info = np.iinfo(dtype)
+        if values.size and (values.min() < info.min or values.max() > info.max):
+            return None
+    result = values.astype(dtype)
+    if dtype.kind == 'f' and np.any(np.isinf(result) & np.isfinite(values)):
+        return None         # Overflow
+    return result
+
+
+def convert(values, fmt, func, args, ctx):
+    """Apply the conversion function's array form and cast to the format"""
+    if func != None:
+        try:
+            values = array_forms.apply(func, values, ctx, args)
+        except (ValueError, IndexError, TypeError, KeyError):
+            return None
+        if values is None:
+            return None     # No array form
+        values = np.asarray(values)
+    return cast_to_format(values, fmt)
+
+
+def write_mesh_ba(scene, obj, m, compiled, ba, reverse_loop, profiler=NO_PROFILER):
+    """Vectorized counterpart of write_mesh_ba in export_gms_vtx_buffer
+
+    Writes the exact same bytes to ba
+    """
+    with profiler.stage('read', obj):
+        corners = corner_indices(m, reverse_loop)
+    if corners is None:
+        write_mesh_ba_per_loop(scene, obj, m, compiled, ba, reverse_loop, profiler)
+        return
+    sources = mesh_sources(m, *corners)
+
+    # Array forms get the values that are the same for all vertices
+    ctx = {'scene': scene, 'object': obj}
+
+    # Fill in the structured array's fields, keep track of everything that remains
+    columns = {}
+    fields = {'names': [], 'formats': [], 'offsets': [], 'itemsize': compiled.stride}
+    values_per_field = []
+    remaining = []
+    for source, prop, occurrence in compiled.occurrences():
+        offset, attr_blen, fmt, index, func, args = occurrence
+        if source in sources and sources[source] is None:
+            continue        # Not on this mesh, so nothing gets written
+
+        values = None
+        if source in sources:
+            key = (source, prop)
+            if key not in columns:
+                collection, corner_index = sources[source]
+                with profiler.stage('read', obj):
+                    columns[key] = read_column(collection, source, prop, corner_index)
+            if columns[key] is not None:
+                with profiler.stage('convert', obj):
+                    values = convert(columns[key], fmt, func, args, ctx)
+
+        if values is None:
+            remaining.append((source, prop, offset))
+            continue
+
+        fields['names'].append("attr{}".format(len(values_per_field)))
+        fields['formats'].append(values.dtype if values.ndim == 1 else (values.dtype, values.shape[1:]))
+        fields['offsets'].append(offset)
+        values_per_field.append(values)
+
+    # The per loop traversal writes full vertex records, so it goes first
+    if remaining:
+        with profiler.stage('per_loop', obj):
+            write_mesh_ba_per_loop(scene, obj, m, compiled.subset(remaining), ba, reverse_loop, profiler)
+
+    if values_per_field:
+        with profiler.stage('store', obj):
+            records = np.frombuffer(ba, dtype=np.dtype(fields))
+            for name, values in zip(fields['names'], values_per_field):
+                records[name] = values
@@ -0,0 +1,152 @@
+# Compiled vertex formats
+#
+# A vertex format is compiled once and reused for every object and frame
+# (and for later exports with the same format): the custom arguments of
+# conversion functions are parsed and bound to the function, and all
+# attributes that are looked up per loop are merged into a single Struct,
+# so that writing a vertex record takes a single call to pack_into.
+#
+
+import json
+from functools import (
+    lru_cache,
+    partial,
+    )
+from struct import (
+    Struct,
+    calcsize,
+    error,
+    )
+
+# Sources that have the same value for all vertices of an object
+# (Material and ShaderNode per material slot) within a single frame
+CONSTANT_SOURCES = {'Scene', 'Object', 'Material', 'ShaderNode'}
+
+# Sources that are looked up for every loop
+LOOP_SOURCES = ('MeshPolygon', 'MeshLoop', 'MeshUVLoop', 'MeshLoopColor', 'MeshVertex', 'Attribute')
+
+# Number of compiled formats that are kept for later exports
+COMPILED_FORMATS_MAX = 16
+
+# Fixed size integer format characters by size, for the ones with a native size
+FIXED_SIZE_INTS = {1: 'b', 2: 'h', 4: 'i', 8: 'q'}
+
+
+def construct_ds(obj, attr):
+    """ Constructs the data structure required to move through the attributes of a given object
+
+    A conversion function with custom arguments is bound to its parsed arguments
+    """
+    description, offset = {}, 0
+    for a in attr:
+        ident, atn, format, fo, func, args = a
+
+        if ident not in description:
+            description[ident] = {}
+        dct_obj = description[ident]
+
+        if atn not in dct_obj:
+            dct_obj[atn] = []
+        lst_attr = dct_obj[atn]
+
+        attrib_bytesize = calcsize(format)
+
+        args = json.loads(args) if func != None and args != "" else None
+        if args is not None:
+            func = partial(func, args=args)
+
+        lst_attr.append((offset, attrib_bytesize, format, fo, func, args))
+        offset += attrib_bytesize
+
+    return (description, offset)
+
+
+def expand_format(fmt):
+    """Return the format with the padding that native alignment adds written out,
+    so that it can be merged with other formats
+
+    Integers with a native size (e.g. 'l', 'N') are replaced by the fixed size
+    integer of the same size, so the result packs the same bytes as pack(fmt)
+    """
+    expanded, size = "", 0
+    for char in fmt:
+        try:
+            char_size = calcsize(char)
+            standard_size = calcsize("=" + char) if char not in 'nNP' else None
+        except error:
+            raise ValueError("Format '{}' can't be written, '{}' isn't a format character".format(fmt, char)) from None
+        if standard_size != char_size:
+            if char not in 'lLnNP' or char_size not in FIXED_SIZE_INTS:
+                raise ValueError("Format '{}' can't be written, '{}' has no fixed size".format(fmt, char))
+            fixed = FIXED_SIZE_INTS[char_size]
+            char = fixed.upper() if char in 'LNP' else fixed
+        padding = -size % char_size
+        expanded += "x" * padding + char
+        size += padding + char_size
+    return expanded
+
+
+class CompiledFormat:
+    """A vertex format that's ready to write vertex records"""
+
+    def __init__(self, desc):
+        self.desc = desc
+        self.description, self.stride = desc
+        self.has_constants = any(id in CONSTANT_SOURCES for id in self.description)
+        self._writers = {}
+        self._subsets = {}
+
+    def occurrences(self):
+        """Iterate over all attributes as (source, property, occurrence) tuples"""
+        for source, props in self.description.items():
+            for prop, occurrences in props.items():
+                for occurrence in occurrences:
+                    yield source, prop, occurrence
+
+    def subset(self, keys):
+        """Return the compiled format that only contains the given attributes
+
+        keys is a collection of (source, property, offset) tuples
+        """
+        keys = frozenset(keys)
+        if keys not in self._subsets:
+            description = {}
+            for source, prop, occurrence in self.occurrences():
+                if (source, prop, occurrence[0]) in keys:
+                    description.setdefault(source, {}).setdefault(prop, []).append(occurrence)
+            self._subsets[keys] = CompiledFormat((description, self.stride))
+        return self._subsets[keys]
+
+    def writer(self, sources):
+        """Return a Struct that packs a full vertex record and the matching list of getters
+
+        The Struct contains the attributes of the given per loop sources,
+        in the order of the getters, which are (source, property, count, func) tuples.
+        All other bytes of the vertex record are written as padding (zeros).
+        """
+        key = frozenset(sources)
+        if key not in self._writers:
+            fields = sorted(((occurrence, source, prop) for source, prop, occurrence in self.occurrences()
+                             if source in key), key=lambda field: field[0][0])
+            fmt, getters, pos = "=", [], 0
+            for (offset, attr_blen, attr_fmt, index, func, args), source, prop in fields:
+                fmt += "x" * (offset - pos) + expand_format(attr_fmt)
+                getters.append((source, prop, len(attr_fmt), func))
+                pos = offset + attr_blen
+            fmt += "x" * (self.stride - pos)
+            self._writers[key] = (Struct(fmt), getters)
+        return self._writers[key]
+
+
+def compile_format(attribs):
+    """Return the compiled format for the given list of attributes
+
+    Formats are compiled once, exporting again with the same attributes reuses it
+    (for the COMPILED_FORMATS_MAX formats used last)
+    """
+    return _compile_format(tuple(attribs))
+
+
+@lru_cache(maxsize=COMPILED_FORMATS_MAX)
+def _compile_format(attribs):
+    return CompiledFormat(construct_ds(None, attribs))
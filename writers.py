@@ -0,0 +1,141 @@
+# Streaming output of vertex data
+#
+# Frames are written to the file(s) as soon as they're complete, at offsets
+# that are known in advance. That way only the frame that's being written
+# (plus the frames held back for interpolation offsets) needs to be in memory.
+#
+
+import os
+import threading
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+
+class FrameStream:
+    """Passes an object's frames on to write as soon as they are complete
+
+    Attributes with an interpolation offset of n hold the value of n frames later
+    (the last frames get the values of the first ones), so a frame is held back
+    until the frame it needs is available.
+    """
+
+    def __init__(self, desc, no_frames, write):
+        self.write = write
+        self.no_frames = no_frames
+        self.count = 0
+
+        desc, self.vertex_format_bytesize = desc
+        columns = {}
+        for props in desc.values():
+            for occurrences in props.values():
+                for offset, attr_blen, fmt, index, func, args in occurrences:
+                    shift = index % no_frames
+                    if shift:
+                        columns.setdefault(shift, []).extend(range(offset, offset+attr_blen))
+        self.columns = {shift: np.array(cols) for shift, cols in columns.items()}
+        self.lookahead = max(self.columns, default=0)
+
+        self.pending = deque()      # (frame index, bytearray) of frames that are held back
+        self.saved = {}             # Values of the first frames that the last frames need
+
+    def view(self, ba):
+        return np.frombuffer(ba, dtype=np.uint8).reshape(-1, self.vertex_format_bytesize)
+
+    def push(self, ba):
+        """Add the bytearray of the next frame, written with the values at that frame"""
+        index = self.count
+        self.count += 1
+
+        if self.columns:
+            view = self.view(ba)
+            for shift, cols in self.columns.items():
+                if index < shift:
+                    self.saved[shift, index] = view[:, cols]    # Fancy indexing copies
+            for i, pending_ba in self.pending:
+                cols = self.columns.get(index - i)
+                if cols is not None:
+                    self.view(pending_ba)[:, cols] = view[:, cols]
+
+        self.pending.append((index, ba))
+        while self.pending and self.pending[0][0] <= index - self.lookahead:
+            self.write(*self.pending.popleft())
+
+    def close(self):
+        """Complete the frames that are still held back using the first frames"""
+        while self.pending:
+            i, ba = self.pending.popleft()
+            for shift, cols in self.columns.items():
+                if i + shift >= self.no_frames:
+                    self.view(ba)[:, cols] = self.saved[shift, i + shift - self.no_frames]
+            self.write(i, ba)
+
+
+class BatchWriter:
+    """Writes frames to their precomputed position in one or more files
+
+    files is a list of (path, entries) tuples, where entries lists the
+    (key, frame index) pairs stored in the file, in order. All files are
+    preallocated up front. The actual writing happens on a pool of background
+    threads, so the main thread can continue with the next frame meanwhile.
+    """
+
+    def __init__(self, file_mode, files, frame_sizes, max_workers=4, max_pending=8):
+        self.files = files
+        self.locations = {}         # (key, frame index) -> (path, offset)
+        self.remaining = {}         # Number of writes left per file
+        for path, entries in files:
+            directory = os.path.dirname(path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            # Append: existing contents are kept, offsets start at the end
+            mode = 'r+b' if file_mode == 'ab' and os.path.exists(path) else 'w+b'
+            with open(path, mode) as f:
+                pos = f.seek(0, os.SEEK_END)
+                for key, frame_index in entries:
+                    self.locations[key, frame_index] = (path, pos)
+                    pos += frame_sizes[key]
+                f.truncate(pos)
+            self.remaining[path] = len(entries)
+
+        self.handles = {}
+        self.locks = {path: threading.Lock() for path, entries in files}
+        self.pending = threading.BoundedSemaphore(max_pending)    # Limits the frames waiting in memory
+        self.pool = ThreadPoolExecutor(max_workers=max_workers)
+        self.futures = []
+
+    def offset(self, key, frame_index=0):
+        """Return the offset of a frame in the file that contains it"""
+        return self.locations[key, frame_index][1]
+
+    def write(self, key, frame_index, data):
+        """Queue a frame's data to be written to its position"""
+        path, offset = self.locations[key, frame_index]
+        self.pending.acquire()
+        self.futures.append(self.pool.submit(self._write, path, offset, data))
+
+    def _write(self, path, offset, data):
+        try:
+            with self.locks[path]:
+                f = self.handles.get(path)
+                if f is None:
+                    f = self.handles[path] = open(path, 'r+b')
+                f.seek(offset)
+                f.write(data)
+
+                # Close files as soon as they're complete
+                self.remaining[path] -= 1
+                if self.remaining[path] == 0:
+                    self.handles.pop(path).close()
+        finally:
+            self.pending.release()
+
+    def close(self):
+        """Wait for all writes to finish, raises the first error that occurred"""
+        self.pool.shutdown(wait=True)
+        for f in self.handles.values():
+            f.close()
+        self.handles.clear()
+        for future in self.futures:
+            future.result()